@@ -0,0 +1,178 @@
+"""
+Agregaciones numéricas para el dashboard de transbordos.
+
+Funciones puras sobre arrays de NumPy que reducen los datos del día a un
+resumen de tamaño acotado antes de enviarlos al navegador.
+"""
+import numpy as np
+import pandas as pd
+
+# ======================================================
+# DENSIDAD GEOGRÁFICA BINEADA
+# ======================================================
+# Tamaño de celda por defecto en grados (~0.002° ≈ 220 m en Asunción)
+TAMANO_CELDA_GRADOS = 0.002
+# Máximo de celdas a enviar al navegador; si se supera, se engrosa la grilla
+MAX_CELDAS = 20000
+
+
+def binear_densidad(lat, lon, pesos=None, tamano_celda=TAMANO_CELDA_GRADOS, max_celdas=MAX_CELDAS):
+    """
+    Agrega coordenadas en una grilla regular y devuelve solo las celdas con peso.
+
+    Todas las coordenadas válidas entran en la agregación (no hay muestreo),
+    de modo que el mapa representa el día completo. El resultado tiene a lo
+    sumo `max_celdas` filas: si la grilla resulta más densa, se duplica el
+    tamaño de celda hasta cumplir el límite.
+
+    Retorna un DataFrame con columnas `lat`, `lon` (centro de la celda) y `peso`.
+    """
+    lat = np.asarray(lat, dtype=np.float64)
+    lon = np.asarray(lon, dtype=np.float64)
+    w = np.ones(len(lat), dtype=np.float64) if pesos is None else np.asarray(pesos, dtype=np.float64)
+
+    validos = np.isfinite(lat) & np.isfinite(lon) & (lat != 0) & (lon != 0)
+    lat, lon, w = lat[validos], lon[validos], w[validos]
+    if len(lat) == 0:
+        return pd.DataFrame({'lat': [], 'lon': [], 'peso': []})
+
+    lat0, lon0 = lat.min(), lon.min()
+    celda = float(tamano_celda)
+    while True:
+        iy = ((lat - lat0) / celda).astype(np.int64)
+        ix = ((lon - lon0) / celda).astype(np.int64)
+        nx = int(ix.max()) + 1
+        claves = iy * nx + ix
+        # Solo las celdas ocupadas: un bincount sobre el rango completo de claves
+        # reserva memoria para toda la caja envolvente (un GPS erróneo la vuelve enorme)
+        unicas, inversa = np.unique(claves, return_inverse=True)
+        conteo = np.bincount(inversa, weights=w, minlength=len(unicas))
+        con_peso = conteo != 0
+        ocupadas, conteo = unicas[con_peso], conteo[con_peso]
+        if len(ocupadas) <= max_celdas:
+            break
+        celda *= 2
+
+    return pd.DataFrame({
+        'lat': lat0 + (ocupadas // nx + 0.5) * celda,
+        'lon': lon0 + (ocupadas % nx + 0.5) * celda,
+        'peso': conteo,
+    })
+
+
+def centro_ponderado(df_bins):
+    """Centro del mapa a partir de las celdas bineadas (promedio ponderado por peso)"""
+    total = df_bins['peso'].sum()
+    return dict(
+        lat=float((df_bins['lat'] * df_bins['peso']).sum() / total),
+        lon=float((df_bins['lon'] * df_bins['peso']).sum() / total),
+    )
+
+
+# ======================================================
+# HISTOGRAMA DE INTERVALOS (COMBINABLE)
+# ======================================================
+# procesar_fecha anula los intervalos fuera de [0, 120] minutos
+LIMITE_INTERVALO_MIN = 120
+# Resolución interna; los cuantiles se interpolan dentro de bins de este ancho
+ANCHO_BIN_FINO_MIN = 0.5
+# Ancho de las barras que se envían al navegador (48 barras para 0-120 min)
+ANCHO_BIN_VISUAL_MIN = 2.5
+RANGOS_INTERVALO = [0, 15, 30, 60, 90, 120]
+ETIQUETAS_RANGOS = ['0-15 min', '15-30 min', '30-60 min', '60-90 min', '90-120 min']
+
+
+class HistogramaIntervalos:
+    """
+    Conteos en bins fijos más n, suma, mínimo y máximo. Se construye en una sola
+    pasada sobre los valores y dos histogramas (ej. de días distintos) se combinan
+    sumando, así que media, cuantiles, barras y rangos salen del resumen sin volver
+    a los datos. Los bins son (desde, hasta], cerrados a derecha como pd.cut; el 0
+    va al primer bin y además se cuenta en `ceros`, porque pd.cut lo deja fuera de
+    los rangos.
+    """
+
+    def __init__(self, conteos, n, suma, minimo, maximo, ancho=ANCHO_BIN_FINO_MIN, ceros=0):
+        self.conteos = np.asarray(conteos, dtype=np.int64)
+        self.n = int(n)
+        self.suma = float(suma)
+        self.minimo = float(minimo)
+        self.maximo = float(maximo)
+        self.ancho = ancho
+        self.ceros = int(ceros)
+
+    @staticmethod
+    def indice_bin(valores, ancho=ANCHO_BIN_FINO_MIN):
+        """Bin (k·ancho, (k+1)·ancho] de cada valor; el 0 cae en el bin 0"""
+        return np.maximum(np.ceil(np.asarray(valores, dtype=np.float64) / ancho).astype(np.int64) - 1, 0)
+
+    @classmethod
+    def desde_valores(cls, valores, ancho=ANCHO_BIN_FINO_MIN, limite=LIMITE_INTERVALO_MIN):
+        v = np.asarray(valores, dtype=np.float64)
+        v = v[np.isfinite(v)]
+        n_bins = int(round(limite / ancho))
+        if len(v) == 0:
+            return cls(np.zeros(n_bins, dtype=np.int64), 0, 0.0, np.nan, np.nan, ancho)
+        indices = np.minimum(cls.indice_bin(v, ancho), n_bins - 1)
+        return cls(np.bincount(indices, minlength=n_bins), len(v), v.sum(), v.min(), v.max(), ancho,
+                   ceros=np.count_nonzero(v == 0))
+
+    @classmethod
+    def desde_conteos(cls, indices, cantidades, suma, minimo, maximo, ancho=ANCHO_BIN_FINO_MIN,
+                      limite=LIMITE_INTERVALO_MIN, ceros=0):
+        """Desde conteos ya agregados por bin (ej. GROUP BY ceil(intervalo / ancho) - 1 en DuckDB)"""
+        n_bins = int(round(limite / ancho))
+        indices = np.clip(np.asarray(indices, dtype=np.int64), 0, n_bins - 1)
+        conteos = np.bincount(indices, weights=np.asarray(cantidades, dtype=np.float64), minlength=n_bins)
+        conteos = conteos.astype(np.int64)
+        return cls(conteos, conteos.sum(), suma, minimo, maximo, ancho, ceros)
+
+    def combinar(self, otro):
+        if self.n == 0:
+            return otro
+        if otro.n == 0:
+            return self
+        return HistogramaIntervalos(
+            self.conteos + otro.conteos, self.n + otro.n, self.suma + otro.suma,
+            min(self.minimo, otro.minimo), max(self.maximo, otro.maximo), self.ancho,
+            self.ceros + otro.ceros
+        )
+
+    def media(self):
+        return self.suma / self.n if self.n else np.nan
+
+    def cuantil(self, q):
+        """Cuantil interpolado linealmente dentro del bin, acotado a [mínimo, máximo]"""
+        if self.n == 0:
+            return np.nan
+        objetivo = q * self.n
+        acumulado = np.cumsum(self.conteos)
+        i = min(int(np.searchsorted(acumulado, objetivo)), len(self.conteos) - 1)
+        previo = acumulado[i - 1] if i > 0 else 0
+        fraccion = (objetivo - previo) / self.conteos[i] if self.conteos[i] else 0.0
+        return float(np.clip((i + fraccion) * self.ancho, self.minimo, self.maximo))
+
+    def bins(self, ancho=ANCHO_BIN_VISUAL_MIN):
+        """Barras de ancho fijo (incluye las vacías, el tamaño no depende de los datos)"""
+        factor = max(1, int(round(ancho / self.ancho)))
+        conteos = np.pad(self.conteos, (0, -len(self.conteos) % factor)).reshape(-1, factor).sum(axis=1)
+        desde = np.arange(len(conteos)) * factor * self.ancho
+        return pd.DataFrame({
+            'desde_min': desde,
+            'centro_min': desde + factor * self.ancho / 2,
+            'cantidad': conteos,
+        })
+
+    def rangos(self, limites=RANGOS_INTERVALO, etiquetas=ETIQUETAS_RANGOS):
+        """
+        Cantidad por rango (desde, hasta] de minutos, igual que pd.cut: un valor en
+        el límite va al rango que termina en él y el 0 no entra en ninguno. Los
+        límites deben ser múltiplos del ancho de bin.
+        """
+        limites = np.asarray(limites, dtype=np.float64)
+        cortes = np.clip(np.round(limites / self.ancho).astype(np.int64), 0, len(self.conteos))
+        acumulado = np.r_[0, np.cumsum(self.conteos)]
+        cantidad = acumulado[cortes[1:]] - acumulado[cortes[:-1]]
+        # Los ceros comparten el bin 0 con (0, ancho]
+        cantidad = cantidad - np.where(limites[:-1] == 0, self.ceros, 0)
+        return pd.DataFrame({'Rango': etiquetas, 'Cantidad': cantidad})
@@ -0,0 +1,182 @@
+"""
+Almacén de resultados compartido entre sesiones de Streamlit.
+
+Las sesiones guardan solo claves (handles) y leen los DataFrames desde un
+almacén único por proceso, con contabilidad de bytes:
+    - resultados idénticos (misma clave, ej. (fecha, filtro)) se guardan una vez
+    - las entradas frías se comprimen a Arrow IPC con zstd
+    - bajo un techo de memoria configurado se desalojan por LRU
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import pyarrow as pa
+
+# ======================================================
+# CONFIGURACIÓN
+# ======================================================
+LIMITE_BYTES = int(float(os.getenv("TRANSBORDOS_MEM_LIMITE_MB", "4096")) * 1024 * 1024)
+# Fracción del límite a partir de la cual se comprimen las entradas frías
+FRACCION_COMPRESION = 0.75
+# Cantidad de entradas más recientes que nunca se comprimen
+MIN_CALIENTES = 2
+
+
+def _tamano_df(df):
+    return int(df.memory_usage(deep=True, index=True).sum())
+
+
+def _comprimir(df):
+    tabla = pa.Table.from_pandas(df, preserve_index=True)
+    sink = pa.BufferOutputStream()
+    opciones = pa.ipc.IpcWriteOptions(compression="zstd")
+    with pa.ipc.new_stream(sink, tabla.schema, options=opciones) as writer:
+        writer.write_table(tabla)
+    return sink.getvalue()
+
+
+def _descomprimir(buffer):
+    return pa.ipc.open_stream(buffer).read_all().to_pandas()
+
+
+class _Entrada:
+    __slots__ = ("valor", "comprimido", "tipo", "bytes", "meta", "creado")
+
+    def __init__(self, valor, meta):
+        # Objetos que no son DataFrame exponen a_dataframe()/desde_dataframe()
+        self.tipo = None if hasattr(valor, "memory_usage") else type(valor)
+        self.valor = valor
+        self.comprimido = None
+        self.bytes = _tamano_df(self._df())
+        self.meta = meta or {}
+        self.creado = time.time()
+
+    def _df(self):
+        return self.valor if self.tipo is None else self.valor.a_dataframe()
+
+    def comprimir(self):
+        self.comprimido = _comprimir(self._df())
+        self.valor = None
+        self.bytes = self.comprimido.size
+
+    def rehidratar(self):
+        df = _descomprimir(self.comprimido)
+        self.valor = df if self.tipo is None else self.tipo.desde_dataframe(df)
+        self.comprimido = None
+        self.bytes = _tamano_df(self._df())
+
+
+class AlmacenResultados:
+    """Caché LRU de DataFrames con techo de memoria y compresión de entradas frías"""
+
+    def __init__(self, limite_bytes=LIMITE_BYTES):
+        self.limite_bytes = limite_bytes
+        self._entradas = OrderedDict()
+        self._lock = threading.RLock()
+        self.estadisticas = {"aciertos": 0, "fallos": 0, "compresiones": 0, "desalojos": 0}
+
+    def guardar(self, clave, valor, meta=None):
+        """Guarda (o reemplaza) el valor bajo la clave y devuelve la clave como handle"""
+        entrada = _Entrada(valor, meta)
+        with self._lock:
+            self._entradas.pop(clave, None)
+            self._entradas[clave] = entrada
+            self._ajustar()
+        return clave
+
+    def obtener(self, clave):
+        """Valor asociado a la clave, o None si nunca existió o fue desalojado"""
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is None:
+                self.estadisticas["fallos"] += 1
+                return None
+            self._entradas.move_to_end(clave)
+            if entrada.comprimido is not None:
+                entrada.rehidratar()
+                self._ajustar()
+            self.estadisticas["aciertos"] += 1
+            return entrada.valor
+
+    def obtener_o_calcular(self, clave, calcular, meta=None):
+        """Deduplica resultados derivados: solo se calculan si no están en el almacén"""
+        valor = self.obtener(clave)
+        if valor is None:
+            valor = calcular()
+            self.guardar(clave, valor, meta)
+        return valor
+
+    def meta(self, clave):
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            return dict(entrada.meta) if entrada is not None else None
+
+    def actualizar_meta(self, clave, **meta):
+        """Actualiza metadatos sin reemplazar el valor (ej. un refresco sin filas nuevas)"""
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is not None:
+                entrada.meta.update(meta)
+
+    def contiene(self, clave):
+        with self._lock:
+            return clave in self._entradas
+
+    def eliminar(self, clave):
+        with self._lock:
+            self._entradas.pop(clave, None)
+
+    def bytes_totales(self):
+        with self._lock:
+            return sum(e.bytes for e in self._entradas.values())
+
+    def resumen(self):
+        """Estado del almacén para diagnóstico (una fila por entrada, de más fría a más reciente)"""
+        with self._lock:
+            return [
+                {
+                    "clave": str(clave),
+                    "comprimido": entrada.comprimido is not None,
+                    "MB": round(entrada.bytes / 1024 / 1024, 2),
+                    "creado": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(entrada.creado)),
+                }
+                for clave, entrada in self._entradas.items()
+            ]
+
+    def _ajustar(self):
+        total = sum(e.bytes for e in self._entradas.values())
+        umbral_compresion = self.limite_bytes * FRACCION_COMPRESION
+        claves = list(self._entradas.keys())
+
+        # 1) Comprimir entradas frías (de la menos a la más reciente)
+        for clave in claves[:-MIN_CALIENTES]:
+            if total <= umbral_compresion:
+                break
+            entrada = self._entradas[clave]
+            if entrada.comprimido is None:
+                antes = entrada.bytes
+                entrada.comprimir()
+                total -= antes - entrada.bytes
+                self.estadisticas["compresiones"] += 1
+
+        # 2) Desalojar por LRU si aún se supera el techo (se conserva siempre la más reciente)
+        for clave in claves[:-1]:
+            if total <= self.limite_bytes:
+                break
+            total -= self._entradas.pop(clave).bytes
+            self.estadisticas["desalojos"] += 1
+
+
+_almacen = None
+_almacen_lock = threading.Lock()
+
+
+def almacen_global():
+    """Instancia única por proceso, compartida por todas las sesiones"""
+    global _almacen
+    with _almacen_lock:
+        if _almacen is None:
+            _almacen = AlmacenResultados()
+        return _almacen
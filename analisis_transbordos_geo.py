@@ -1,13 +1,15 @@
 import streamlit as st
-import psycopg2
 import pandas as pd
-from datetime import datetime, timedelta
-import plotly.express as px
+from datetime import date, datetime, timedelta
 import os
 from dotenv import load_dotenv
 import numpy as np
-import folium
-from streamlit_folium import st_folium
+from concurrent.futures import ThreadPoolExecutor
+from almacen_resultados import almacen_global
+from conexiones_db import conexion, leer_preparada, obtener_pool
+from geocerca import IndiceGrilla
+from periodos import asignar_periodos, dias_de_periodos, tramos_faltantes
+# folium, shapely (geocerca.py) y plotly se importan recién al mostrar datos cargados
 
 # Cargar variables de entorno
 load_dotenv()
@@ -27,14 +29,7 @@ st.markdown("---")
 # ======================================================
 # CONEXIONES
 # ======================================================
-DB_TRANSACCIONES = {
-    "host": os.getenv("DB_TRANSACCIONES_HOST", "replicatransacciones.vmt.gov.py"),
-    "port": os.getenv("DB_TRANSACCIONES_PORT", "5435"),
-    "dbname": os.getenv("DB_TRANSACCIONES_NAME", "transacciones"),
-    "user": os.getenv("DB_TRANSACCIONES_USER", "devmt"),
-    "password": os.getenv("DB_TRANSACCIONES_PASS", "FootgearBlinkedDigFreewillStricken"),
-    "options": "-c statement_timeout=0"
-}
+# Configuración y conexiones instrumentadas en conexiones_db.py
 
 # ======================================================
 # LÓGICA DE DATOS Y DISTANCIA
@@ -49,94 +44,206 @@ def haversine_distance(lat1, lon1, lat2, lon2):
     a = np.sin(dphi / 2)**2 + np.cos(phi1) * np.cos(phi2) * np.sin(dlambda / 2)**2
     return 2 * R * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
 
+QUERY_VALIDACIONES = """
+SELECT 
+    fechahoraevento,
+    latitude,
+    longitude,
+    idrutaestacion,
+    serialmediopago,
+    montoevento
+FROM c_transacciones
+WHERE fechahoraevento >= $1
+  AND fechahoraevento < $2
+  AND idrutaestacion = ANY($3)
+  AND tipoevento IN (4, 8)
+  AND idproducto IN ('4d4f')
+  AND (fechahoraevento::time >= '05:00:00' AND fechahoraevento::time <= '22:59:59')
+  AND latitude IS NOT NULL 
+  AND latitude != 0 
+"""
+
+def leer_validaciones(inicio, fin, rutas):
+    """Validaciones de [inicio, fin) para las rutas indicadas, en una conexión del pool"""
+    with conexion("transacciones") as conn:
+        return leer_preparada("geo_validaciones", QUERY_VALIDACIONES, conn, (inicio, fin, list(rutas)))
+
 def get_all_validations_optimized(all_rutas, ranges):
-    """Optimización: Una sola consulta para todos los periodos y rutas, con filtro horario"""
-    conn = psycopg2.connect(**DB_TRANSACCIONES)
-    rutas_str = "','".join(all_rutas)
-    
-    all_starts = [r[0] for r in ranges.values()]
-    all_ends = [r[1] for r in ranges.values()]
-    min_date = min(all_starts)
-    max_date = max(all_ends)
-
-    query = f"""
-    SELECT 
-        fechahoraevento,
-        latitude,
-        longitude,
-        idrutaestacion,
-        serialmediopago,
-        montoevento
-    FROM c_transacciones
-    WHERE fechahoraevento >= '{min_date}'
-      AND fechahoraevento < '{max_date}'
-      AND idrutaestacion IN ('{rutas_str}')
-      AND tipoevento IN (4, 8)
-      AND idproducto IN ('4d4f')
-      AND (fechahoraevento::time >= '05:00:00' AND fechahoraevento::time <= '22:59:59')
-      AND latitude IS NOT NULL 
-      AND latitude != 0 
     """
-    df = pd.read_sql(query, conn)
-    conn.close()
-    
-    def assign_period(dt):
-        dt_date = dt.date()
-        for label, (start, end) in ranges.items():
-            start_dt = datetime.strptime(start, "%Y-%m-%d").date()
-            end_dt = datetime.strptime(end, "%Y-%m-%d").date()
-            if start_dt <= dt_date < end_dt:
-                return label
-        return None
-
-    df['periodo_label'] = df['fechahoraevento'].apply(assign_period)
-    return df[df['periodo_label'].notna()]
+    Validaciones de las rutas en los períodos, cacheadas en el almacén compartido
+    por (ruta, día). Solo se consultan los pares que faltan, agrupados en tramos
+    de días consecutivos (una consulta acotada por tramo, no un único rango
+    min→max) que corren en paralelo en conexiones del pool. Los días no cerrados
+    (hoy en adelante) se consultan siempre y no se guardan.
+    Devuelve (df, pares ruta-día consultados).
+    """
+    almacen = almacen_global()
+    rutas = sorted(set(all_rutas))
+    dias = dias_de_periodos(ranges)
+    hoy = date.today().strftime("%Y-%m-%d")
+    faltantes = {}
+    for dia in dias:
+        rutas_dia = [r for r in rutas if dia >= hoy or not almacen.contiene(("geo_validaciones", r, dia))]
+        if rutas_dia:
+            faltantes[dia] = rutas_dia
+
+    nuevas = {}
+    tramos = tramos_faltantes(faltantes)
+    if tramos:
+        with ThreadPoolExecutor(max_workers=min(len(tramos), obtener_pool("transacciones").maxconn)) as executor:
+            for (inicio, fin, rutas_tramo), df in zip(tramos, executor.map(lambda t: leer_validaciones(*t), tramos)):
+                # Un tramo sin filas trae fechahoraevento como object
+                dia_evento = pd.to_datetime(df['fechahoraevento']).dt.normalize()
+                por_par = dict(tuple(df.groupby([df['idrutaestacion'], dia_evento], observed=True)))
+                for dia_ts in pd.date_range(inicio, fin, inclusive='left'):
+                    dia = dia_ts.strftime("%Y-%m-%d")
+                    for ruta in rutas_tramo:
+                        # Un par sin validaciones también se guarda para no volver a consultarlo
+                        nuevas[(ruta, dia)] = por_par.get((ruta, dia_ts), df.iloc[0:0])
+                        if dia < hoy:
+                            almacen.guardar(("geo_validaciones", ruta, dia), nuevas[(ruta, dia)])
+
+    partes = []
+    for dia in dias:
+        for ruta in rutas:
+            parte = nuevas.get((ruta, dia))
+            if parte is None:
+                # obtener_o_calcular cubre un par desalojado del almacén entre medio
+                parte = almacen.obtener_o_calcular(("geo_validaciones", ruta, dia), lambda: leer_validaciones(*tramos_faltantes({dia: [ruta]})[0]))
+            partes.append(parte)
+    # Los pares sin filas pueden traer columnas object; se descartan para no perder los tipos
+    df = pd.concat([p for p in partes if not p.empty] or partes[:1], ignore_index=True)
+    # Si los períodos se solapan, cada validación queda solo en el primero que la cubre
+    df['periodo_label'] = asignar_periodos(df['fechahoraevento'], ranges)
+    return df[df['periodo_label'].notna()], sum(len(r) for r in faltantes.values())
+
+# ======================================================
+# RENDERIZADO DEL MAPA
+# ======================================================
+# Por debajo de este zoom los puntos se agrupan en clusters; desde aquí se ven uno a uno
+ZOOM_SIN_CLUSTERS = 16
+# Tope de puntos enviados al navegador (~40 B por punto en la página); por encima se muestrea
+MAX_PUNTOS_MAPA = int(os.getenv("TRANSBORDOS_GEO_MAX_PUNTOS", "300000"))
+
+def capa_validaciones(df, colores, color_defecto='gray'):
+    """
+    Una sola capa FastMarkerCluster con todos los puntos. Los datos viajan como
+    arreglo compacto [lat, lon, ruta, epoch] armado desde las columnas y los
+    marcadores (círculos en canvas) y sus popups se crean en el navegador.
+    """
+    import json
+    from folium.plugins import FastMarkerCluster
+
+    df = df[np.isfinite(df['latitude'].to_numpy(dtype=float)) & np.isfinite(df['longitude'].to_numpy(dtype=float))]
+    codigos, rutas = pd.factorize(df['idrutaestacion'].astype(str))
+    # Hora local sin zona codificada como epoch: en el navegador se formatea en UTC y conserva la hora
+    segundos = df['fechahoraevento'].to_numpy().astype('datetime64[s]').astype(np.int64)
+    datos = list(zip(
+        df['latitude'].round(5).tolist(), df['longitude'].round(5).tolist(), codigos.tolist(), segundos.tolist()
+    ))
+    callback = """(function () {
+        var rutas = %s, colores = %s;
+        return function (row) {
+            var color = colores[row[2]];
+            var marker = L.circleMarker(new L.LatLng(row[0], row[1]), {
+                radius: 4, color: color, fillColor: color, fillOpacity: 0.6, weight: 1
+            });
+            var fecha = new Date(row[3] * 1000).toISOString().slice(0, 19).replace('T', ' ');
+            marker.bindPopup('Ruta: ' + rutas[row[2]] + '<br>' + fecha);
+            return marker;
+        };
+    })()""" % (json.dumps(list(rutas)), json.dumps([colores.get(r, color_defecto) for r in rutas]))
+    return FastMarkerCluster(
+        datos, callback=callback, name="Validaciones",
+        options={'chunkedLoading': True, 'disableClusteringAtZoom': ZOOM_SIN_CLUSTERS, 'spiderfyOnMaxZoom': False}
+    )
 
 # ======================================================
 # CONFIGURACIÓN DE PERIODOS Y RUTAS
 # ======================================================
-# Definición de fechas (Hoy es 2026-03-06 según metadatos)
-today = datetime(2026, 3, 6)
-date_cut = datetime(2025, 12, 24)
-
-# Definimos los 4 periodos solicitados vinculados a la fecha de corte y la actual
-ranges = {
-    "1) Post-Corte (24/12 + 7d)": (date_cut.strftime("%Y-%m-%d"), (date_cut + timedelta(days=7)).strftime("%Y-%m-%d")),
-    "2) Pre-Corte (24/12 - 7d)": ((date_cut - timedelta(days=7)).strftime("%Y-%m-%d"), date_cut.strftime("%Y-%m-%d")),
-    "3) Últimos 7 días (Hoy)": ((today - timedelta(days=7)).strftime("%Y-%m-%d"), today.strftime("%Y-%m-%d")),
-    "4) Mismo período (Año Ant.)": ((today - timedelta(days=365+7)).strftime("%Y-%m-%d"), (today - timedelta(days=365)).strftime("%Y-%m-%d"))
-}
-
-group_1_rutas = ["0212", "0213"]
-group_2_rutas = ["0214", "0215"]
-all_rutas_to_query = group_1_rutas + group_2_rutas
+# Valores iniciales de los selectores; se cambian desde la barra lateral sin redeploy
+RUTAS_GRUPO_1 = os.getenv("TRANSBORDOS_GEO_RUTAS_G1", "0212,0213").split(",")
+RUTAS_GRUPO_2 = os.getenv("TRANSBORDOS_GEO_RUTAS_G2", "0214,0215").split(",")
+FECHA_CORTE = os.getenv("TRANSBORDOS_GEO_FECHA_CORTE", "2025-12-24")
+DIAS_PERIODO = int(os.getenv("TRANSBORDOS_GEO_DIAS_PERIODO", "7"))
+
+COLORES_PERIODOS = ["#ef553b", "#636efa", "#00cc96", "#ab63fa"]
+COLORES_RUTAS = ["#1f77b4", "#2ca02c", "#ff7f0e", "#9467bd", "#d62728", "#8c564b", "#e377c2", "#17becf", "#bcbd22", "#7f7f7f"]
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def rutas_disponibles():
+    """Catálogo ruta_hex -> empresa para los selectores de rutas"""
+    from procesamiento import leer_empresas
+    return leer_empresas().set_index('ruta_hex')['empresa'].to_dict()
+
+def periodos_comparacion(date_cut, today, dias):
+    """Los 4 períodos [inicio, fin) alrededor de la fecha de corte y de la fecha actual"""
+    n = timedelta(days=dias)
+    anio = timedelta(days=365)
+    return {
+        f"1) Post-Corte ({date_cut:%d/%m} + {dias}d)": (f"{date_cut:%Y-%m-%d}", f"{date_cut + n:%Y-%m-%d}"),
+        f"2) Pre-Corte ({date_cut:%d/%m} - {dias}d)": (f"{date_cut - n:%Y-%m-%d}", f"{date_cut:%Y-%m-%d}"),
+        f"3) Últimos {dias} días (al {today:%d/%m})": (f"{today - n:%Y-%m-%d}", f"{today:%Y-%m-%d}"),
+        "4) Mismo período (Año Ant.)": (f"{today - anio - n:%Y-%m-%d}", f"{today - anio:%Y-%m-%d}"),
+    }
 
 # ======================================================
 # SIDEBAR
 # ======================================================
+st.sidebar.header("⚙️ Configuración")
+
+try:
+    catalogo_rutas = rutas_disponibles()
+except Exception as e:
+    catalogo_rutas = {}
+    st.sidebar.warning(f"⚠️ No se pudo leer el catálogo de rutas: {e}")
+opciones_rutas = sorted(set(catalogo_rutas) | set(RUTAS_GRUPO_1) | set(RUTAS_GRUPO_2))
+
+def etiqueta_ruta(ruta):
+    return f"{ruta} · {catalogo_rutas[ruta]}" if catalogo_rutas.get(ruta) else ruta
+
+group_1_rutas = st.sidebar.multiselect("Rutas grupo 1", opciones_rutas, default=RUTAS_GRUPO_1, format_func=etiqueta_ruta)
+group_2_rutas = st.sidebar.multiselect("Rutas grupo 2", opciones_rutas, default=RUTAS_GRUPO_2, format_func=etiqueta_ruta)
+date_cut = st.sidebar.date_input("📅 Fecha de corte", value=datetime.strptime(FECHA_CORTE, "%Y-%m-%d").date())
+today = st.sidebar.date_input("📆 Fin del período reciente", value=date.today(), help="Día excluido; el período reciente termina el día anterior")
+dias_periodo = int(st.sidebar.number_input("Días por período", min_value=1, max_value=60, value=DIAS_PERIODO))
+
+ranges = periodos_comparacion(date_cut, today, dias_periodo)
+all_rutas_to_query = list(dict.fromkeys(group_1_rutas + group_2_rutas))
+route_colors = {ruta: COLORES_RUTAS[i % len(COLORES_RUTAS)] for i, ruta in enumerate(all_rutas_to_query)}
+
 st.sidebar.header("🚀 Acciones")
-st.sidebar.info(f"📅 Corte: **24/12/2025**\n\n⏰ Horario: **05:00 a 23:00**")
+st.sidebar.info(f"📅 Corte: **{date_cut:%d/%m/%Y}**\n\n⏰ Horario: **05:00 a 23:00**")
+
+# Con datos ya cargados, un cambio de rutas o períodos recarga solo con los pares (ruta, día) nuevos
+seleccion = (tuple(all_rutas_to_query), tuple(ranges.items()))
+cambio_seleccion = 'df_all' in st.session_state and st.session_state.get('seleccion_geo') != seleccion
 
-if st.sidebar.button("� Cargar/Actualizar Datos (Batch)", type="primary"):
-    with st.spinner("Consultando validaciones..."):
-        df_all = get_all_validations_optimized(all_rutas_to_query, ranges)
-        st.session_state['df_all'] = df_all
-        st.session_state['active_polygon'] = None  # Resetear filtro de polígono
-        st.sidebar.success(f"Cargados {len(df_all)} registros.")
+if st.sidebar.button("� Cargar/Actualizar Datos (Batch)", type="primary") or cambio_seleccion:
+    if not all_rutas_to_query:
+        st.sidebar.warning("Seleccione al menos una ruta.")
+    else:
+        with st.spinner("Consultando validaciones..."):
+            df_all, pares_consultados = get_all_validations_optimized(all_rutas_to_query, ranges)
+            st.session_state['df_all'] = df_all
+            st.session_state['seleccion_geo'] = seleccion
+            # Índice espacial armado una sola vez por carga; cada redibujo del polígono lo reutiliza
+            st.session_state['indice_geo'] = IndiceGrilla.desde_df(df_all)
+            st.session_state['active_polygon'] = None  # Resetear filtro de polígono
+            st.sidebar.success(f"Cargados {len(df_all)} registros ({pares_consultados} pares ruta-día consultados, el resto desde caché).")
 
 if st.sidebar.button("🧹 Limpiar Filtro de Polígono"):
     st.session_state['active_polygon'] = None
 
-import folium
-from folium.plugins import Draw
-from streamlit_folium import st_folium
-from shapely.geometry import Point, Polygon
-import numpy as np
-
 # ======================================================
 # PROCESAMIENTO E INTERACCIÓN (POLÍGONO)
 # ======================================================
 if 'df_all' in st.session_state:
+    import folium
+    from folium.plugins import Draw
+    from streamlit_folium import st_folium
+    import plotly.express as px
+
     df_raw = st.session_state['df_all']
     
     st.subheader("📐 Mapa con Geocerca de Polígono Libre")
@@ -147,28 +254,23 @@ if 'df_all' in st.session_state:
     3. Puede borrar y redibujar cuantas veces necesite.
     """)
     
-    route_colors = {
-        "0212": "#1f77b4", "0213": "#2ca02c", 
-        "0214": "#ff7f0e", "0215": "#9467bd"
-    }
-
     # Definir el polígono actual desde el estado
     current_polygon = st.session_state.get('active_polygon', None)
 
     # Filtrar datos por polígono si existe
     if current_polygon:
-        # Shapely espera (lon, lat) para Point y Polygon
-        poly_shape = Polygon(current_polygon)
-        # Vectorizar el chequeo de "puntos en polígono" es lento, usamos apply para claridad inicial
-        mask = df_raw.apply(lambda row: poly_shape.contains(Point(row['longitude'], row['latitude'])), axis=1)
-        df_filtered = df_raw[mask].copy()
+        # Vértices (lon, lat); solo se prueban exactamente los puntos de las celdas del borde
+        indice = st.session_state.get('indice_geo')
+        if indice is None or len(indice) != len(df_raw):
+            indice = st.session_state['indice_geo'] = IndiceGrilla.desde_df(df_raw)
+        df_filtered = df_raw.iloc[indice.consulta_poligono(current_polygon)].copy()
     else:
         df_filtered = df_raw.copy()
 
     # Crear mapa
     center_lat = df_raw['latitude'].mean()
     center_lon = df_raw['longitude'].mean()
-    m = folium.Map(location=[center_lat, center_lon], zoom_start=12, tiles="cartodbpositron")
+    m = folium.Map(location=[center_lat, center_lon], zoom_start=12, tiles="cartodbpositron", prefer_canvas=True)
 
     # Plugin de Dibujo
     draw = Draw(
@@ -187,28 +289,27 @@ if 'df_all' in st.session_state:
     draw.add_to(m)
 
     # Añadir Leyenda HTML
+    items_leyenda = "<br>".join(
+        f'<i style="background:{color};width:10px;height:10px;display:inline-block;"></i> {ruta}'
+        for ruta, color in route_colors.items()
+    )
     legend_html = f'''
-     <div style="position: fixed; bottom: 50px; left: 50px; width: 140px; height: 100px; 
+     <div style="position: fixed; bottom: 50px; left: 50px; width: 140px; 
      border:2px solid grey; z-index:9999; font-size:12px; background-color:white; opacity: 0.8; padding: 10px;">
      <b>Rutas</b><br>
-     <i style="background:{route_colors['0212']};width:10px;height:10px;display:inline-block;"></i> 0212<br>
-     <i style="background:{route_colors['0213']};width:10px;height:10px;display:inline-block;"></i> 0213<br>
-     <i style="background:{route_colors['0214']};width:10px;height:10px;display:inline-block;"></i> 0214<br>
-     <i style="background:{route_colors['0215']};width:10px;height:10px;display:inline-block;"></i> 0215
+     {items_leyenda}
      </div>
      '''
     m.get_root().html.add_child(folium.Element(legend_html))
 
-    # Pintar puntos (Muestra para performance si no hay filtro)
-    display_df = df_filtered if (current_polygon or len(df_raw) < 5000) else df_raw.sample(5000)
-    for _, row in display_df.iterrows():
-        color = route_colors.get(str(row['idrutaestacion']), 'gray')
-        folium.CircleMarker(
-            location=[row['latitude'], row['longitude']],
-            radius=4, color=color, fill=True, fill_color=color, fill_opacity=0.6,
-            popup=f"Ruta: {row['idrutaestacion']}<br>{row['fechahoraevento']}",
-            weight=1
-        ).add_to(m)
+    # Pintar los puntos filtrados en una sola capa (sin un objeto por punto); las métricas
+    # y gráficos siguen usando df_filtered completo
+    df_mapa = df_filtered
+    if len(df_filtered) > MAX_PUNTOS_MAPA:
+        df_mapa = df_filtered.sample(MAX_PUNTOS_MAPA, random_state=0)
+        st.info(f"🗺️ El mapa muestra una muestra de {MAX_PUNTOS_MAPA:,} de {len(df_filtered):,} validaciones. "
+                f"Dibuje un polígono para ver todos los puntos de un área.")
+    capa_validaciones(df_mapa, route_colors).add_to(m)
 
     # Mostrar el mapa y capturar el dibujo
     output = st_folium(m, width="100%", height=600, key="polygon_map")
@@ -219,9 +320,9 @@ if 'df_all' in st.session_state:
         if len(output["all_drawings"]) > 0:
             last_drawing = output["all_drawings"][-1]
             if last_drawing['geometry']['type'] in ['Polygon', 'Rectangle']:
-                 # Folium devuelve [[lat, lon], ...], Shapely usa (lon, lat)
+                 # GeoJSON de Leaflet.draw ya viene como [[lon, lat], ...], el orden que espera geocerca.py
                  coords = last_drawing['geometry']['coordinates'][0]
-                 new_polygon_coords = [[c[1], c[0]] for c in coords]
+                 new_polygon_coords = [list(c) for c in coords]
     
     # Si el usuario borró el polígono desde la herramienta del mapa
     elif output and output.get("all_drawings") == []:
@@ -251,11 +352,8 @@ if 'df_all' in st.session_state:
 
         def get_bar_df(df_group, group_rutas):
             data = df_group[df_group['idrutaestacion'].isin(group_rutas)]
-            results = []
-            for label in ranges.keys():
-                count = len(data[data['periodo_label'] == label])
-                results.append({"Periodo": label, "Cantidad": count})
-            return pd.DataFrame(results)
+            conteos = data.groupby('periodo_label', observed=False).size()
+            return pd.DataFrame({"Periodo": list(ranges.keys()), "Cantidad": conteos.reindex(list(ranges.keys()), fill_value=0).to_numpy()})
 
         df_g1_bars = get_bar_df(df_filtered, group_1_rutas)
         df_g2_bars = get_bar_df(df_filtered, group_2_rutas)
@@ -263,24 +361,14 @@ if 'df_all' in st.session_state:
         with col1:
             st.markdown(f"**Rutas {', '.join(group_1_rutas)}**")
             fig1 = px.bar(df_g1_bars, x='Periodo', y='Cantidad', text='Cantidad', color='Periodo',
-                         color_discrete_map={
-                             "1) Post-Corte (24/12 + 7d)": "#ef553b",
-                             "2) Pre-Corte (24/12 - 7d)": "#636efa",
-                             "3) Últimos 7 días (Hoy)": "#00cc96",
-                             "4) Mismo período (Año Ant.)": "#ab63fa"
-                         })
+                         color_discrete_map=dict(zip(ranges, COLORES_PERIODOS)))
             fig1.update_traces(texttemplate='%{text}', textposition='outside')
             st.plotly_chart(fig1, use_container_width=True)
 
         with col2:
             st.markdown(f"**Rutas {', '.join(group_2_rutas)}**")
             fig2 = px.bar(df_g2_bars, x='Periodo', y='Cantidad', text='Cantidad', color='Periodo',
-                         color_discrete_map={
-                             "1) Post-Corte (24/12 + 7d)": "#ef553b",
-                             "2) Pre-Corte (24/12 - 7d)": "#636efa",
-                             "3) Últimos 7 días (Hoy)": "#00cc96",
-                             "4) Mismo período (Año Ant.)": "#ab63fa"
-                         })
+                         color_discrete_map=dict(zip(ranges, COLORES_PERIODOS)))
             fig2.update_traces(texttemplate='%{text}', textposition='outside')
             st.plotly_chart(fig2, use_container_width=True)
 
@@ -3,127 +3,42 @@ Análisis de Transbordos - Aplicación Streamlit.
 Para ejecutar: streamlit run analisis_transbordos_streamlit.py
 """
 import streamlit as st
-import psycopg2
 import pandas as pd
-from psycopg2.extras import execute_values
 from datetime import datetime, timedelta
 import time
 import numpy as np
-import plotly.express as px
-import plotly.graph_objects as go
-from concurrent.futures import ProcessPoolExecutor
-import multiprocessing
 import os
 from dotenv import load_dotenv
+from agregaciones import binear_densidad, centro_ponderado, HistogramaIntervalos
+from exportacion import FILAS_POR_BLOQUE, FORMATOS, abrir_exportacion, exportar, ruta_exportacion
+from score_exceso import cargar_flags, UMBRAL_DIAS_EXCESO
+from motor_analitico import MotorAnalitico, guardar_particion, fechas_disponibles
+from almacen_resultados import almacen_global
+from perfilador import Perfilador, PERFILADO_POR_DEFECTO
+from conexiones_db import registro_consultas
+from extraccion import REBANADAS_POR_DEFECTO, MOTOR_POR_DEFECTO, MOTORES
+from procesamiento import procesar_fecha, publicar_resultado, resultado_en_almacen
+from arranque import cargar_precalentados, frescura
+from modo_vivo import INTERVALO_VIVO_MIN, refrescar_si_corresponde
+# plotly.express, consulta_detalle (DuckDB) y red_rutas (SciPy) se importan recién donde se usan;
+# `python arranque.py importaciones` reporta el costo de importación del arranque
 
 # Cargar variables de entorno
 load_dotenv()
 
-# ======================================================
-# FUNCIONES DE PROCESAMIENTO PARALELO (TOP LEVEL)
-# ======================================================
-def worker_matching_logic(chunk_df, h_dict):
-    """
-    Función que ejecutan los workers en paralelo. 
-    Se encarga de buscar la validación madre para un conjunto de transbordos.
-    """
-    import pandas as pd
-    results_list = []
-    
-    for _, row in chunk_df.iterrows():
-        card_id = row['serialmediopago']
-        
-        # Obtener historial de la tarjeta desde el diccionario pre-agrupado
-        card_history_data = h_dict.get(card_id, [])
-        if not card_history_data:
-            results_list.append({
-                'idsam_madre': None, 'fechahoraevento_madre': None, 
-                'entidad_madre': None, 'idrutaestacion_madre': None,
-                'latitude_madre': None, 'longitude_madre': None,
-                'consecutivoevento_madre': None, 'montoevento_madre': None
-            })
-            continue
-
-        # Determinar target_num_trans según lógica de negocio
-        target_num_trans = None
-        if row['entidad'] == '0002':
-            if row['numerotransbordos'] in [5, 6]: target_num_trans = 4
-            elif row['numerotransbordos'] in [9, 10]: target_num_trans = 8
-        elif row['entidad'] == '0003': 
-            target_num_trans = 0
-
-        # Filtrar historial de la tarjeta: consecutivo debe ser menor
-        # Convertimos a DF temporalmente para esta tarjeta (es rápido ya que son pocos registros)
-        card_history_df = pd.DataFrame(card_history_data)
-        valid_madres = card_history_df[card_history_df['consecutivoevento'] < row['consecutivoevento']]
-        
-        if target_num_trans is not None and not valid_madres.empty:
-            especificas = valid_madres[valid_madres['numerotransbordos'] == target_num_trans]
-            if not especificas.empty:
-                valid_madres = especificas
-        
-        if valid_madres.empty:
-            results_list.append({
-                'idsam_madre': None, 'fechahoraevento_madre': None, 
-                'entidad_madre': None, 'idrutaestacion_madre': None,
-                'latitude_madre': None, 'longitude_madre': None,
-                'consecutivoevento_madre': None, 'montoevento_madre': None
-            })
-        else:
-            # Tomar la más reciente (mayor consecutivo)
-            madre = valid_madres.sort_values('consecutivoevento', ascending=False).iloc[0]
-            results_list.append({
-                'idsam_madre': madre['idsam'],
-                'fechahoraevento_madre': madre['fechahoraevento'],
-                'entidad_madre': madre['entidad'],
-                'idrutaestacion_madre': madre['idrutaestacion'],
-                'latitude_madre': madre['latitude'],
-                'longitude_madre': madre['longitude'],
-                'consecutivoevento_madre': madre['consecutivoevento'],
-                'montoevento_madre': madre['montoevento']
-            })
-            
-    return pd.DataFrame(results_list)
+@st.cache_resource
+def obtener_motor_analitico():
+    """Motor DuckDB compartido por todas las sesiones del proceso"""
+    return MotorAnalitico()
 
-def vectorized_clasificar_descuento(df):
-    """Clasificación de descuentos optimizada vectorialmente"""
-    import numpy as np
-    # Auxiliares
-    tarifa = np.where(df['tipotransporte_str'] == '3', 3400, 2400)
-    porcentaje = np.where(df['monto_ahorrado'] >= tarifa * 0.95, "100%", 
-                         np.where(df['monto_ahorrado'] >= tarifa * 0.45, "50%", "Otro"))
-    
-    conds = [
-        (df['entidad_transbordo'] == '0002') & (df['numerotransbordos'] == 5),
-        (df['entidad_transbordo'] == '0002') & (df['numerotransbordos'] == 6),
-        (df['entidad_transbordo'] == '0002') & (df['numerotransbordos'] == 9),
-        (df['entidad_transbordo'] == '0002') & (df['numerotransbordos'] == 10),
-        (df['entidad_transbordo'] == '0003') & (df['numerotransbordos'] == 1),
-        (df['entidad_transbordo'] == '0003') & (df['numerotransbordos'] == 2)
-    ]
-    
-    prefixes = ['TDP_V1_T1_', 'TDP_V1_T2_', 'TDP_V2_T1_', 'TDP_V2_T2_', 'EPAS_T1_', 'EPAS_T2_']
-    
-    results = np.full(len(df), "Otro", dtype=object)
-    for cond, prefix in zip(conds, prefixes):
-        results[cond] = prefix + porcentaje[cond]
-    
-    return results
-
-def run_parallel_matching(transfers_df, h_dict, n_workers=6, progress_bar=None):
-    """Ejecuta la lógica de matching en paralelo utilizando ProcessPoolExecutor"""
-    chunks = np.array_split(transfers_df, n_workers)
-    
-    with ProcessPoolExecutor(max_workers=n_workers) as executor:
-        futures = [executor.submit(worker_matching_logic, chunk, h_dict) for chunk in chunks]
-        
-        results = []
-        for i, future in enumerate(futures):
-            results.append(future.result())
-            if progress_bar:
-                progress_bar.progress(70 + int(((i+1) / n_workers) * 10))
-        
-        return pd.concat(results, ignore_index=True)
+# Quién calculó el día mostrado (meta 'origen' del almacén / meta.json)
+ORIGENES = {
+    'dashboard': 'Procesar Datos',
+    'procesado': 'Procesar Datos',
+    'arranque': 'el precalentamiento al iniciar',
+    'programador': 'el precálculo programado',
+    'parquet': 'una partición guardada',
+}
 
 # ======================================================
 # CONFIGURACIÓN DE PÁGINA
@@ -141,22 +56,7 @@ st.markdown("---")
 # ======================================================
 # CONEXIONES
 # ======================================================
-DB_TRANSACCIONES = {
-    "host": os.getenv("DB_TRANSACCIONES_HOST", "replicatransacciones.vmt.gov.py"),
-    "port": os.getenv("DB_TRANSACCIONES_PORT", "5435"),
-    "dbname": os.getenv("DB_TRANSACCIONES_NAME", "transacciones"),
-    "user": os.getenv("DB_TRANSACCIONES_USER", "devmt"),
-    "password": os.getenv("DB_TRANSACCIONES_PASS", "FootgearBlinkedDigFreewillStricken"),
-    "options": "-c statement_timeout=0"
-}
-
-DB_MONITOREO = {
-    "host": os.getenv("DB_MONITOREO_HOST", "168.90.177.232"),
-    "port": os.getenv("DB_MONITOREO_PORT", "2024"),
-    "dbname": os.getenv("DB_MONITOREO_NAME", "bbdd-monitoreo-cid"),
-    "user": os.getenv("DB_MONITOREO_USER", "FPorta"),
-    "password": os.getenv("DB_MONITOREO_PASS", "portaf2024")
-}
+# Configuración y conexiones instrumentadas en conexiones_db.py
 
 # ======================================================
 # SIDEBAR - CONFIGURACIÓN
@@ -192,288 +92,172 @@ filtro_tipo_empresa = st.sidebar.radio(
     help="1) Todos: todas las empresas\n2) Nuevos: Solo Magno, San Isidro, Ñanduti y La Sanlorenzana"
 )
 
+# Extracción paralela por rebanadas horarias (1 = una sola consulta)
+rebanadas_extraccion = st.sidebar.number_input(
+    "Rebanadas de extracción",
+    min_value=1,
+    max_value=24,
+    value=REBANADAS_POR_DEFECTO,
+    help="Divide el día en N rebanadas horarias que se consultan en paralelo, cada una en su propia conexión."
+)
+
+motor_extraccion = st.sidebar.selectbox(
+    "Motor de extracción",
+    options=MOTORES,
+    index=MOTORES.index(MOTOR_POR_DEFECTO),
+    help="read_sql: consulta preparada con pd.read_sql. copy: COPY binario decodificado directamente a columnas NumPy (textos como categóricos)."
+)
+
+# Modo en vivo: solo para el día en curso, refresca por marca de agua
+modo_vivo = False
+if fecha_seleccionada == datetime.now().date():
+    modo_vivo = st.sidebar.checkbox(
+        "🔴 Modo en vivo",
+        value=False,
+        help="Mantiene el día de hoy en memoria y cada N minutos procesa solo los eventos nuevos y las tarjetas que tocan."
+    )
+    if modo_vivo:
+        intervalo_vivo = st.sidebar.number_input("Refresco (minutos)", min_value=1, max_value=60, value=int(INTERVALO_VIVO_MIN))
+
+# Perfilado opcional (también activable con TRANSBORDOS_PROFILE=1)
+modo_perfilado = st.sidebar.checkbox(
+    "🩺 Modo perfilado",
+    value=PERFILADO_POR_DEFECTO,
+    help="Mide cada etapa y tab, muestrea la pila de ejecución y registra asignaciones de memoria."
+)
+perf = Perfilador(activo=modo_perfilado).iniciar()
+
+# Días precalculados al iniciar el contenedor (arranque.py) o por programador.py;
+# solo se lee la partición del día elegido si es más nueva que la del almacén
+try:
+    cargar_precalentados([fecha_seleccionada])
+except Exception as e:
+    st.sidebar.warning(f"⚠️ No se pudieron cargar los días precalculados: {e}")
+
+with st.sidebar.expander("🗓️ Días precalculados"):
+    df_frescura = frescura()
+    if df_frescura.empty:
+        st.caption("Aún no hay días guardados.")
+    else:
+        st.dataframe(df_frescura.sort_values("fecha", ascending=False), use_container_width=True, hide_index=True)
+
+with st.sidebar.expander("🧠 Memoria compartida"):
+    _almacen = almacen_global()
+    st.caption(f"{_almacen.bytes_totales() / 1024 / 1024:,.0f} MB de {_almacen.limite_bytes / 1024 / 1024:,.0f} MB en uso")
+    st.dataframe(pd.DataFrame(_almacen.resumen()), use_container_width=True, hide_index=True)
+
 if st.sidebar.button("🔄 Procesar Datos", type="primary"):
-    
     inicio = time.time()
-    
-    # ======================================================
-    # PREPARAR FECHAS
-    # ======================================================
-    fecha_proceso = fecha_seleccionada
-    fecha_inicio = fecha_proceso.strftime("%Y-%m-%d")
-    fecha_fin = (fecha_proceso + timedelta(days=1)).strftime("%Y-%m-%d")
-    fecha_pool_inicio = (datetime.combine(fecha_proceso, datetime.min.time()) - timedelta(hours=2.5)).strftime("%Y-%m-%d %H:%M:%S")
+    procesado_en = datetime.now().isoformat()
+    marca_sql = registro_consultas.marca()
+    fecha_inicio = fecha_seleccionada.strftime("%Y-%m-%d")
     
     st.info(f"📅 Procesando fecha: **{fecha_inicio}**")
     
-    # ======================================================
-    # PROGRESS BAR
-    # ======================================================
     progress_bar = st.progress(0)
     status_text = st.empty()
     
-    # ======================================================
-    # 1) EXTRAER TRANSBORDOS
-    # ======================================================
-    status_text.text("📥 Consultando transbordos desde Azure...")
-    progress_bar.progress(10)
-    
-    conn_trx = psycopg2.connect(**DB_TRANSACCIONES)
-    
-    query_transfers = f"""
-    SELECT DISTINCT ON (idsam, consecutivoevento, serialmediopago)
-        idsam,
-        serialmediopago,
-        fechahoraevento,
-        entidad,
-        latitude,
-        longitude,
-        idrutaestacion,
-        tipotransporte,
-        tipoevento,
-        consecutivoevento,
-        númerotransbordos as numerotransbordos,
-        montoevento
-    FROM c_transacciones
-    WHERE fechahoraevento >= '{fecha_inicio}'
-      AND fechahoraevento < '{fecha_fin}'
-      AND idproducto IN ('4d4f')
-      AND tipoevento IN (4, 8) 
-      AND (
-          (entidad = '0002' AND númerotransbordos IN (1, 5, 6, 9, 10))
-          OR
-          (entidad = '0003' AND númerotransbordos IN (1, 2))
-      )
-    """
-    
-    df_transfers = pd.read_sql(query_transfers, conn_trx)
-    progress_bar.progress(30)
-    
-    if df_transfers.empty:
+    def avisar(progreso=None, texto=None, exito=None):
+        if progreso is not None:
+            progress_bar.progress(progreso)
+        if texto:
+            status_text.text(texto)
+        if exito:
+            st.success(exito)
+    
+    procesado = procesar_fecha(fecha_seleccionada, rebanadas=rebanadas_extraccion, motor=motor_extraccion,
+                               avisar=avisar, perf=perf)
+    if procesado is None:
         st.warning("⚠️ No hay transbordos para procesar en esta fecha.")
+        # st.stop() corta el script antes del panel de perfilado: se libera tracemalloc aquí
+        perf.detener()
         st.stop()
-    
-    st.success(f"✅ Transbordos encontrados: **{len(df_transfers):,}**")
-    
-    # ======================================================
-    # 2) OBTENER HISTORIAL DE TARJETAS
-    # ======================================================
-    status_text.text("🎴 Obteniendo historial de tarjetas...")
-    progress_bar.progress(40)
-    
-    unique_cards = df_transfers['serialmediopago'].unique().tolist()
-    
-    cur_trx = conn_trx.cursor()
-    cur_trx.execute("DROP TABLE IF EXISTS tmp_target_cards; CREATE TEMP TABLE tmp_target_cards (card_id BIGINT PRIMARY KEY);")
-    execute_values(cur_trx, "INSERT INTO tmp_target_cards (card_id) VALUES %s", [(c,) for c in unique_cards])
-    
-    query_history = f"""
-    SELECT 
-        idsam,
-        serialmediopago,
-        fechahoraevento,
-        entidad,
-        idrutaestacion,
-        latitude,
-        longitude,
-        consecutivoevento,
-        montoevento,
-        númerotransbordos as numerotransbordos
-    FROM c_transacciones c
-    JOIN tmp_target_cards tc ON c.serialmediopago = tc.card_id
-    WHERE c.fechahoraevento >= '{fecha_pool_inicio}'
-      AND c.fechahoraevento < '{fecha_fin}'
-      AND c.tipoevento IN (4, 8)
-      AND c.númerotransbordos IN (0, 1, 2, 4, 5, 6, 8, 9, 10)
-      AND c.montoevento >= 0
-    """
-    
-    df_history = pd.read_sql(query_history, conn_trx)
-    conn_trx.close()
-    progress_bar.progress(60)
-    
-    st.success(f"✅ Historial cargado: **{len(df_history):,}** registros de **{len(unique_cards):,}** tarjetas únicas")
-    
-    # ======================================================
-    # 3) VINCULACIÓN DE MADRES (OPTIMIZADO CON 6 WORKERS)
-    # ======================================================
-    status_text.text("🔗 Preparando vinculación de transbordos...")
-    progress_bar.progress(70)
-    
-    # Preparar datos
-    df_transfers['consecutivoevento'] = df_transfers['consecutivoevento'].astype('int64')
-    df_history['consecutivoevento'] = df_history['consecutivoevento'].astype('int64')
-    
-    status_text.text("📦 Agrupando historial de tarjetas para búsqueda rápida...")
-    # Pre-agrupar historial por tarjeta para evitar filtrado repetitivo
-    # Ordenamos por consecutivoevento descendente para que la más reciente sea la primera
-    history_dict = {
-        card: group.to_dict('records') 
-        for card, group in df_history.groupby('serialmediopago')
-    }
-    
-    status_text.text("🚀 Ejecutando vinculación paralela con 6 workers...")
-    madre_info = run_parallel_matching(df_transfers, history_dict, n_workers=6, progress_bar=progress_bar)
-    
-    # Combinar resultados
-    df_linked = pd.concat([df_transfers.reset_index(drop=True), madre_info], axis=1)
-    
-    # DEBUG: Mostrar columnas disponibles
-    # st.write("**Columnas disponibles:**", df_linked.columns.tolist())
-    
-    # Renombrar columnas (df_transfers no tiene sufijos, solo madre_info)
-    rename_dict = {}
-    
-    # Columnas de transbordo (vienen de df_transfers)
-    if 'fechahoraevento' in df_linked.columns:
-        rename_dict['fechahoraevento'] = 'fecha_transbordo'
-    if 'idrutaestacion' in df_linked.columns:
-        rename_dict['idrutaestacion'] = 'idruta_transbordo'
-    if 'latitude' in df_linked.columns:
-        rename_dict['latitude'] = 'latitud_transbordo'
-    if 'longitude' in df_linked.columns:
-        rename_dict['longitude'] = 'longitud_transbordo'
-    if 'idsam' in df_linked.columns:
-        rename_dict['idsam'] = 'idsam_transbordo'
-    if 'montoevento' in df_linked.columns:
-        rename_dict['montoevento'] = 'montoevento_transbordo'
-    if 'entidad' in df_linked.columns:
-        rename_dict['entidad'] = 'entidad_transbordo'
-    
-    # Columnas de madre (vienen de madre_info)
-    if 'fechahoraevento_madre' in df_linked.columns:
-        rename_dict['fechahoraevento_madre'] = 'fecha_madre'
-    if 'idrutaestacion_madre' in df_linked.columns:
-        rename_dict['idrutaestacion_madre'] = 'idruta_madre'
-    if 'latitude_madre' in df_linked.columns:
-        rename_dict['latitude_madre'] = 'latitud_madre'
-    if 'longitude_madre' in df_linked.columns:
-        rename_dict['longitude_madre'] = 'longitud_madre'
-    
-    df_linked = df_linked.rename(columns=rename_dict)
-    
-    # st.write("**Columnas después de renombrar:**", df_linked.columns.tolist())
-    
-    progress_bar.progress(80)
-    
-    # ======================================================
-    # 4) CÁLCULOS ADICIONALES
-    # ======================================================
-    status_text.text("🧮 Calculando métricas...")
-    
-    df_linked["fecha_transbordo"] = pd.to_datetime(df_linked["fecha_transbordo"])
-    df_linked["fecha_madre"] = pd.to_datetime(df_linked["fecha_madre"])
-    
-    df_linked["intervalo"] = (
-        (df_linked["fecha_transbordo"] - df_linked["fecha_madre"])
-        .dt.total_seconds() / 60
-    )
-    
-    df_linked.loc[(df_linked["intervalo"] < 0) | (df_linked["intervalo"] > 120), "intervalo"] = None
-    
-    # ======================================================
-    # NUEVA LÓGICA: CÁLCULO DE MONTO AHORRADO
-    # ======================================================
-    # tipotransporte = 1 -> tarifa 2400 (Convencional)
-    # tipotransporte = 3 -> tarifa 3400 (Diferencial)
-    
-    # Vectorización de monto ahorrado
-    df_linked['monto_ahorrado'] = 0
-    df_linked['tipotransporte_str'] = df_linked['tipotransporte'].astype(str)
-    
-    mask_conv = df_linked['tipotransporte_str'] == '1'
-    mask_dif = df_linked['tipotransporte_str'] == '3'
-    
-    df_linked.loc[mask_conv, 'monto_ahorrado'] = (2400 - df_linked['montoevento_transbordo']).clip(lower=0)
-    df_linked.loc[mask_dif, 'monto_ahorrado'] = (3400 - df_linked['montoevento_transbordo']).clip(lower=0)
-    
-    # Clasificar tipo de transbordo (1 = primer beneficio, 2 = segundo beneficio)
-    df_linked["tipo_transbordo"] = 1
-    # Segundo transbordo: 6 o 10 para TDP, 2 para EPAS
-    df_linked.loc[df_linked["numerotransbordos"].isin([6, 10, 2]), "tipo_transbordo"] = 2
-    
-    df_linked['tipo_descuento'] = vectorized_clasificar_descuento(df_linked)
-    df_linked = df_linked.drop(columns=['tipotransporte_str'])
-    
-    progress_bar.progress(85)
-    
-    # ======================================================
-    # 5) ENRIQUECIMIENTO CON EMPRESAS
-    # ======================================================
-    status_text.text("🏷️ Enriqueciendo con nombres de empresas...")
-    
-    conn_mon = psycopg2.connect(**DB_MONITOREO)
-    
-    query_empresas = """
-    SELECT 
-        r.ruta_hex,
-        e.eot_nombre AS empresa
-    FROM catalogo_rutas r
-    JOIN eots e 
-        ON r.id_eot_catalogo = e.cod_catalogo;
-    """
-    
-    df_empresas = pd.read_sql(query_empresas, conn_mon).drop_duplicates("ruta_hex")
-    conn_mon.close()
-    
-    df_linked = df_linked.merge(
-        df_empresas,
-        left_on="idruta_transbordo",
-        right_on="ruta_hex",
-        how="left"
-    ).rename(columns={"empresa": "empresa_transbordo"}).drop(columns=["ruta_hex"], errors='ignore')
-    
-    df_linked = df_linked.merge(
-        df_empresas,
-        left_on="idruta_madre",
-        right_on="ruta_hex",
-        how="left"
-    ).rename(columns={"empresa": "empresa_madre"}).drop(columns=["ruta_hex"], errors='ignore')
-    
-    df_linked["servicio_transbordo"] = (
-        df_linked["empresa_transbordo"].fillna("SIN_EMPRESA")
-        + " → " +
-        df_linked["empresa_madre"].fillna("SIN_EMPRESA")
-    )
-    
-    # Clasificar tipo de transbordo
-    df_linked["clasificacion_transbordo"] = "Sin Madre"
-    df_linked.loc[df_linked["empresa_madre"].notna(), "clasificacion_transbordo"] = "Intra-Empresa"
-    df_linked.loc[
-        (df_linked["empresa_madre"].notna()) & 
-        (df_linked["empresa_transbordo"] != df_linked["empresa_madre"]), 
-        "clasificacion_transbordo"
-    ] = "Inter-Empresa"
-    
-    progress_bar.progress(100)
-    status_text.text("✅ Procesamiento completado!")
+    df_linked, df_history = procesado
     
     tiempo_total = time.time() - inicio
-    
-    # Enriquecer df_history con empresas antes de guardar
-    df_history = df_history.merge(
-        df_empresas,
-        left_on="idrutaestacion",
-        right_on="ruta_hex",
-        how="left"
-    ).drop(columns=["ruta_hex"], errors='ignore')
 
+    # Persistir el día en Parquet particionado para el análisis multi-día
+    perf.etapa("6) Guardar resultados")
+    try:
+        guardar_particion(fecha_inicio, df_linked, df_history, meta={
+            'procesado_en': procesado_en,
+            'duracion_s': round(tiempo_total, 1),
+            'transbordos': int(len(df_linked)),
+            'origen': 'dashboard',
+        })
+    except Exception as e:
+        st.warning(f"⚠️ No se pudo guardar la partición Parquet del día: {e}")
+    
     # ======================================================
-    # GUARDAR EN SESSION STATE
+    # GUARDAR EN EL ALMACÉN COMPARTIDO (LA SESIÓN SOLO GUARDA HANDLES)
     # ======================================================
-    st.session_state['df_linked'] = df_linked
-    st.session_state['df_history'] = df_history
-    st.session_state['fecha_proceso'] = fecha_inicio
-    st.session_state['tiempo_proceso'] = tiempo_total
+    st.session_state['resultado'] = publicar_resultado(fecha_inicio, df_linked, df_history, {
+        'procesado_en': procesado_en,
+        'tiempo_proceso': tiempo_total,
+        'origen': 'dashboard',
+    })
+    
+    perf.cerrar_etapa()
     
     st.success(f"⏱️ Tiempo de procesamiento: **{tiempo_total:.2f} segundos** ({tiempo_total/60:.2f} minutos)")
 
+    with st.expander("🗄️ Consultas SQL de este procesamiento"):
+        df_sql = registro_consultas.resumen(marca_sql)
+        if df_sql.empty:
+            st.caption("Sin consultas registradas.")
+        else:
+            st.caption(
+                f"{len(df_sql)} sentencias · ejecución {df_sql['ejecucion_s'].sum():.2f}s · fetch {df_sql['fetch_s'].sum():.2f}s"
+                + ("" if registro_consultas.capturar_explain else " · EXPLAIN deshabilitado (TRANSBORDOS_EXPLAIN=1)")
+            )
+            st.dataframe(registro_consultas.resumen_por_huella(marca_sql), use_container_width=True, hide_index=True)
+
 # ======================================================
 # VISUALIZACIÓN DE DATOS
 # ======================================================
-if 'df_linked' in st.session_state:
+almacen = almacen_global()
+# ======================================================
+# MODO EN VIVO (DELTA DESDE LA MARCA DE AGUA)
+# ======================================================
+if modo_vivo:
+    with st.spinner("🔴 Actualizando eventos nuevos..."):
+        refresco = refrescar_si_corresponde(fecha_seleccionada, intervalo_min=intervalo_vivo, motor=motor_extraccion)
+    if refresco:
+        st.session_state['vivo_ultimo_refresco'] = refresco
+    ultimo = st.session_state.get('vivo_ultimo_refresco')
+    if ultimo:
+        st.sidebar.caption(
+            f"🔴 Último refresco ({ultimo['modo']}): {ultimo['nuevos']:,} transbordos nuevos en {ultimo['segundos']:.1f}s"
+        )
+    st.session_state['vivo_ultima_ejecucion'] = time.time()
+
+    # Latido: el fragmento se reejecuta solo y dispara una ejecución completa al cumplirse el intervalo
+    @st.fragment(run_every=timedelta(minutes=1))
+    def _latido_vivo():
+        if time.time() - st.session_state.get('vivo_ultima_ejecucion', 0) >= intervalo_vivo * 60:
+            st.rerun()
+
+    _latido_vivo()
+
+# Si el día seleccionado ya está calculado en el almacén se muestra sin reprocesar
+resultado = st.session_state.get('resultado')
+if not resultado or resultado['fecha_proceso'] != fecha_seleccionada.strftime("%Y-%m-%d"):
+    precalculado = resultado_en_almacen(fecha_seleccionada.strftime("%Y-%m-%d"))
+    if precalculado:
+        st.session_state['resultado'] = precalculado
+resultado = st.session_state.get('resultado')
+df_base = almacen.obtener(resultado['linked']) if resultado else None
+
+if resultado and df_base is None:
+    st.warning("⚠️ El resultado de esta sesión fue liberado por el límite de memoria. Vuelva a presionar **Procesar Datos**.")
+
+if df_base is not None:
+    import plotly.express as px
     
-    df = st.session_state['df_linked']
+    # Si otra sesión reprocesó la misma fecha, se muestran los datos más recientes
+    resultado.update(almacen.meta(resultado['linked']) or {})
+    perf.etapa("Métricas generales")
+    df = df_base
     
     # ======================================================
     # FILTRADO SEGÚN SELECCIÓN DE SIDEBAR
@@ -482,7 +266,11 @@ if 'df_linked' in st.session_state:
         # Lista de empresas solicitadas para el filtro "Nuevos"
         empresas_nuevas = ['MAGNO', 'SAN ISIDRO', 'ÑANDUTI', 'SANLORENZANA']
         pattern = '|'.join(empresas_nuevas)
-        df = df[df['empresa_transbordo'].str.contains(pattern, case=False, na=False)]
+        # En el almacén queda solo el día completo; el subconjunto vive lo que dura la ejecución.
+        # El patrón se evalúa sobre los nombres distintos de empresa, no fila por fila
+        empresas_dia = pd.Series(df_base['empresa_transbordo'].dropna().unique())
+        seleccionadas = empresas_dia[empresas_dia.str.contains(pattern, case=False)]
+        df = df_base[df_base['empresa_transbordo'].isin(seleccionadas)]
     
     # ======================================================
     # CÁLCULO DE EXCESO DE TRANSBORDOS (> 2 viajes/día)
@@ -492,7 +280,13 @@ if 'df_linked' in st.session_state:
     tarjetas_con_exceso = (viajes_con_transbordo_por_tarjeta > 2).sum()
     
     st.markdown("---")
-    st.header(f"📊 Resultados - {st.session_state['fecha_proceso']}")
+    st.header(f"📊 Resultados - {resultado['fecha_proceso']}")
+    antiguedad_h = (datetime.now() - datetime.fromisoformat(resultado['procesado_en'])).total_seconds() / 3600
+    st.caption(
+        f"🕒 Calculado el {resultado['procesado_en'][:16].replace('T', ' ')} (hace {antiguedad_h:.1f} h) "
+        f"por {ORIGENES.get(resultado.get('origen'), resultado.get('origen'))}. "
+        "Presione **Procesar Datos** para actualizarlo."
+    )
     
     # ======================================================
     # MÉTRICAS PRINCIPALES
@@ -543,6 +337,36 @@ if 'df_linked' in st.session_state:
             
             st.dataframe(exceso_df.sort_values('Cant. Viajes con Transbordo', ascending=False), use_container_width=True, hide_index=True)
             
+            # Reincidencia en ventanas móviles (estado incremental que actualiza el ETL nocturno)
+            estado_exceso, ultima_fecha_exceso = cargar_flags()
+            if estado_exceso is not None:
+                reincidentes = estado_exceso[
+                    estado_exceso['serialmediopago'].isin(exceso_df['Serial Tarjeta'])
+                    & (estado_exceso['flag_7d'] | estado_exceso['flag_30d'])
+                ]
+                st.markdown(
+                    f"**Reincidencia (hasta {ultima_fecha_exceso}):** {len(reincidentes):,} de estas tarjetas superan "
+                    f"{UMBRAL_DIAS_EXCESO[7]} días con exceso en 7 días o {UMBRAL_DIAS_EXCESO[30]} en 30 días."
+                )
+                st.caption(
+                    "Las ventanas 7d/30d las calcula el ETL nocturno con su vinculación (madre más cercana, "
+                    "a lo sumo 10 eventos antes); el conteo de arriba prefiere la madre del mismo beneficio, "
+                    "así que los viajes de una tarjeta pueden diferir."
+                )
+                if len(reincidentes) > 0:
+                    st.dataframe(
+                        reincidentes[['serialmediopago', 'dias_exceso_7d', 'viajes_con_transbordo_7d', 'dias_exceso_30d',
+                                      'viajes_con_transbordo_30d', 'monto_ahorrado_30d']].rename(columns={
+                            'serialmediopago': 'Serial Tarjeta',
+                            'dias_exceso_7d': 'Días con Exceso (7d)',
+                            'viajes_con_transbordo_7d': 'Viajes con Transbordo (7d)',
+                            'dias_exceso_30d': 'Días con Exceso (30d)',
+                            'viajes_con_transbordo_30d': 'Viajes con Transbordo (30d)',
+                            'monto_ahorrado_30d': 'Monto Ahorrado (30d)'
+                        }).sort_values('Días con Exceso (30d)', ascending=False),
+                        use_container_width=True, hide_index=True
+                    )
+            
             st.markdown("---")
             st.subheader("🕵️ Historial Detallado de Tarjetas en Alerta")
             
@@ -552,29 +376,9 @@ if 'df_linked' in st.session_state:
                 options=exceso_df['Serial Tarjeta'].unique()
             )
             
-            if tarjeta_analizar and 'df_history' in st.session_state:
-                h_df = st.session_state['df_history']
-                tarjeta_history = h_df[h_df['serialmediopago'] == tarjeta_analizar].copy()
-                tarjeta_history = tarjeta_history.sort_values('fechahoraevento')
-                
-                # Clasificar eventos para mejor visualización
-                def etiquetar_evento(row):
-                    nt = row['numerotransbordos']
-                    ent = row['entidad']
-                    if ent == '0002': # TDP
-                        if nt == 4: return "🏠 Madre (Viaje 1)"
-                        if nt == 8: return "🏠 Madre (Viaje 2)"
-                        if nt == 5: return "🚌 1er Transbordo (V1)"
-                        if nt == 6: return "🚌 2do Transbordo (V1)"
-                        if nt == 9: return "🚌 1er Transbordo (V2)"
-                        if nt == 10: return "🚌 2do Transbordo (V2)"
-                    elif ent == '0003': # EPAS
-                        if nt == 0: return "🏠 Madre (Base)"
-                        if nt == 1: return "🚌 1er Transbordo"
-                        if nt == 2: return "🚌 2do Transbordo"
-                    return "💳 Validación Base"
-                
-                tarjeta_history['Tipo Evento'] = tarjeta_history.apply(etiquetar_evento, axis=1)
+            historial_idx = almacen.obtener(resultado['historial'])
+            if tarjeta_analizar and historial_idx is not None:
+                tarjeta_history = historial_idx.timeline(tarjeta_analizar)
                 
                 # Formatear para mostrar
                 display_cols = ['fechahoraevento', 'Tipo Evento', 'idsam', 'empresa', 'montoevento', 'numerotransbordos', 'consecutivoevento']
@@ -688,29 +492,12 @@ if 'df_linked' in st.session_state:
                 key="sb_anomalias"
             )
             
-            if tarjeta_otro and 'df_history' in st.session_state:
-                h_df = st.session_state['df_history']
-                t_history = h_df[h_df['serialmediopago'] == tarjeta_otro].copy()
-                t_history = t_history.sort_values('fechahoraevento')
-                
-                # Usar la misma lógica de etiquetado
-                def etiquetar_evento_otro(row):
-                    nt = row['numerotransbordos']
-                    ent = row['entidad']
-                    if ent == '0002': # TDP
-                        if nt == 4: return "🏠 Madre (Viaje 1)"
-                        if nt == 8: return "🏠 Madre (Viaje 2)"
-                        if nt == 5: return "🚌 1er Transbordo (V1)"
-                        if nt == 6: return "🚌 2do Transbordo (V1)"
-                        if nt == 9: return "🚌 1er Transbordo (V2)"
-                        if nt == 10: return "🚌 2do Transbordo (V2)"
-                    elif ent == '0003': # EPAS
-                        if nt == 0: return "🏠 Madre (Base)"
-                        if nt == 1: return "🚌 1er Transbordo"
-                        if nt == 2: return "🚌 2do Transbordo"
-                    return f"❓ Evento Desconocido (Cód: {nt})"
-                
-                t_history['Tipo Evento'] = t_history.apply(etiquetar_evento_otro, axis=1)
+            historial_idx = almacen.obtener(resultado['historial'])
+            if tarjeta_otro and historial_idx is not None:
+                # Misma tabla de etiquetas; los códigos sin regla se muestran como desconocidos
+                t_history = historial_idx.timeline(
+                    tarjeta_otro, etiqueta_desconocida="❓ Evento Desconocido (Cód: {nt})"
+                )
                 
                 st.table(t_history[['fechahoraevento', 'Tipo Evento', 'idsam', 'empresa', 'montoevento', 'numerotransbordos']].rename(columns={
                     'fechahoraevento': 'Fecha/Hora',
@@ -764,20 +551,22 @@ if 'df_linked' in st.session_state:
     # ======================================================
     # TABS DE ANÁLISIS
     # ======================================================
-    tab1, tab2, tab3, tab4, tab5, tab6, tab7 = st.tabs([
+    tab1, tab2, tab3, tab4, tab5, tab6, tab7, tab8 = st.tabs([
         "💰 Tipos de Descuento",
         "📈 Resumen por Empresa", 
         "🔄 Matriz de Transbordos",
         "⏱️ Distribución de Intervalos",
         "📋 Datos Detallados",
         "🗺️ Mapa de Calor General",
-        "📍 Análisis Geográfico Detallado"
+        "📍 Análisis Geográfico Detallado",
+        "📆 Histórico Multi-día"
     ])
     
     # ======================================================
     # TAB 1: ANÁLISIS DE TIPOS DE DESCUENTO
     # ======================================================
     with tab1:
+        perf.etapa("Tab 1: Tipos de Descuento")
         st.subheader("💰 Análisis Detallado de Tipos de Descuento")
         
         # Gráfico de distribución general
@@ -875,6 +664,7 @@ if 'df_linked' in st.session_state:
     # TAB 2: RESUMEN POR EMPRESA
     # ======================================================
     with tab2:
+        perf.etapa("Tab 2: Resumen por Empresa")
         st.subheader("📊 Transbordos por Empresa", help="📊 **Qué es:** Muestra el volumen total de transbordos por cada empresa operadora.\n\n💡 **Utilidad:** Identifica qué empresas tienen mayor demanda de conexiones.\n\n🧮 **Cálculo:** Suma de todos los transbordos registrados, divididos en 'Intra-Empresa' (mismo operador) e 'Inter-Empresa' (cambio de operador).")
         
         # Resumen por empresa de transbordo
@@ -936,6 +726,7 @@ if 'df_linked' in st.session_state:
     # TAB 3: MATRIZ DE TRANSBORDOS
     # ======================================================
     with tab3:
+        perf.etapa("Tab 3: Matriz de Transbordos")
         st.subheader("🗺️ Matriz de Flujo de Transbordos", help="📊 **Qué es:** Un mapa de calor que muestra de dónde vienen y a dónde van los usuarios.\n\n💡 **Utilidad:** Detectar alianzas naturales o necesidades de conexión entre empresas.\n\n🧮 **Cálculo:** Eje Y (Empresa Madre) -> Eje X (Empresa de Transbordo). Cada celda representa la cantidad de usuarios que hicieron ese cambio específico.")
         
         # Filtrar solo transbordos con madre identificada
@@ -968,6 +759,59 @@ if 'df_linked' in st.session_state:
             )
             fig2.update_layout(height=400)
             st.plotly_chart(fig2, use_container_width=True)
+            
+            # ======================================================
+            # RED DE RUTAS (MATRIZ DISPERSA)
+            # ======================================================
+            from red_rutas import RedRutas
+            st.subheader("🕸️ Red de Transbordos por Ruta", help="📊 **Qué es:** La red origen-destino a nivel de ruta: cada arista es Ruta Madre → Ruta de Transbordo.\n\n💡 **Utilidad:** Detectar corredores y rutas alimentadoras entre miles de rutas, donde una matriz densa no es legible.\n\n🧮 **Cálculo:** Matriz dispersa de conteos; grado = rutas distintas conectadas, PageRank = importancia de la ruta como destino de transbordos ponderada por flujo.")
+            red = almacen.obtener_o_calcular(
+                ('red_rutas', resultado['fecha_proceso'], resultado['procesado_en'], filtro_tipo_empresa),
+                lambda: RedRutas.desde_transbordos(df),
+                meta=resultado
+            )
+            
+            col_r1, col_r2, col_r3 = st.columns(3)
+            col_r1.metric("Rutas", f"{red.n_rutas:,}")
+            col_r2.metric("Conexiones", f"{red.n_aristas:,}")
+            col_r3.metric("Densidad", f"{red.densidad():.2%}")
+            
+            col_k, col_misma = st.columns([1, 2])
+            with col_k:
+                k_aristas = st.number_input("Top conexiones", min_value=5, max_value=200, value=20, step=5, key="k_aristas_red")
+            with col_misma:
+                incluir_misma = st.checkbox("Incluir transbordos en la misma ruta", value=False, key="misma_ruta_red")
+            
+            # Empresa de cada ruta para etiquetar las aristas
+            empresa_ruta = pd.concat([
+                df[['idruta_transbordo', 'empresa_transbordo']].set_axis(['ruta', 'empresa'], axis=1),
+                df[['idruta_madre', 'empresa_madre']].set_axis(['ruta', 'empresa'], axis=1),
+            ]).dropna().drop_duplicates('ruta').astype(str).set_index('ruta')['empresa']
+            
+            top_aristas = red.top_aristas(int(k_aristas), incluir_misma_ruta=incluir_misma)
+            top_aristas['empresa_origen'] = top_aristas['origen'].map(empresa_ruta)
+            top_aristas['empresa_destino'] = top_aristas['destino'].map(empresa_ruta)
+            top_aristas['conexion'] = top_aristas['origen'] + " → " + top_aristas['destino']
+            fig_red = px.bar(
+                top_aristas.iloc[::-1],
+                x='cantidad',
+                y='conexion',
+                orientation='h',
+                hover_data=['empresa_origen', 'empresa_destino'],
+                labels={'cantidad': 'Transbordos', 'conexion': 'Ruta Madre → Ruta Transbordo'}
+            )
+            fig_red.update_layout(height=max(400, 18 * len(top_aristas)))
+            st.plotly_chart(fig_red, use_container_width=True)
+            
+            metricas_red = red.metricas()
+            metricas_red['empresa'] = metricas_red['ruta'].map(empresa_ruta)
+            st.markdown("##### 📍 Rutas más centrales")
+            st.dataframe(
+                metricas_red.sort_values('pagerank', ascending=False).head(50),
+                use_container_width=True,
+                hide_index=True,
+                column_config={'pagerank': st.column_config.NumberColumn("PageRank", format="%.4f")}
+            )
         else:
             st.warning("No hay transbordos con validación madre identificada.")
     
@@ -975,38 +819,34 @@ if 'df_linked' in st.session_state:
     # TAB 4: DISTRIBUCIÓN DE INTERVALOS
     # ======================================================
     with tab4:
+        perf.etapa("Tab 4: Distribución de Intervalos")
         st.subheader("⏱️ Distribución de Intervalos de Tiempo", help="📊 **Qué es:** Analiza cuánto tiempo pasa el usuario entre que bajó de un bus y subió al siguiente.\n\n💡 **Utilidad:** Permite evaluar la eficiencia de las frecuencias y el tiempo de espera del usuario.\n\n🧮 **Cálculo:** `Tiempo Transbordo - Tiempo Madre`. Se muestra la frecuencia de estos intervalos en minutos.")
         
-        df_con_intervalo = df[df['intervalo'].notna()].copy()
+        # Una pasada de NumPy: bins, rangos y estadísticas salen del histograma;
+        # al navegador solo viajan las 48 barras, sin importar cuántos transbordos haya
+        hist_intervalos = HistogramaIntervalos.desde_valores(df['intervalo'].to_numpy(dtype='float64', na_value=np.nan))
         
-        if len(df_con_intervalo) > 0:
-            fig = px.histogram(
-                df_con_intervalo,
-                x='intervalo',
-                nbins=50,
-                labels={'intervalo': 'Intervalo (minutos)', 'count': 'Frecuencia'},
+        if hist_intervalos.n > 0:
+            fig = px.bar(
+                hist_intervalos.bins(),
+                x='centro_min',
+                y='cantidad',
+                labels={'centro_min': 'Intervalo (minutos)', 'cantidad': 'Frecuencia'},
                 color_discrete_sequence=['#2ecc71']
             )
-            fig.update_layout(height=400)
+            fig.update_layout(height=400, bargap=0)
             st.plotly_chart(fig, use_container_width=True)
             
             col1, col2, col3 = st.columns(3)
             with col1:
-                st.metric("Intervalo Promedio", f"{df_con_intervalo['intervalo'].mean():.1f} min")
+                st.metric("Intervalo Promedio", f"{hist_intervalos.media():.1f} min")
             with col2:
-                st.metric("Intervalo Mediano", f"{df_con_intervalo['intervalo'].median():.1f} min")
+                st.metric("Intervalo Mediano", f"{hist_intervalos.cuantil(0.5):.1f} min")
             with col3:
-                st.metric("Intervalo Máximo", f"{df_con_intervalo['intervalo'].max():.1f} min")
-            
-            # Distribución por rangos
-            df_con_intervalo['rango_intervalo'] = pd.cut(
-                df_con_intervalo['intervalo'],
-                bins=[0, 15, 30, 60, 90, 120],
-                labels=['0-15 min', '15-30 min', '30-60 min', '60-90 min', '90-120 min']
-            )
+                st.metric("Intervalo Máximo", f"{hist_intervalos.maximo:.1f} min")
             
-            rangos = df_con_intervalo['rango_intervalo'].value_counts().reset_index()
-            rangos.columns = ['Rango', 'Cantidad']
+            # Distribución por rangos (sumas de bins, mismos bordes (a, b] que pd.cut)
+            rangos = hist_intervalos.rangos()
             
             st.subheader("🍰 Distribución por Rangos de Tiempo", help="📊 **Qué es:** Agrupa los tiempos de espera en rangos lógicos (ej: 0-15 min).\n\n💡 **Utilidad:** Visión simplificada de la puntualidad y tiempos de conexión.\n\n🧮 **Cálculo:** Se clasifican los intervalos en cubetas predefinidas (0-15, 15-30, etc.) y se cuentan los registros en cada una.")
             fig2 = px.pie(
@@ -1022,6 +862,7 @@ if 'df_linked' in st.session_state:
     # TAB 5: DATOS DETALLADOS
     # ======================================================
     with tab5:
+        perf.etapa("Tab 5: Datos Detallados")
         st.subheader("Datos Detallados")
         
         # Filtros
@@ -1039,17 +880,10 @@ if 'df_linked' in st.session_state:
                 default=None
             )
         
-        df_filtrado = df.copy()
-        
-        # Mapear EPS para mejor visualización
-        eps_map = {'0002': 'TDP', '0003': 'EPAS'}
-        df_filtrado['EPS Origen'] = df_filtrado['entidad_madre'].map(eps_map).fillna('Desconocida')
-        df_filtrado['EPS Destino'] = df_filtrado['entidad_transbordo'].map(eps_map).fillna('Desconocida')
-        
-        if filtro_empresa:
-            df_filtrado = df_filtrado[df_filtrado['empresa_transbordo'].isin(filtro_empresa)]
-        if filtro_clasificacion:
-            df_filtrado = df_filtrado[df_filtrado['clasificacion_transbordo'].isin(filtro_clasificacion)]
+        filtros_detalle = {
+            'empresa_transbordo': filtro_empresa,
+            'clasificacion_transbordo': filtro_clasificacion,
+        }
         
         # Seleccionar columnas relevantes
         columnas_mostrar = [
@@ -1058,38 +892,87 @@ if 'df_linked' in st.session_state:
             'tipo_transbordo', 'tipo_descuento', 'montoevento_transbordo', 'monto_ahorrado', 'tipotransporte', 'intervalo'
         ]
         
+        # Paginación: filtro, orden y OFFSET/LIMIT se resuelven en DuckDB sobre el DataFrame en memoria
+        col_orden, col_dir, col_tam, col_pag = st.columns([3, 2, 2, 2])
+        with col_orden:
+            orden_detalle = st.selectbox("Ordenar por", options=columnas_mostrar, index=1, key="orden_detalle")
+        with col_dir:
+            dir_detalle = st.radio("Dirección", options=["Ascendente", "Descendente"], horizontal=True, key="dir_detalle")
+        with col_tam:
+            tam_pagina = st.selectbox("Filas por página", options=[100, 500, 1000, 5000], index=2, key="tam_pagina_detalle")
+        with col_pag:
+            pagina = st.number_input("Página", min_value=1, value=1, step=1, key="pagina_detalle")
+        
+        from consulta_detalle import consultar_pagina
+        df_pagina, total_filtrado = consultar_pagina(
+            df,
+            filtros=filtros_detalle,
+            columnas=columnas_mostrar,
+            orden=orden_detalle,
+            ascendente=(dir_detalle == "Ascendente"),
+            offset=(pagina - 1) * tam_pagina,
+            limit=tam_pagina
+        )
+        total_paginas = max(1, -(-total_filtrado // tam_pagina))
+        
         st.dataframe(
-            df_filtrado[columnas_mostrar].head(1000),
+            df_pagina,
             use_container_width=True,
             hide_index=True
         )
         
-        st.info(f"Mostrando {min(len(df_filtrado), 1000):,} de {len(df_filtrado):,} registros")
+        desde = min((pagina - 1) * tam_pagina + 1, total_filtrado)
+        st.info(f"Mostrando {desde:,}-{(pagina - 1) * tam_pagina + len(df_pagina):,} de {total_filtrado:,} registros (página {pagina:,} de {total_paginas:,})")
         
-        # Botón de descarga
-        csv = df_filtrado.to_csv(index=False).encode('utf-8')
-        st.download_button(
-            label="📥 Descargar CSV completo",
-            data=csv,
-            file_name=f"transbordos_{st.session_state['fecha_proceso']}.csv",
-            mime="text/csv",
-        )
+        # Exportación bajo demanda: el archivo solo se genera al solicitarlo
+        # y queda en caché por (fecha, filtros, formato, procesamiento)
+        col_fmt, col_btn = st.columns([2, 1])
+        with col_fmt:
+            formato_export = st.selectbox("Formato de exportación", options=list(FORMATOS.keys()), key="formato_export")
+        filtros_export = {
+            'tipo_empresa': filtro_tipo_empresa,
+            'empresa': sorted(filtro_empresa),
+            'clasificacion': sorted(filtro_clasificacion),
+        }
+        args_export = (resultado['fecha_proceso'], filtros_export, formato_export, resultado['procesado_en'])
+        path_export = ruta_exportacion(*args_export)
+        
+        with col_btn:
+            if not os.path.exists(path_export) and st.button("⚙️ Preparar archivo", key="btn_preparar_export"):
+                with st.spinner("Generando archivo de exportación..."):
+                    # DuckDB entrega el resultado filtrado por lotes directo al archivo
+                    from consulta_detalle import lector_filtrado
+                    with lector_filtrado(df, filtros=filtros_detalle, filas_por_bloque=FILAS_POR_BLOQUE) as lector:
+                        path_export = exportar(lector, *args_export)
+        
+        f_export = abrir_exportacion(path_export)
+        if f_export is not None:
+            with f_export:
+                st.download_button(
+                    label=f"📥 Descargar {formato_export} completo",
+                    data=f_export,
+                    file_name=os.path.basename(path_export),
+                    mime=FORMATOS[formato_export]["mime"],
+                )
     
     # ======================================================
     # TAB 6: MAPA DE CALOR GENERAL
     # ======================================================
     with tab6:
+        perf.etapa("Tab 6: Mapa de Calor General")
         st.subheader("�️ Mapa de Calor General de Transbordos", help="📊 **Qué es:** Visualización de densidad que muestra las zonas con mayor concentración de transbordos.\n\n💡 **Utilidad:** Identificar rápidamente los 'puntos calientes' de transferencia en la ciudad.\n\n🧮 **Cálculo:** Mapa de calor basado exclusivamente en las coordenadas de los eventos de transbordo realizados.")
         
-        df_geo_heatmap = df[df['latitud_transbordo'].notna() & df['longitud_transbordo'].notna()].copy()
+        # Se binean todas las coordenadas del día; al navegador solo van las celdas con peso
+        bins_heatmap = binear_densidad(df['latitud_transbordo'].to_numpy(), df['longitud_transbordo'].to_numpy())
         
-        if len(df_geo_heatmap) > 0:
+        if len(bins_heatmap) > 0:
             fig_heat = px.density_map(
-                df_geo_heatmap.head(2000),
-                lat='latitud_transbordo',
-                lon='longitud_transbordo',
+                bins_heatmap,
+                lat='lat',
+                lon='lon',
+                z='peso',
                 radius=10,
-                center=dict(lat=df_geo_heatmap['latitud_transbordo'].mean(), lon=df_geo_heatmap['longitud_transbordo'].mean()),
+                center=centro_ponderado(bins_heatmap),
                 zoom=11,
                 map_style="open-street-map",
                 height=700
@@ -1103,6 +986,7 @@ if 'df_linked' in st.session_state:
     # TAB 7: ANÁLISIS GEOGRÁFICO DETALLADO (MAPA DE CALOR DINÁMICO)
     # ======================================================
     with tab7:
+        perf.etapa("Tab 7: Análisis Geográfico")
         st.subheader("📍 Análisis Geográfico Detallado: Mapa de Calor por Etapa", help="📊 **Qué es:** Visualización de densidad que permite ver dónde se concentran los inicios de viaje (Madre) comparado con dónde se concentran los transbordos.\n\n💡 **Utilidad:** Comparar si las zonas de inicio de viaje coinciden con las zonas de transbordo.\n\n🧮 **Cálculo:** Mapa de densidad basado en la etapa del trayecto seleccionada.")
         
         # Filtros superiores
@@ -1125,37 +1009,40 @@ if 'df_linked' in st.session_state:
                 key="geo_filtro_empresa_calor"
             )
         
-        # Filtrado de datos base
-        df_geo_base = df.copy()
+        # Filtrado de datos base (máscaras booleanas, sin copiar el DataFrame)
+        mask_base = np.ones(len(df), dtype=bool)
         if filtro_empresa_madre:
-            df_geo_base = df_geo_base[df_geo_base['empresa_madre'].isin(filtro_empresa_madre)]
+            mask_base &= df['empresa_madre'].isin(filtro_empresa_madre).to_numpy()
             
         # Preparar data según la etapa
         if etapa_seleccionada == "🏠 Validación Madre":
-            data_mapa = df_geo_base[df_geo_base['latitud_madre'].notna() & df_geo_base['longitud_madre'].notna()].copy()
+            mask_etapa = mask_base
             lat_col, lon_col = 'latitud_madre', 'longitud_madre'
             color_scale = ['#FEE5D9', '#FCAE91', '#FB6A4A', '#DE2D26', '#A50F15'] # Escala Roja/Naranja
             titulo_mapa = "Densidad: Validaciones Madre (Inicio de Viaje)"
         
         elif etapa_seleccionada == "🟢 1er Transbordo":
-            data_mapa = df_geo_base[(df_geo_base['tipo_transbordo'] == 1) & df_geo_base['latitud_transbordo'].notna()].copy()
+            mask_etapa = mask_base & (df['tipo_transbordo'] == 1).to_numpy()
             lat_col, lon_col = 'latitud_transbordo', 'longitud_transbordo'
             color_scale = ['#EDF8E9', '#BAE4B3', '#74C476', '#31A354', '#006D2C'] # Escala Verde
             titulo_mapa = "Densidad: Primer Beneficio de Transbordo"
             
         else: # 2do Transbordo
-            data_mapa = df_geo_base[(df_geo_base['tipo_transbordo'] == 2) & df_geo_base['latitud_transbordo'].notna()].copy()
+            mask_etapa = mask_base & (df['tipo_transbordo'] == 2).to_numpy()
             lat_col, lon_col = 'latitud_transbordo', 'longitud_transbordo'
             color_scale = ['#EFF3FF', '#BDD7E7', '#6BAED6', '#3182BD', '#08519C'] # Escala Azul
             titulo_mapa = "Densidad: Segundo Beneficio de Transbordo"
         
-        if len(data_mapa) > 0:
+        bins_mapa = binear_densidad(df[lat_col].to_numpy()[mask_etapa], df[lon_col].to_numpy()[mask_etapa])
+        
+        if len(bins_mapa) > 0:
             fig_det = px.density_map(
-                data_mapa.head(2000),
-                lat=lat_col,
-                lon=lon_col,
+                bins_mapa,
+                lat='lat',
+                lon='lon',
+                z='peso',
                 radius=12,
-                center=dict(lat=data_mapa[lat_col].mean(), lon=data_mapa[lon_col].mean()),
+                center=centro_ponderado(bins_mapa),
                 zoom=11,
                 map_style="open-street-map",
                 color_continuous_scale=color_scale,
@@ -1168,9 +1055,106 @@ if 'df_linked' in st.session_state:
             )
             
             st.plotly_chart(fig_det, use_container_width=True)
-            st.info(f"Mostrando mapa de densidad para {len(data_mapa):,} registros filtrados.")
+            st.info(f"Mostrando mapa de densidad para {int(bins_mapa['peso'].sum()):,} registros filtrados ({len(bins_mapa):,} celdas).")
         else:
             st.warning(f"No hay suficientes datos geográficos para mostrar la densidad de: {etapa_seleccionada}")
 
-else:
+    # ======================================================
+    # TAB 8: HISTÓRICO MULTI-DÍA (DUCKDB SOBRE PARQUET)
+    # ======================================================
+    with tab8:
+        perf.etapa("Tab 8: Histórico Multi-día")
+        st.subheader("📆 Análisis Multi-día", help="📊 **Qué es:** Agregados sobre todos los días ya procesados y guardados en Parquet.\n\n💡 **Utilidad:** Comparar semanas o meses sin volver a ejecutar la extracción.\n\n🧮 **Cálculo:** DuckDB consulta las particiones diarias del rango seleccionado.")
+        
+        motor = obtener_motor_analitico()
+        fechas_guardadas = fechas_disponibles()
+        
+        if motor.disponible() and fechas_guardadas:
+            primera = datetime.strptime(fechas_guardadas[0], "%Y-%m-%d").date()
+            ultima = datetime.strptime(fechas_guardadas[-1], "%Y-%m-%d").date()
+            rango_hist = st.date_input(
+                "Rango de fechas",
+                value=(max(primera, ultima - timedelta(days=29)), ultima),
+                min_value=primera,
+                max_value=ultima,
+                key="rango_historico"
+            )
+            
+            if isinstance(rango_hist, (tuple, list)) and len(rango_hist) == 2:
+                desde_hist, hasta_hist = rango_hist
+                st.caption(f"{len([f for f in fechas_guardadas if str(desde_hist) <= f <= str(hasta_hist)])} días procesados en el rango")
+                
+                resumen_hist = motor.resumen_diario(desde_hist, hasta_hist)
+                fig_hist = px.line(resumen_hist, x='fecha', y='transbordos', markers=True,
+                                   labels={'fecha': 'Fecha', 'transbordos': 'Transbordos'})
+                fig_hist.update_layout(height=350)
+                st.plotly_chart(fig_hist, use_container_width=True)
+                
+                col_h1, col_h2 = st.columns(2)
+                with col_h1:
+                    st.markdown("##### 💰 Distribución de Descuentos")
+                    desc_hist = motor.distribucion_descuentos(desde_hist, hasta_hist)
+                    fig_desc_hist = px.pie(desc_hist, values='Cantidad', names='Tipo de Descuento', hole=0.4,
+                                           color_discrete_sequence=px.colors.qualitative.Set3)
+                    st.plotly_chart(fig_desc_hist, use_container_width=True)
+                with col_h2:
+                    st.markdown("##### ⏱️ Intervalos (minutos)")
+                    hist_rango = motor.histograma_intervalos(desde_hist, hasta_hist)
+                    fig_int_hist = px.bar(hist_rango.bins(), x='centro_min', y='cantidad',
+                                          labels={'centro_min': 'Intervalo (minutos)', 'cantidad': 'Frecuencia'},
+                                          color_discrete_sequence=['#2ecc71'])
+                    fig_int_hist.update_layout(bargap=0)
+                    st.plotly_chart(fig_int_hist, use_container_width=True)
+                    if hist_rango.n > 0:
+                        st.caption(
+                            f"Promedio {hist_rango.media():.1f} min · mediana {hist_rango.cuantil(0.5):.1f} min · "
+                            f"p90 {hist_rango.cuantil(0.9):.1f} min · {hist_rango.n:,} transbordos"
+                        )
+                
+                st.markdown("##### 🔄 Matriz de Flujo entre Empresas")
+                matriz_hist = motor.matriz_empresas(desde_hist, hasta_hist)
+                if len(matriz_hist) > 0:
+                    pivot_hist = matriz_hist.pivot(index='empresa_madre', columns='empresa_transbordo', values='cantidad').fillna(0)
+                    fig_mat_hist = px.imshow(pivot_hist, labels=dict(x="Empresa Transbordo", y="Empresa Madre", color="Cantidad"),
+                                             color_continuous_scale='Blues')
+                    fig_mat_hist.update_layout(height=600)
+                    st.plotly_chart(fig_mat_hist, use_container_width=True)
+                
+                st.markdown("##### 🕸️ Conexiones entre Rutas más frecuentes")
+                red_hist = motor.red_rutas(desde_hist, hasta_hist)
+                if red_hist.n_aristas > 0:
+                    st.caption(f"{red_hist.n_rutas:,} rutas · {red_hist.n_aristas:,} conexiones en el rango")
+                    st.dataframe(red_hist.top_aristas(20, incluir_misma_ruta=False), use_container_width=True, hide_index=True)
+        else:
+            st.info("Aún no hay días guardados en Parquet. Cada procesamiento agrega su día al histórico.")
+
+elif not resultado:
     st.info("👈 Selecciona una fecha y presiona **Procesar Datos** para comenzar el análisis.")
+
+# ======================================================
+# PANEL DE PERFILADO
+# ======================================================
+if perf.activo:
+    perf.detener()
+    with st.expander("🩺 Perfilado de esta ejecución", expanded=False):
+        st.markdown("**Tiempos por etapa y tab**")
+        st.dataframe(perf.reporte_etapas(), use_container_width=True, hide_index=True)
+        st.markdown(f"**Top {len(perf.asignaciones)} ubicaciones por memoria asignada (tracemalloc)**")
+        st.dataframe(perf.reporte_asignaciones(), use_container_width=True, hide_index=True)
+        st.caption(f"{len(perf.muestras):,} muestras de pila cada {perf.intervalo * 1000:.0f} ms (solo el hilo del script; los workers de vinculación no se muestrean).")
+        col_p1, col_p2 = st.columns(2)
+        with col_p1:
+            st.download_button(
+                "📥 Descargar perfil (speedscope)",
+                data=perf.speedscope(),
+                file_name=f"perfil_transbordos_{datetime.now():%Y%m%d_%H%M%S}.speedscope.json",
+                mime="application/json",
+                help="Abrir en https://www.speedscope.app"
+            )
+        with col_p2:
+            st.download_button(
+                "📥 Descargar pilas colapsadas (flamegraph)",
+                data=perf.pilas_colapsadas(),
+                file_name=f"perfil_transbordos_{datetime.now():%Y%m%d_%H%M%S}.folded.txt",
+                mime="text/plain"
+            )
@@ -0,0 +1,273 @@
+"""
+API HTTP de solo lectura sobre los resultados de transbordos guardados en Parquet.
+
+Sirve los agregados que ya calcularon el dashboard, el arranque o programador.py
+(ver motor_analitico.py) sin tocar la réplica ni el proceso de Streamlit:
+
+    GET /dias                                  frescura de cada día guardado (procesado_en, origen, ...)
+    GET /resumen?desde=&hasta=                 transbordos, tarjetas y ahorro por día
+    GET /descuentos?desde=&hasta=              distribución por tipo de descuento
+    GET /od?desde=&hasta=&nivel=empresa|ruta   matriz origen-destino
+    GET /intervalos?desde=&hasta=&ancho=       histograma de intervalos y cuantiles
+    GET /tarjetas/{serial}/linea-de-tiempo     validaciones de una tarjeta y sus transbordos
+
+Sin `desde`/`hasta` se usa el último día guardado. Cada respuesta lleva ETag y
+Last-Modified derivados de los archivos de las particiones del rango, así que
+un cliente que revalida recibe 304 mientras no se reescriba ningún día; las
+respuestas grandes se comprimen con gzip. Los endpoints son síncronos: FastAPI
+los corre en su pool de hilos y cada consulta usa su propio cursor de DuckDB.
+
+Uso:
+    python api_transbordos.py
+    uvicorn api_transbordos:app --host 0.0.0.0 --port 8600
+"""
+import hashlib
+import json
+import math
+import os
+import threading
+from collections import OrderedDict
+from datetime import date, datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Optional
+
+from fastapi import FastAPI, HTTPException, Query, Request, Response
+from fastapi.middleware.gzip import GZipMiddleware
+
+from agregaciones import ANCHO_BIN_VISUAL_MIN
+from arranque import frescura
+from motor_analitico import PARQUET_DIR, MotorAnalitico, archivos_particion, fechas_disponibles
+
+# ======================================================
+# CONFIGURACIÓN
+# ======================================================
+API_HOST = os.getenv("TRANSBORDOS_API_HOST", "0.0.0.0")
+API_PORT = int(os.getenv("TRANSBORDOS_API_PORT", "8600"))
+# Segundos que un cliente puede reutilizar una respuesta antes de revalidar con ETag
+MAX_AGE_S = int(os.getenv("TRANSBORDOS_API_MAX_AGE_S", "60"))
+# Respuestas serializadas que se conservan en memoria (clave: ruta, parámetros y ETag)
+ENTRADAS_CACHE = int(os.getenv("TRANSBORDOS_API_CACHE_ENTRADAS", "256"))
+MAX_DIAS_RANGO = int(os.getenv("TRANSBORDOS_API_MAX_DIAS", "366"))
+GZIP_MINIMO_BYTES = 1024
+
+motor = MotorAnalitico(PARQUET_DIR, threads=os.getenv("TRANSBORDOS_API_THREADS"))
+app = FastAPI(title="Transbordos", description="Agregados de transbordos precalculados (solo lectura)")
+app.add_middleware(GZipMiddleware, minimum_size=GZIP_MINIMO_BYTES)
+
+
+# ======================================================
+# VERSIÓN DE LOS DATOS (ETAG / LAST-MODIFIED)
+# ======================================================
+def version_datos(fechas, directorio=PARQUET_DIR):
+    """
+    (etag, ultima_modificacion) de un conjunto de días. El ETag cambia si
+    aparece, desaparece o se reescribe cualquier archivo de esas particiones.
+    """
+    firma = hashlib.sha1()
+    ultima = 0.0
+    for fecha in fechas:
+        for path in archivos_particion(fecha, directorio):
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            firma.update(f"{path}:{st.st_mtime_ns}:{st.st_size};".encode())
+            ultima = max(ultima, st.st_mtime)
+    return firma.hexdigest()[:20], datetime.fromtimestamp(int(ultima), tz=timezone.utc)
+
+
+def _no_modificado(request, etag, ultima):
+    """True si la revalidación del cliente coincide (If-None-Match tiene prioridad)"""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        etiquetas = {e.strip().removeprefix("W/") for e in if_none_match.split(",")}
+        return "*" in etiquetas or f'"{etag}"' in etiquetas
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return ultima <= parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+# ======================================================
+# SERIALIZACIÓN Y CACHÉ DE RESPUESTAS
+# ======================================================
+_cache = OrderedDict()
+_lock_cache = threading.Lock()
+
+
+def _registros(df):
+    """DataFrame → lista de dicts JSON (NaN → null, fechas ISO)"""
+    return json.loads(df.to_json(orient="records", date_format="iso"))
+
+
+def _numero(x):
+    x = float(x)
+    return x if math.isfinite(x) else None
+
+
+def _cuerpo(clave, calcular):
+    """Respuesta serializada; solo se calcula una vez por versión de los datos"""
+    with _lock_cache:
+        if clave in _cache:
+            _cache.move_to_end(clave)
+            return _cache[clave]
+    cuerpo = json.dumps(calcular(), ensure_ascii=False).encode("utf-8")
+    with _lock_cache:
+        _cache[clave] = cuerpo
+        while len(_cache) > ENTRADAS_CACHE:
+            _cache.popitem(last=False)
+    return cuerpo
+
+
+def _responder(request, fechas, calcular):
+    """JSON con ETag/Last-Modified de las particiones de `fechas`, o 304 si el cliente ya lo tiene"""
+    etag, ultima = version_datos(fechas)
+    cabeceras = {
+        "ETag": f'"{etag}"',
+        "Last-Modified": format_datetime(ultima, usegmt=True),
+        "Cache-Control": f"public, max-age={MAX_AGE_S}",
+    }
+    if _no_modificado(request, etag, ultima):
+        return Response(status_code=304, headers=cabeceras)
+    clave = (request.url.path, str(sorted(request.query_params.multi_items())), etag)
+    return Response(_cuerpo(clave, calcular), media_type="application/json", headers=cabeceras)
+
+
+def _rango(desde, hasta):
+    """Fechas guardadas dentro de [desde, hasta]; sin rango se usa el último día disponible"""
+    disponibles = fechas_disponibles()
+    if not disponibles:
+        raise HTTPException(404, "No hay días procesados")
+    hasta = hasta.isoformat() if hasta else (desde.isoformat() if desde else disponibles[-1])
+    desde = desde.isoformat() if desde else hasta
+    if desde > hasta:
+        raise HTTPException(400, "`desde` es posterior a `hasta`")
+    if (date.fromisoformat(hasta) - date.fromisoformat(desde)).days >= MAX_DIAS_RANGO:
+        raise HTTPException(400, f"El rango no puede superar {MAX_DIAS_RANGO} días")
+    return desde, hasta, [f for f in disponibles if desde <= f <= hasta]
+
+
+def _con_rango(desde, hasta, fechas, **datos):
+    return {"desde": desde, "hasta": hasta, "dias": fechas, **datos}
+
+
+# ======================================================
+# ENDPOINTS
+# ======================================================
+@app.get("/salud")
+def salud():
+    return {"estado": "ok", "dias": len(fechas_disponibles())}
+
+
+@app.get("/dias")
+def dias(request: Request):
+    fechas = fechas_disponibles()
+    # Sin antiguedad_h: depende de la hora de la consulta y el cuerpo se cachea por ETag
+    # de los archivos; el cliente la deriva de procesado_en
+    return _responder(request, fechas, lambda: _registros(frescura(fechas).drop(columns=["antiguedad_h"])))
+
+
+@app.get("/resumen")
+def resumen(request: Request, desde: Optional[date] = None, hasta: Optional[date] = None):
+    desde, hasta, fechas = _rango(desde, hasta)
+
+    def calcular():
+        df = motor.resumen_diario(desde, hasta)
+        df["fecha"] = df["fecha"].astype(str)
+        return _con_rango(desde, hasta, fechas, filas=_registros(df))
+
+    return _responder(request, fechas, calcular)
+
+
+@app.get("/descuentos")
+def descuentos(request: Request, desde: Optional[date] = None, hasta: Optional[date] = None):
+    desde, hasta, fechas = _rango(desde, hasta)
+    return _responder(request, fechas, lambda: _con_rango(
+        desde, hasta, fechas, filas=_registros(motor.distribucion_descuentos(desde, hasta))
+    ))
+
+
+@app.get("/od")
+def origen_destino(request: Request, desde: Optional[date] = None, hasta: Optional[date] = None,
+                   nivel: str = Query("empresa", pattern="^(empresa|ruta)$"),
+                   top: int = Query(100, ge=1, le=10000), misma_ruta: bool = True):
+    """Por empresa: matriz completa. Por ruta: las `top` aristas más cargadas y el tamaño de la red."""
+    desde, hasta, fechas = _rango(desde, hasta)
+
+    def calcular():
+        if nivel == "empresa":
+            return _con_rango(desde, hasta, fechas, nivel=nivel, aristas=_registros(motor.matriz_empresas(desde, hasta)))
+        red = motor.red_rutas(desde, hasta)
+        return _con_rango(
+            desde, hasta, fechas, nivel=nivel,
+            rutas=red.n_rutas, n_aristas=red.n_aristas, densidad=_numero(red.densidad()),
+            aristas=_registros(red.top_aristas(top, incluir_misma_ruta=misma_ruta)),
+        )
+
+    return _responder(request, fechas, calcular)
+
+
+@app.get("/intervalos")
+def intervalos(request: Request, desde: Optional[date] = None, hasta: Optional[date] = None,
+               ancho: float = Query(ANCHO_BIN_VISUAL_MIN, gt=0, le=120)):
+    desde, hasta, fechas = _rango(desde, hasta)
+
+    def calcular():
+        hist = motor.histograma_intervalos(desde, hasta)
+        return _con_rango(
+            desde, hasta, fechas,
+            n=hist.n, media=_numero(hist.media()),
+            cuantiles={f"p{int(q * 100)}": _numero(hist.cuantil(q)) for q in (0.25, 0.5, 0.75, 0.9, 0.95)},
+            minimo=_numero(hist.minimo), maximo=_numero(hist.maximo),
+            rangos=_registros(hist.rangos()), bins=_registros(hist.bins(ancho)),
+        )
+
+    return _responder(request, fechas, calcular)
+
+
+@app.get("/tarjetas/{serial}/linea-de-tiempo")
+def linea_de_tiempo(request: Request, serial: int, desde: Optional[date] = None, hasta: Optional[date] = None):
+    """Validaciones de la tarjeta en el rango; las que fueron transbordo traen su madre, intervalo y descuento"""
+    desde, hasta, fechas = _rango(desde, hasta)
+
+    def calcular():
+        # El historial de cada día arranca 2.5 h antes de medianoche, así que los
+        # días contiguos se solapan: DISTINCT ON por consecutivo deja un evento por validación
+        df = motor.consultar("""
+            SELECT DISTINCT ON (h.consecutivoevento)
+                h.consecutivoevento,
+                h.fechahoraevento,
+                h.idsam,
+                h.entidad,
+                h.empresa,
+                h.idrutaestacion,
+                h.latitude,
+                h.longitude,
+                h.montoevento,
+                h.numerotransbordos,
+                t.idsam_transbordo IS NOT NULL AS es_transbordo,
+                t.consecutivoevento_madre,
+                t.intervalo,
+                t.tipo_descuento,
+                t.monto_ahorrado,
+                t.clasificacion_transbordo
+            FROM historial h
+            LEFT JOIN (
+                SELECT * FROM transbordos
+                WHERE fecha BETWEEN ? AND ? AND serialmediopago = ?
+            ) t USING (serialmediopago, consecutivoevento)
+            WHERE h.fecha BETWEEN ? AND ? AND h.serialmediopago = ?
+            ORDER BY h.consecutivoevento
+        """, [desde, hasta, serial, desde, hasta, serial])
+        return _con_rango(desde, hasta, fechas, serialmediopago=serial, eventos=_registros(df))
+
+    return _responder(request, fechas, calcular)
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(app, host=API_HOST, port=API_PORT)
@@ -0,0 +1,226 @@
+"""
+Arranque rápido del contenedor del dashboard.
+
+    - precalentamiento: al iniciar el contenedor se procesan ayer y hoy y se
+      guardan como particiones Parquet; el dashboard las carga en el almacén
+      compartido en la primera vista, sin esperar una extracción completa
+    - frescura: cada partición guarda en meta.json cuándo y quién la calculó
+      (dashboard, arranque o programador.py) para mostrarlo en la interfaz
+    - presupuesto de importación: mide con `python -X importtime` cuánto cuesta
+      importar los módulos que el dashboard carga antes de la primera vista
+
+Uso:
+    python arranque.py precalentar [YYYY-MM-DD ...]
+    python arranque.py frescura
+    python arranque.py importaciones
+"""
+import os
+import subprocess
+import sys
+import time
+from datetime import date, datetime, timedelta
+
+import pandas as pd
+
+from motor_analitico import PARQUET_DIR, path_particion, fechas_disponibles, meta_particion
+
+# ======================================================
+# CONFIGURACIÓN
+# ======================================================
+# Días hacia atrás que se precalientan, contando hoy (2 = ayer y hoy)
+DIAS_PRECALENTAR = int(os.getenv("TRANSBORDOS_PRECALENTAR_DIAS", "2"))
+PRESUPUESTO_IMPORTACION_S = float(os.getenv("TRANSBORDOS_PRESUPUESTO_IMPORTACION_S", "1.5"))
+
+# Módulos que el dashboard importa antes de la primera vista
+MODULOS_ARRANQUE = (
+    "streamlit", "pandas", "dotenv",
+    "agregaciones", "exportacion", "score_exceso", "almacen_resultados", "perfilador",
+    "conexiones_db", "extraccion", "motor_analitico", "procesamiento", "arranque", "modo_vivo",
+)
+# Módulos pesados que se importan recién en el tab o la acción que los usa
+MODULOS_DIFERIDOS = (
+    "plotly.express", "duckdb", "consulta_detalle", "red_rutas",
+    "folium", "streamlit_folium", "shapely",
+)
+
+
+def dias_a_precalentar(hoy=None, dias=DIAS_PRECALENTAR):
+    """Fechas a precalentar, de la más antigua a hoy"""
+    hoy = hoy or date.today()
+    return [hoy - timedelta(days=i) for i in range(dias - 1, -1, -1)]
+
+
+def _procesado_en(fecha, directorio=PARQUET_DIR):
+    """Momento de cálculo de la partición del día, o None si falta alguna tabla"""
+    paths = [path_particion(tabla, fecha, directorio) for tabla in ("transbordos", "historial")]
+    if not all(os.path.exists(p) for p in paths):
+        return None
+    meta = meta_particion(fecha, directorio)
+    if meta and meta.get("procesado_en"):
+        return datetime.fromisoformat(meta["procesado_en"])
+    # Particiones anteriores a meta.json: se usa la fecha de escritura
+    return datetime.fromtimestamp(min(os.path.getmtime(p) for p in paths))
+
+
+def _dia_cerrado(fecha, procesado_en):
+    """True si el cálculo se hizo después de terminado el día (no le faltan transacciones)"""
+    fin = datetime.combine(datetime.strptime(fecha, "%Y-%m-%d").date() + timedelta(days=1), datetime.min.time())
+    return procesado_en >= fin
+
+
+# ======================================================
+# FRESCURA
+# ======================================================
+def frescura(fechas=None, directorio=PARQUET_DIR, ahora=None):
+    """
+    Una fila por día con partición guardada: cuándo se calculó, cuánto tardó,
+    quién lo calculó (dashboard, arranque, programador) y si el día ya estaba cerrado.
+    """
+    ahora = ahora or datetime.now()
+    filas = []
+    for fecha in fechas or fechas_disponibles(directorio=directorio):
+        procesado_en = _procesado_en(fecha, directorio)
+        if procesado_en is None:
+            continue
+        meta = meta_particion(fecha, directorio) or {}
+        filas.append({
+            "fecha": fecha,
+            "procesado_en": procesado_en.strftime("%Y-%m-%d %H:%M"),
+            "antiguedad_h": round((ahora - procesado_en).total_seconds() / 3600, 1),
+            "duracion_s": meta.get("duracion_s"),
+            "transbordos": meta.get("transbordos"),
+            "origen": meta.get("origen"),
+            "completo": _dia_cerrado(fecha, procesado_en),
+        })
+    return pd.DataFrame(filas, columns=["fecha", "procesado_en", "antiguedad_h", "duracion_s", "transbordos", "origen", "completo"])
+
+
+# ======================================================
+# PRECALENTAMIENTO (PROCESO DE ARRANQUE)
+# ======================================================
+def precalentar(fechas=None, directorio=PARQUET_DIR, origen="arranque"):
+    """
+    Procesa y guarda en Parquet los días indicados (por defecto ayer y hoy).
+    Un día ya cerrado cuya partición se calculó después de medianoche no se
+    vuelve a procesar; hoy siempre se reprocesa.
+    """
+    from motor_analitico import guardar_particion
+    from procesamiento import procesar_fecha
+
+    for fecha in fechas or dias_a_precalentar():
+        fecha_str = fecha.strftime("%Y-%m-%d")
+        escrito = _procesado_en(fecha_str, directorio)
+        if escrito is not None and _dia_cerrado(fecha_str, escrito):
+            print(f"⏭️ {fecha_str}: partición completa, se omite")
+            continue
+        t0 = time.perf_counter()
+        procesado_en = datetime.now()
+        procesado = procesar_fecha(fecha)
+        if procesado is None:
+            print(f"⚠️ {fecha_str}: sin transbordos")
+            continue
+        df_linked, df_history = procesado
+        guardar_particion(fecha_str, df_linked, df_history, directorio, meta={
+            "procesado_en": procesado_en.isoformat(),
+            "duracion_s": round(time.perf_counter() - t0, 1),
+            "transbordos": int(len(df_linked)),
+            "origen": origen,
+        })
+        print(f"🔥 {fecha_str}: {len(df_linked):,} transbordos precalentados en {time.perf_counter() - t0:.1f}s")
+
+
+# ======================================================
+# CARGA EN EL ALMACÉN (PROCESO DEL DASHBOARD)
+# ======================================================
+def cargar_precalentados(fechas=None, directorio=PARQUET_DIR):
+    """
+    Publica en el almacén compartido las particiones de los días indicados que
+    sean más nuevas que lo que ya tiene. Si no hay nada nuevo solo cuesta leer
+    meta.json, así que se puede llamar en cada ejecución del script.
+    Devuelve las fechas cargadas.
+    """
+    from procesamiento import publicar_resultado, resultado_en_almacen
+
+    cargadas = []
+    for fecha in fechas or dias_a_precalentar():
+        fecha_str = fecha.strftime("%Y-%m-%d")
+        escrito = _procesado_en(fecha_str, directorio)
+        if escrito is None:
+            continue
+        actual = resultado_en_almacen(fecha_str)
+        if actual is not None and actual['procesado_en'] >= escrito.isoformat():
+            continue
+        df_linked = pd.read_parquet(path_particion("transbordos", fecha_str, directorio))
+        df_history = pd.read_parquet(path_particion("historial", fecha_str, directorio))
+        meta = meta_particion(fecha_str, directorio) or {}
+        publicar_resultado(fecha_str, df_linked, df_history, {
+            'procesado_en': escrito.isoformat(),
+            'tiempo_proceso': meta.get('duracion_s'),
+            'origen': meta.get('origen') or 'parquet',
+        })
+        cargadas.append(fecha_str)
+    return cargadas
+
+
+# ======================================================
+# PRESUPUESTO DE IMPORTACIÓN
+# ======================================================
+def reporte_importaciones(modulos=MODULOS_ARRANQUE + MODULOS_DIFERIDOS):
+    """
+    Tiempo acumulado de importación de cada módulo en un intérprete nuevo, en
+    el orden dado (las dependencias compartidas se cargan al primero que las usa).
+    """
+    # __import__ (no importlib.import_module) para que -X importtime registre el módulo pedido
+    codigo = (
+        f"for m in {list(modulos)!r}:\n"
+        "    try:\n"
+        "        __import__(m)\n"
+        "    except ImportError:\n"
+        "        print(m)\n"
+    )
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", codigo],
+        capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__))
+    )
+    faltantes = set(proc.stdout.split())
+    acumulado = {}
+    for linea in proc.stderr.splitlines():
+        # "import time:  self [us] | cumulative | imported package"; sin sangría = nivel superior
+        if not linea.startswith("import time:") or "|" not in linea:
+            continue
+        _, cumulativo, nombre = linea.split("|")
+        if nombre.strip() in modulos and not nombre[1:].startswith(" ") and cumulativo.strip().isdigit():
+            acumulado[nombre.strip()] = int(cumulativo) / 1e6
+    return pd.DataFrame([
+        {
+            "modulo": m,
+            "fase": "arranque" if m in MODULOS_ARRANQUE else "diferido",
+            "segundos": round(acumulado.get(m, 0.0), 3),
+            "instalado": m not in faltantes,
+        }
+        for m in modulos
+    ])
+
+
+def _imprimir_reporte(presupuesto_s=PRESUPUESTO_IMPORTACION_S):
+    df = reporte_importaciones()
+    print(df.to_string(index=False))
+    total = df.loc[df["fase"] == "arranque", "segundos"].sum()
+    diferido = df.loc[df["fase"] == "diferido", "segundos"].sum()
+    print(f"\n⏱️ Importación antes de la primera vista: {total:.2f}s (presupuesto {presupuesto_s:.2f}s)")
+    print(f"💤 Diferido a tabs/acciones: {diferido:.2f}s")
+    return total <= presupuesto_s
+
+
+if __name__ == "__main__":
+    accion = sys.argv[1] if len(sys.argv) > 1 else ""
+    if accion == "precalentar":
+        fechas = [datetime.strptime(f, "%Y-%m-%d").date() for f in sys.argv[2:]]
+        precalentar(fechas or None)
+    elif accion == "frescura":
+        print(frescura().to_string(index=False))
+    elif accion == "importaciones":
+        sys.exit(0 if _imprimir_reporte() else 1)
+    else:
+        print("Uso: python arranque.py precalentar [YYYY-MM-DD ...] | frescura | importaciones")
+        sys.exit(1)
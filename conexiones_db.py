@@ -0,0 +1,422 @@
+"""
+Capa de acceso a base de datos instrumentada, compartida por el ETL y las apps Streamlit.
+
+Cada sentencia ejecutada a través de estas conexiones queda registrada con:
+    - huella (SQL normalizado sin literales) y texto de muestra
+    - tiempo de ejecución (servidor + red) y tiempo de fetch/conversión en Python
+    - filas y bytes devueltos
+    - tiempo de espera para obtener la conexión
+Opcionalmente (TRANSBORDOS_EXPLAIN=1) se captura EXPLAIN (ANALYZE, BUFFERS) de
+cada SELECT leído con leer_sql, lo que permite separar el tiempo en el servidor
+del tiempo en la red.
+
+Las apps obtienen conexiones de un pool por base (con keepalives y verificación
+de salud al reutilizarlas) y las consultas repetidas se ejecutan como sentencias
+preparadas con parámetros enlazados, de modo que el servidor reutiliza el plan.
+"""
+import hashlib
+import os
+import re
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import pandas as pd
+import psycopg2
+import psycopg2.extensions
+import psycopg2.pool
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# ======================================================
+# CONFIGURACIÓN DE CONEXIONES
+# ======================================================
+DB_TRANSACCIONES = {
+    "host": os.getenv("DB_TRANSACCIONES_HOST", "replicatransacciones.vmt.gov.py"),
+    "port": os.getenv("DB_TRANSACCIONES_PORT", "5435"),
+    "dbname": os.getenv("DB_TRANSACCIONES_NAME", "transacciones"),
+    "user": os.getenv("DB_TRANSACCIONES_USER", "devmt"),
+    "password": os.getenv("DB_TRANSACCIONES_PASS", "FootgearBlinkedDigFreewillStricken"),
+    "options": "-c statement_timeout=0"
+}
+
+DB_MONITOREO = {
+    "host": os.getenv("DB_MONITOREO_HOST", "168.90.177.232"),
+    "port": os.getenv("DB_MONITOREO_PORT", "2024"),
+    "dbname": os.getenv("DB_MONITOREO_NAME", "bbdd-monitoreo-cid"),
+    "user": os.getenv("DB_MONITOREO_USER", "FPorta"),
+    "password": os.getenv("DB_MONITOREO_PASS", "portaf2024")
+}
+
+BASES = {
+    "transacciones": DB_TRANSACCIONES,
+    "monitoreo": DB_MONITOREO,
+}
+
+# TCP keepalives: detectan conexiones muertas en consultas largas y en el pool
+KEEPALIVES = {
+    "keepalives": 1,
+    "keepalives_idle": 30,
+    "keepalives_interval": 10,
+    "keepalives_count": 5,
+}
+
+POOL_MIN = int(os.getenv("TRANSBORDOS_POOL_MIN", "1"))
+POOL_MAX = int(os.getenv("TRANSBORDOS_POOL_MAX", "8"))
+# Una conexión ociosa por más de estos segundos se verifica con SELECT 1 antes de entregarla
+VERIFICAR_TRAS_S = 30
+
+CAPTURAR_EXPLAIN = os.getenv("TRANSBORDOS_EXPLAIN", "0") == "1"
+MAX_REGISTROS = 5000
+
+# ======================================================
+# HUELLA DE CONSULTAS
+# ======================================================
+_RE_STRING = re.compile(r"'(?:[^']|'')*'")
+_RE_NUMERO = re.compile(r"\b\d+(?:\.\d+)?\b")
+_RE_LISTA = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+_RE_LISTAS = re.compile(r"\(\.\.\.\)(?:\s*,\s*\(\.\.\.\))+")
+_RE_ESPACIOS = re.compile(r"\s+")
+
+
+def normalizar_sql(sql):
+    """SQL sin literales ni espacios redundantes: consultas iguales salvo valores comparten huella"""
+    if isinstance(sql, bytes):
+        sql = sql.decode("utf-8", errors="replace")
+    sql = _RE_STRING.sub("?", sql)
+    sql = _RE_NUMERO.sub("?", sql)
+    sql = sql.replace("%s", "?")
+    sql = re.sub(r"%\(\w+\)s", "?", sql)
+    sql = _RE_LISTA.sub("(...)", sql)
+    sql = _RE_LISTAS.sub("(...)", sql)
+    return _RE_ESPACIOS.sub(" ", sql).strip()
+
+
+def huella_sql(sql):
+    return hashlib.md5(normalizar_sql(sql).encode("utf-8")).hexdigest()[:12]
+
+
+# ======================================================
+# REGISTRO DE CONSULTAS
+# ======================================================
+class RegistroConsultas:
+    """Registro en memoria (acotado) de las sentencias ejecutadas por el proceso"""
+
+    def __init__(self, max_registros=MAX_REGISTROS):
+        self._registros = deque(maxlen=max_registros)
+        self._lock = threading.Lock()
+        self._contador = 0
+        self.capturar_explain = CAPTURAR_EXPLAIN
+
+    def agregar(self, registro):
+        with self._lock:
+            self._contador += 1
+            registro["id"] = self._contador
+            self._registros.append(registro)
+        return registro
+
+    def marca(self):
+        """Id del último registro; sirve para listar solo lo ejecutado después"""
+        with self._lock:
+            return self._contador
+
+    def registros(self, desde=0):
+        with self._lock:
+            return [dict(r) for r in self._registros if r["id"] > desde]
+
+    def resumen(self, desde=0):
+        """Una fila por sentencia ejecutada"""
+        df = pd.DataFrame(self.registros(desde))
+        if df.empty:
+            return df
+        columnas = ["id", "db", "huella", "operacion", "espera_conexion_s", "ejecucion_s", "fetch_s",
+                    "servidor_s", "filas", "bytes", "sql"]
+        return df[[c for c in columnas if c in df.columns]]
+
+    def resumen_por_huella(self, desde=0):
+        """Agregado por huella: cantidad, tiempos totales y filas"""
+        df = self.resumen(desde)
+        if df.empty:
+            return df
+        return (
+            df.groupby(["db", "huella"], dropna=False)
+            .agg(
+                ejecuciones=("id", "count"),
+                ejecucion_s=("ejecucion_s", "sum"),
+                fetch_s=("fetch_s", "sum"),
+                filas=("filas", "sum"),
+                bytes=("bytes", "sum"),
+                sql=("sql", "first"),
+            )
+            .reset_index()
+            .sort_values("ejecucion_s", ascending=False)
+        )
+
+    def imprimir_resumen(self, desde=0):
+        """Resumen en consola para los scripts ETL"""
+        df = self.resumen_por_huella(desde)
+        if df.empty:
+            return
+        print("\n🗄️ Consultas SQL (por huella):")
+        for _, r in df.iterrows():
+            print(f"  [{r['db']}] {r['huella']} x{r['ejecuciones']}: ejec {r['ejecucion_s']:.2f}s, "
+                  f"fetch {r['fetch_s']:.2f}s, {int(r['filas']):,} filas | {r['sql'][:90]}")
+
+
+registro_consultas = RegistroConsultas()
+
+
+# ======================================================
+# CONEXIÓN Y CURSOR INSTRUMENTADOS
+# ======================================================
+class CursorInstrumentado(psycopg2.extensions.cursor):
+    """Cursor que registra duración de execute y del fetch posterior"""
+
+    def execute(self, query, vars=None):
+        t0 = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            self._registro_actual = self._registrar(query, vars, time.perf_counter() - t0)
+
+    def executemany(self, query, vars_list):
+        t0 = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            self._registro_actual = self._registrar(query, None, time.perf_counter() - t0)
+
+    def copy_expert(self, sql, file, size=8192):
+        t0 = time.perf_counter()
+        try:
+            return super().copy_expert(sql, file, size)
+        finally:
+            self._registro_actual = self._registrar(sql, None, time.perf_counter() - t0)
+
+    def _registrar(self, query, vars, duracion):
+        conn = self.connection
+        sql = query.decode("utf-8", errors="replace") if isinstance(query, bytes) else str(query)
+        registro = {
+            "db": getattr(conn, "nombre_db", conn.info.dbname),
+            "huella": huella_sql(sql),
+            "operacion": normalizar_sql(sql).split(" ", 1)[0].upper(),
+            "espera_conexion_s": getattr(conn, "espera_conexion_s", None),
+            "ejecucion_s": round(duracion, 4),
+            "fetch_s": 0.0,
+            "servidor_s": None,
+            "filas": self.rowcount if self.rowcount is not None and self.rowcount >= 0 else None,
+            "bytes": None,
+            "sql": normalizar_sql(sql)[:500],
+            "inicio": time.time() - duracion,
+        }
+        # La espera de conexión se atribuye solo a la primera sentencia
+        conn.espera_conexion_s = 0.0
+        conn.ultimo_registro = registro
+        return registro_consultas.agregar(registro)
+
+    def _medir_fetch(self, metodo, *args):
+        t0 = time.perf_counter()
+        filas = metodo(*args)
+        registro = getattr(self, "_registro_actual", None)
+        if registro is not None:
+            registro["fetch_s"] = round(registro["fetch_s"] + time.perf_counter() - t0, 4)
+        return filas
+
+    def fetchall(self):
+        return self._medir_fetch(super().fetchall)
+
+    def fetchmany(self, size=None):
+        return self._medir_fetch(super().fetchmany, size if size is not None else self.arraysize)
+
+    def fetchone(self):
+        return self._medir_fetch(super().fetchone)
+
+
+class ConexionInstrumentada(psycopg2.extensions.connection):
+    """Conexión cuyos cursores son instrumentados por defecto"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Sentencias preparadas en esta sesión del servidor: nombre -> SQL
+        self.preparadas = {}
+        self.ultimo_uso = time.monotonic()
+
+    def cursor(self, *args, **kwargs):
+        kwargs.setdefault("cursor_factory", CursorInstrumentado)
+        return super().cursor(*args, **kwargs)
+
+
+def conectar(config, nombre=None, **kwargs):
+    """psycopg2.connect instrumentado; registra el tiempo de espera de la conexión"""
+    t0 = time.perf_counter()
+    conn = psycopg2.connect(connection_factory=ConexionInstrumentada, **{**KEEPALIVES, **config, **kwargs})
+    conn.nombre_db = nombre or config.get("dbname")
+    conn.espera_conexion_s = round(time.perf_counter() - t0, 4)
+    return conn
+
+
+# ======================================================
+# POOL DE CONEXIONES
+# ======================================================
+class PoolConexiones:
+    """
+    ThreadedConnectionPool que espera (en lugar de fallar) cuando no hay
+    conexiones libres y verifica las conexiones ociosas antes de entregarlas.
+    """
+
+    def __init__(self, nombre, config, minconn=POOL_MIN, maxconn=POOL_MAX):
+        self.nombre = nombre
+        self.maxconn = maxconn
+        self._pool = psycopg2.pool.ThreadedConnectionPool(
+            minconn, maxconn, connection_factory=ConexionInstrumentada, **{**KEEPALIVES, **config}
+        )
+        self._cupos = threading.BoundedSemaphore(maxconn)
+
+    def obtener(self):
+        t0 = time.perf_counter()
+        self._cupos.acquire()
+        try:
+            conn = self._pool.getconn()
+            # Tras un reinicio del servidor todas las ociosas están muertas: se descartan
+            # hasta dar con una sana; agotadas las ociosas, el pool abre una nueva
+            descartadas = 0
+            while not self._sana(conn):
+                self._pool.putconn(conn, close=True)
+                descartadas += 1
+                if descartadas > self.maxconn:
+                    raise psycopg2.OperationalError(f"No hay conexiones sanas en el pool {self.nombre}")
+                conn = self._pool.getconn()
+        except Exception:
+            self._cupos.release()
+            raise
+        conn.nombre_db = self.nombre
+        conn.espera_conexion_s = round(time.perf_counter() - t0, 4)
+        return conn
+
+    def devolver(self, conn):
+        """Devuelve la conexión con la transacción descartada (y sus tablas temporales)"""
+        try:
+            cerrar = bool(conn.closed)
+            if not cerrar:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    cerrar = True
+            conn.ultimo_uso = time.monotonic()
+            self._pool.putconn(conn, close=cerrar)
+        finally:
+            self._cupos.release()
+
+    @staticmethod
+    def _sana(conn):
+        if conn.closed:
+            return False
+        if time.monotonic() - conn.ultimo_uso < VERIFICAR_TRAS_S:
+            return True
+        try:
+            cur = psycopg2.extensions.cursor(conn)
+            cur.execute("SELECT 1")
+            cur.close()
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def cerrar(self):
+        self._pool.closeall()
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def registrar_base(nombre, config):
+    """Agrega una base al catálogo de pools (ej. la base de lluvia de script_lluvia.py)"""
+    BASES[nombre] = config
+
+
+def obtener_pool(nombre):
+    """Pool único por proceso y por base, creado en el primer uso"""
+    with _pools_lock:
+        if nombre not in _pools:
+            _pools[nombre] = PoolConexiones(nombre, BASES[nombre])
+        return _pools[nombre]
+
+
+@contextmanager
+def conexion(nombre):
+    """Conexión del pool para un bloque `with`; se devuelve aunque el bloque falle"""
+    pool = obtener_pool(nombre)
+    conn = pool.obtener()
+    try:
+        yield conn
+    finally:
+        pool.devolver(conn)
+
+
+# ======================================================
+# SENTENCIAS PREPARADAS
+# ======================================================
+def _preparar(conn, nombre, sql):
+    """PREPARE una sola vez por sesión; `sql` usa marcadores $1, $2, ..."""
+    if conn.preparadas.get(nombre) == sql:
+        return
+    cur = psycopg2.extensions.cursor(conn)
+    try:
+        if nombre in conn.preparadas:
+            cur.execute(f"DEALLOCATE {nombre}")
+        cur.execute(f"PREPARE {nombre} AS {sql}")
+    finally:
+        cur.close()
+    conn.preparadas[nombre] = sql
+
+
+def _sql_execute(nombre, params):
+    return f"EXECUTE {nombre}" + (f" ({', '.join(['%s'] * len(params))})" if params else "")
+
+
+def ejecutar_preparada(cur, nombre, sql, params=()):
+    """Ejecuta la sentencia preparada `nombre` (preparándola si hace falta) con parámetros enlazados"""
+    _preparar(cur.connection, nombre, sql)
+    cur.execute(_sql_execute(nombre, params), tuple(params))
+
+
+def leer_preparada(nombre, sql, conn, params=()):
+    """leer_sql sobre una sentencia preparada: el plan se reutiliza entre ejecuciones"""
+    _preparar(conn, nombre, sql)
+    return leer_sql(_sql_execute(nombre, params), conn, params=tuple(params))
+
+
+def _capturar_explain(conn, query, params, registro):
+    if not normalizar_sql(query).upper().startswith(("SELECT", "WITH", "EXECUTE")):
+        return
+    cur = psycopg2.extensions.cursor(conn)
+    try:
+        cur.execute("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + query, params)
+        plan = cur.fetchone()[0]
+        plan = plan[0] if isinstance(plan, list) else plan
+        registro["servidor_s"] = round(plan.get("Execution Time", 0) / 1000, 4)
+        registro["plan"] = plan
+    except Exception as e:
+        conn.rollback()
+        registro["plan_error"] = str(e)
+    finally:
+        cur.close()
+
+
+def leer_sql(query, conn, params=None):
+    """
+    pd.read_sql instrumentado: agrega filas y bytes del DataFrame al registro y,
+    si está habilitado, captura EXPLAIN (ANALYZE, BUFFERS) de la consulta.
+    """
+    conn.ultimo_registro = None
+    df = pd.read_sql(query, conn, params=params)
+    registro = getattr(conn, "ultimo_registro", None)
+    if registro is not None:
+        registro["filas"] = len(df)
+        registro["bytes"] = int(df.memory_usage(deep=True).sum())
+        if registro_consultas.capturar_explain:
+            _capturar_explain(conn, query, params, registro)
+    return df
@@ -0,0 +1,140 @@
+"""
+Consulta paginada de la grilla de "Datos Detallados".
+
+DuckDB escanea una vista Arrow del DataFrame en memoria; filtro, orden y
+OFFSET/LIMIT se resuelven dentro del motor y solo la página pedida vuelve a
+pandas.
+"""
+import threading
+import weakref
+from contextlib import contextmanager
+
+import duckdb
+import pyarrow as pa
+
+# ======================================================
+# CONFIGURACIÓN
+# ======================================================
+EPS_SQL = "CASE {col} WHEN '0002' THEN 'TDP' WHEN '0003' THEN 'EPAS' ELSE 'Desconocida' END"
+
+# Columnas derivadas que la grilla agrega sobre el DataFrame vinculado
+COLUMNAS_DERIVADAS = {
+    'EPS Origen': EPS_SQL.format(col='entidad_madre'),
+    'EPS Destino': EPS_SQL.format(col='entidad_transbordo'),
+}
+
+# Clave natural de un transbordo; desempata el orden para que las páginas no se solapen
+CLAVE_DESEMPATE = ['serialmediopago', 'consecutivoevento', 'idsam_transbordo']
+
+_con = duckdb.connect()
+_lock = threading.Lock()
+
+# Vista Arrow por DataFrame: se convierte una vez y se reutiliza en cada rerun
+_cache_arrow = {}
+MAX_CACHE_ARROW = 4
+
+
+def _ident(nombre):
+    return '"' + nombre.replace('"', '""') + '"'
+
+
+def _como_arrow(df):
+    """Tabla Arrow del DataFrame, cacheada mientras el DataFrame siga vivo"""
+    if isinstance(df, pa.Table):
+        return df
+    entrada = _cache_arrow.get(id(df))
+    if entrada is not None and entrada[0]() is df:
+        return entrada[1]
+    tabla = pa.Table.from_pandas(df, preserve_index=False)
+    with _lock:
+        for clave in [k for k, (ref, _) in _cache_arrow.items() if ref() is None]:
+            del _cache_arrow[clave]
+        while len(_cache_arrow) >= MAX_CACHE_ARROW:
+            del _cache_arrow[next(iter(_cache_arrow))]
+        _cache_arrow[id(df)] = (weakref.ref(df), tabla)
+    return tabla
+
+
+def _cursor():
+    # Cada sesión de Streamlit corre en su propio hilo: un cursor por consulta
+    with _lock:
+        return _con.cursor()
+
+
+def _armar_consulta(tabla, filtros):
+    columnas_validas = set(tabla.column_names) | set(COLUMNAS_DERIVADAS)
+    derivadas = ", ".join(f"{expr} AS {_ident(nombre)}" for nombre, expr in COLUMNAS_DERIVADAS.items())
+    condiciones, params = [], []
+    for columna, valores in (filtros or {}).items():
+        if not valores:
+            continue
+        if columna not in columnas_validas:
+            raise ValueError(f"Columna de filtro desconocida: {columna}")
+        condiciones.append(f"list_contains(?, {_ident(columna)})")
+        params.append([str(v) for v in valores])
+    where = ("WHERE " + " AND ".join(condiciones)) if condiciones else ""
+    base = f"SELECT * FROM (SELECT *, {derivadas} FROM datos) {where}"
+    return base, params, columnas_validas
+
+
+def _ordenar(tabla, base, columnas_validas, columnas=None, orden=None, ascendente=True):
+    """SELECT sobre la consulta filtrada con el orden pedido más la clave de desempate"""
+    if orden is not None and orden not in columnas_validas:
+        raise ValueError(f"Columna de orden desconocida: {orden}")
+    for columna in columnas or []:
+        if columna not in columnas_validas:
+            raise ValueError(f"Columna desconocida: {columna}")
+
+    select = ", ".join(_ident(c) for c in columnas) if columnas else "*"
+    claves_orden = ([orden] if orden else []) + [c for c in CLAVE_DESEMPATE if c in tabla.column_names and c != orden]
+    direccion = "ASC" if ascendente else "DESC"
+    order_by = ", ".join(f"{_ident(c)} {direccion} NULLS LAST" for c in claves_orden)
+    sql = f"SELECT {select} FROM ({base})"
+    if order_by:
+        sql += f" ORDER BY {order_by}"
+    return sql
+
+
+def consultar_pagina(df, filtros=None, columnas=None, orden=None, ascendente=True, offset=0, limit=1000):
+    """
+    Devuelve (pagina_df, total) para los filtros dados.
+
+    `df` puede ser un DataFrame o una tabla Arrow.
+    `filtros` es un dict {columna: [valores]}; listas vacías no filtran.
+    `columnas=None` devuelve todas las columnas (incluidas las derivadas);
+    con `limit=None` se devuelve el resultado completo.
+    """
+    tabla = _como_arrow(df)
+    base, params, columnas_validas = _armar_consulta(tabla, filtros)
+    sql = _ordenar(tabla, base, columnas_validas, columnas, orden, ascendente)
+    params_pagina = list(params)
+    if limit is not None:
+        sql += " LIMIT ? OFFSET ?"
+        params_pagina += [int(limit), int(offset)]
+
+    cur = _cursor()
+    try:
+        cur.register('datos', tabla)
+        total = cur.execute(f"SELECT count(*) FROM ({base})", params).fetchone()[0]
+        pagina = cur.execute(sql, params_pagina).df()
+    finally:
+        cur.close()
+    return pagina, total
+
+
+@contextmanager
+def lector_filtrado(df, filtros=None, columnas=None, orden=None, ascendente=True, filas_por_bloque=100_000):
+    """
+    Resultado filtrado y ordenado como pa.RecordBatchReader de lotes de
+    `filas_por_bloque` filas. DuckDB entrega los lotes a medida que se leen,
+    así que el resultado completo nunca se arma en pandas (para exportaciones).
+    """
+    tabla = _como_arrow(df)
+    base, params, columnas_validas = _armar_consulta(tabla, filtros)
+    sql = _ordenar(tabla, base, columnas_validas, columnas, orden, ascendente)
+    cur = _cursor()
+    try:
+        cur.register('datos', tabla)
+        yield cur.execute(sql, params).fetch_record_batch(filas_por_bloque)
+    finally:
+        cur.close()
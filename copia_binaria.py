@@ -0,0 +1,369 @@
+"""
+Extracción por COPY binario decodificado directamente a columnas NumPy.
+
+`pd.read_sql` convierte cada valor a un objeto Python (Decimal, datetime,
+str) antes de armar el DataFrame. Aquí la consulta se envuelve en
+`COPY (...) TO STDOUT WITH (FORMAT binary)` y el flujo se decodifica en dos
+pasadas:
+    1) un recorrido por filas que solo ubica el desplazamiento de cada campo
+       (las columnas de ancho fijo se leen con un único struct por fila)
+    2) una conversión vectorizada por columna sobre arreglos preasignados:
+       int2/int4/int8, float4/float8, bool, date, timestamp, numeric y
+       texto (→ categórico)
+
+Con `python copia_binaria.py YYYY-MM-DD` se compara el throughput contra
+pd.read_sql para la consulta de transbordos y la de historial del día.
+"""
+import io
+import re
+import struct
+import sys
+import time
+from array import array
+
+import numpy as np
+import pandas as pd
+import psycopg2.extensions
+
+# ======================================================
+# TIPOS SOPORTADOS (OID de PostgreSQL)
+# ======================================================
+OID_BOOL, OID_INT8, OID_INT2, OID_INT4 = 16, 20, 21, 23
+OID_FLOAT4, OID_FLOAT8 = 700, 701
+OID_DATE, OID_TIMESTAMP, OID_TIMESTAMPTZ = 1082, 1114, 1184
+OID_NUMERIC = 1700
+OID_TEXTO = {18, 19, 25, 1042, 1043}
+
+# Ancho en bytes y dtype big-endian de los tipos de ancho fijo
+ANCHO_FIJO = {
+    OID_BOOL: (1, ">u1"),
+    OID_INT2: (2, ">i2"),
+    OID_INT4: (4, ">i4"),
+    OID_INT8: (8, ">i8"),
+    OID_FLOAT4: (4, ">f4"),
+    OID_FLOAT8: (8, ">f8"),
+    OID_DATE: (4, ">i4"),
+    OID_TIMESTAMP: (8, ">i8"),
+    OID_TIMESTAMPTZ: (8, ">i8"),
+}
+
+FIRMA = b"PGCOPY\n\xff\r\n\x00"
+# Epoch de PostgreSQL (2000-01-01) respecto de 1970-01-01
+EPOCH_PG_US = 946684800 * 1000000
+EPOCH_PG_DIAS = 10957
+# Textos más largos que esto no se categorizan (se decodifican a object)
+MAX_LARGO_CATEGORICO = 64
+
+_I16 = struct.Struct(">h").unpack_from
+_I32 = struct.Struct(">i").unpack_from
+
+
+def _describir(cur, query):
+    """(nombre, oid) de cada columna, sin traer filas"""
+    cur.execute(f"SELECT * FROM ({query}) AS q LIMIT 0")
+    return [(d.name, d.type_code) for d in cur.description]
+
+
+def sustituir_posicionales(cur, query, params):
+    """Reemplaza $1, $2, ... por literales citados (COPY no admite parámetros enlazados)"""
+    if not params:
+        return query
+    literales = [cur.mogrify("%s", (p,)).decode("utf-8") for p in params]
+    return re.sub(r"\$(\d+)", lambda m: literales[int(m.group(1)) - 1], query)
+
+
+# ======================================================
+# PASADA 1: DESPLAZAMIENTOS DE CAMPOS
+# ======================================================
+def _indexar(buf, columnas_fijas, n_variables):
+    """
+    Recorre las filas y devuelve:
+        inicios    : desplazamiento de cada fila (tras el contador de campos)
+        var_offs   : (n, n_variables) desplazamiento de cada campo variable
+        var_lens   : (n, n_variables) largo de cada campo variable (-1 = NULL)
+        excepciones: {fila: [(offset, largo), ...]} filas con NULL en columnas fijas
+    Las columnas fijas van primero, así que en el caso común un único struct
+    valida todos sus largos de una vez; de los campos variables el bucle solo
+    guarda el largo y los desplazamientos se reconstruyen después con cumsum.
+    """
+    if buf[:11] != FIRMA:
+        raise ValueError("Flujo COPY binario inválido")
+    (largo_ext,) = _I32(buf, 15)
+    p = 19 + largo_ext
+
+    anchos = [ancho for ancho, _ in columnas_fijas]
+    prefijo = struct.Struct(">" + "".join(f"i{ancho}x" for ancho in anchos))
+    esperado = tuple(anchos)
+    largo_prefijo = prefijo.size
+    leer_prefijo = prefijo.unpack_from
+    n_fijas = len(anchos)
+    i16, i32 = _I16, _I32
+
+    inicios = array("q")
+    var_lens = array("i")
+    agregar_inicio, agregar_largo = inicios.append, var_lens.append
+    rango_variables = range(n_variables)
+    excepciones = {}
+    while True:
+        (n_campos,) = i16(buf, p)
+        if n_campos == -1:
+            break
+        p += 2
+        agregar_inicio(p)
+        if n_fijas:
+            if leer_prefijo(buf, p) == esperado:
+                p += largo_prefijo
+            else:
+                campos = []
+                for _ in range(n_fijas):
+                    (largo,) = i32(buf, p)
+                    p += 4
+                    campos.append((p, largo))
+                    if largo > 0:
+                        p += largo
+                excepciones[len(inicios) - 1] = campos
+        for _ in rango_variables:
+            (largo,) = i32(buf, p)
+            agregar_largo(largo)
+            p += 4 + largo if largo > 0 else 4
+
+    n = len(inicios)
+    inicios = np.frombuffer(inicios, dtype=np.int64)
+    var_lens = np.frombuffer(var_lens, dtype=np.int32).reshape(n, n_variables)
+
+    # Inicio de la parte variable de cada fila: tras el prefijo fijo (o lo que ocupó en las excepciones)
+    base = inicios + largo_prefijo
+    for fila, campos in excepciones.items():
+        offset, largo = campos[-1]
+        base[fila] = offset + max(largo, 0)
+    ocupado = 4 + np.maximum(var_lens, 0).astype(np.int64)
+    var_offs = base[:, None] + np.cumsum(ocupado, axis=1) - ocupado + 4
+    return inicios, var_offs, var_lens, excepciones
+
+
+# ======================================================
+# PASADA 2: CONVERSIÓN VECTORIZADA POR COLUMNA
+# ======================================================
+def _juntar(bytes_np, offs, ancho):
+    """Matriz (n, ancho) con los bytes de cada campo"""
+    idx = offs[:, None] + np.arange(ancho)
+    np.minimum(idx, len(bytes_np) - 1, out=idx)
+    return bytes_np[idx]
+
+
+def _columna_fija(bytes_np, offs, nulos, oid):
+    ancho, dtype = ANCHO_FIJO[oid]
+    valores = np.ascontiguousarray(_juntar(bytes_np, offs, ancho)).view(dtype).ravel()
+    hay_nulos = nulos.any()
+
+    if oid == OID_BOOL:
+        valores = valores.astype(bool)
+        if hay_nulos:
+            return pd.array(np.where(nulos, None, valores), dtype="boolean")
+        return valores
+    if oid in (OID_TIMESTAMP, OID_TIMESTAMPTZ):
+        fechas = (valores.astype(np.int64) + EPOCH_PG_US).astype("datetime64[us]")
+        fechas[nulos] = np.datetime64("NaT")
+        return pd.DatetimeIndex(fechas, tz="UTC" if oid == OID_TIMESTAMPTZ else None).array
+    if oid == OID_DATE:
+        fechas = (valores.astype(np.int64) + EPOCH_PG_DIAS).astype("datetime64[D]").astype("datetime64[s]")
+        fechas[nulos] = np.datetime64("NaT")
+        return fechas
+    if oid in (OID_FLOAT4, OID_FLOAT8):
+        valores = valores.astype(np.float64)
+        valores[nulos] = np.nan
+        return valores
+    # Enteros: con NULL pasan a float64 con NaN, igual que pd.read_sql
+    if hay_nulos:
+        valores = valores.astype(np.float64)
+        valores[nulos] = np.nan
+        return valores
+    return valores.astype(dtype.replace(">", "="))
+
+
+def _columna_numeric(bytes_np, offs, lens):
+    """
+    numeric binario (dígitos base 10000) → float64. Con hasta 4 grupos de
+    dígitos la mantisa es un entero exacto y una sola división por potencia de
+    10 da el mismo redondeo que float(Decimal).
+    """
+    nulos = lens < 0
+    cabecera = np.ascontiguousarray(_juntar(bytes_np, offs, 8)).view(">i2").reshape(-1, 4).astype(np.int64)
+    n_digitos, peso, signo = cabecera[:, 0], cabecera[:, 1], cabecera[:, 2] & 0xFFFF
+    n_digitos[nulos] = 0
+    max_digitos = int(n_digitos.max()) if len(n_digitos) else 0
+    valores = np.zeros(len(offs), dtype=np.float64)
+    if max_digitos:
+        digitos = np.ascontiguousarray(_juntar(bytes_np, offs + 8, 2 * max_digitos)).view(">i2").astype(np.int64)
+        k = np.arange(max_digitos)
+        validos = k[None, :] < n_digitos[:, None]
+        digitos[~validos] = 0
+        if max_digitos <= 4:
+            potencias = np.where(validos, n_digitos[:, None] - 1 - k[None, :], 0)
+            mantisa = (digitos * 10000 ** potencias).sum(axis=1).astype(np.float64)
+            exponente = 4 * (peso - n_digitos + 1)
+            escala = np.power(10.0, np.abs(exponente))
+            valores = np.where(exponente >= 0, mantisa * escala, mantisa / escala)
+        else:
+            valores = (digitos * np.power(10000.0, peso[:, None] - k[None, :])).sum(axis=1)
+    valores[signo == 0x4000] *= -1
+    valores[(signo == 0xC000) | nulos] = np.nan
+    return valores
+
+
+def _columna_texto(buf, bytes_np, offs, lens, categoricos):
+    nulos = lens < 0
+    largo_max = int(lens.max()) if len(lens) else 0
+    if not categoricos or largo_max > MAX_LARGO_CATEGORICO:
+        return np.array(
+            [None if l < 0 else buf[o:o + l].decode("utf-8") for o, l in zip(offs.tolist(), lens.tolist())],
+            dtype=object,
+        )
+    if largo_max <= 0:
+        codigos = np.where(nulos, -1, 0)
+        return pd.Categorical.from_codes(codigos, categories=[""] if (~nulos).any() else [])
+
+    matriz = _juntar(bytes_np, offs, largo_max)
+    matriz[np.arange(largo_max)[None, :] >= lens[:, None]] = 0
+    # Con relleno de ceros cada valor es un bytes de ancho fijo: np.unique agrupa sin objetos Python
+    fijos = np.ascontiguousarray(matriz).view(f"S{largo_max}").ravel()
+    categorias, codigos = np.unique(fijos[~nulos], return_inverse=True)
+    codigos_todos = np.full(len(fijos), -1, dtype=np.int64)
+    codigos_todos[~nulos] = codigos
+    return pd.Categorical.from_codes(codigos_todos, categories=[c.decode("utf-8") for c in categorias])
+
+
+def decodificar_copy_binario(buf, columnas, categoricos=True):
+    """
+    Decodifica un flujo COPY binario completo a DataFrame. `columnas` = [(nombre, oid)]
+    en el orden del flujo, con las columnas de ancho fijo antes que las variables.
+    """
+    fijas = [(i, c) for i, c in enumerate(columnas) if c[1] in ANCHO_FIJO]
+    variables = [(i, c) for i, c in enumerate(columnas) if c[1] not in ANCHO_FIJO]
+    no_soportadas = [c for _, c in variables if c[1] != OID_NUMERIC and c[1] not in OID_TEXTO]
+    if no_soportadas:
+        raise TypeError(f"Tipos no soportados en COPY binario: {no_soportadas}")
+
+    inicios, var_offs, var_lens, excepciones = _indexar(
+        buf, [ANCHO_FIJO[oid] for _, (_, oid) in fijas], len(variables)
+    )
+    bytes_np = np.frombuffer(buf, dtype=np.uint8)
+    n = len(inicios)
+
+    datos = {}
+    # Offsets de las columnas fijas: constantes respecto del inicio de la fila salvo excepciones
+    desplazamiento = 0
+    for j, (_, (nombre, oid)) in enumerate(fijas):
+        ancho = ANCHO_FIJO[oid][0]
+        offs = inicios + desplazamiento + 4
+        nulos = np.zeros(n, dtype=bool)
+        for fila, campos in excepciones.items():
+            offs[fila], largo = campos[j]
+            nulos[fila] = largo < 0
+        datos[nombre] = _columna_fija(bytes_np, offs, nulos, oid)
+        desplazamiento += 4 + ancho
+
+    for j, (_, (nombre, oid)) in enumerate(variables):
+        offs, lens = var_offs[:, j], var_lens[:, j]
+        if oid == OID_NUMERIC:
+            datos[nombre] = _columna_numeric(bytes_np, offs, lens)
+        else:
+            datos[nombre] = _columna_texto(buf, bytes_np, offs, lens, categoricos)
+
+    return pd.DataFrame({nombre: datos[nombre] for nombre, _ in columnas})
+
+
+# ======================================================
+# LECTURA
+# ======================================================
+def leer_copy_binario(query, conn, params=None, categoricos=True):
+    """
+    Reemplazo de leer_sql/pd.read_sql vía COPY binario. `params` con la sintaxis
+    de psycopg2 (%s / %(nombre)s) se citan en el cliente antes de enviar el COPY.
+    """
+    # La descripción de columnas va por un cursor sin instrumentar: solo el COPY queda registrado
+    cur = psycopg2.extensions.cursor(conn)
+    try:
+        if params:
+            query = cur.mogrify(query, params).decode("utf-8")
+        query = query.strip().rstrip(";")
+        columnas = _describir(cur, query)
+    finally:
+        cur.close()
+
+    # Columnas fijas primero: el índice de filas valida sus largos con un solo struct
+    orden = sorted(columnas, key=lambda c: c[1] not in ANCHO_FIJO)
+    lista = ", ".join('"' + nombre.replace('"', '""') + '"' for nombre, _ in orden)
+    conn.ultimo_registro = None
+    cur = conn.cursor()
+    try:
+        destino = io.BytesIO()
+        cur.copy_expert(f"COPY (SELECT {lista} FROM ({query}) AS q) TO STDOUT WITH (FORMAT binary)", destino)
+        buf = destino.getbuffer().tobytes()
+    finally:
+        cur.close()
+
+    t0 = time.perf_counter()
+    df = decodificar_copy_binario(buf, orden, categoricos)[[nombre for nombre, _ in columnas]]
+    registro = getattr(conn, "ultimo_registro", None)
+    if registro is not None:
+        registro["fetch_s"] = round(time.perf_counter() - t0, 4)
+        registro["filas"] = len(df)
+        registro["bytes"] = len(buf)
+    return df
+
+
+# ======================================================
+# COMPARATIVA
+# ======================================================
+def comparar_motores(fecha, repeticiones=2):
+    """Throughput de pd.read_sql vs COPY binario para transbordos e historial del día"""
+    import warnings
+
+    from conexiones_db import conexion
+    from extraccion import sql_transbordos
+
+    inicio = pd.Timestamp(fecha)
+    fin = inicio + pd.Timedelta(days=1)
+    consultas = {
+        "transbordos": sql_transbordos(),
+        "historial (día completo)": """
+            SELECT idsam, serialmediopago, fechahoraevento, entidad, idrutaestacion,
+                   latitude, longitude, consecutivoevento, montoevento,
+                   númerotransbordos as numerotransbordos
+            FROM c_transacciones
+            WHERE fechahoraevento >= $1 AND fechahoraevento < $2
+              AND tipoevento IN (4, 8)
+        """,
+    }
+    filas = []
+    with conexion("transacciones") as conn, warnings.catch_warnings():
+        warnings.simplefilter("ignore", UserWarning)
+        for nombre, sql in consultas.items():
+            cur = psycopg2.extensions.cursor(conn)
+            sql_literal = sustituir_posicionales(cur, sql, (inicio.to_pydatetime(), fin.to_pydatetime()))
+            cur.close()
+            for motor, leer in (("read_sql", lambda: pd.read_sql(sql_literal, conn)),
+                                ("copy binario", lambda: leer_copy_binario(sql_literal, conn))):
+                tiempos = []
+                for _ in range(repeticiones):
+                    t0 = time.perf_counter()
+                    df = leer()
+                    tiempos.append(time.perf_counter() - t0)
+                mejor = min(tiempos)
+                filas.append({
+                    "consulta": nombre,
+                    "motor": motor,
+                    "filas": len(df),
+                    "segundos": round(mejor, 3),
+                    "filas/s": int(len(df) / mejor) if mejor > 0 else None,
+                    "MB en memoria": round(df.memory_usage(deep=True).sum() / 1024 / 1024, 1),
+                })
+    return pd.DataFrame(filas)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Uso: python copia_binaria.py YYYY-MM-DD")
+        sys.exit(1)
+    print(comparar_motores(sys.argv[1]).to_string(index=False))
@@ -0,0 +1,153 @@
+"""
+Exportación de datos detallados del dashboard de transbordos.
+
+Los archivos se generan solo cuando el usuario los solicita, escribiendo por
+bloques a disco (nunca el archivo completo en memoria) y se reutilizan
+mientras no cambien la fecha, los filtros o el procesamiento de origen.
+Los datos pueden ser un DataFrame o un pa.RecordBatchReader (ver
+consulta_detalle.lector_filtrado), que se escribe lote a lote sin armar el
+resultado filtrado en memoria.
+"""
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+# ======================================================
+# CONFIGURACIÓN
+# ======================================================
+EXPORT_DIR = os.getenv("TRANSBORDOS_EXPORT_DIR", os.path.join(tempfile.gettempdir(), "transbordos_export"))
+FILAS_POR_BLOQUE = 100_000
+# Artefactos sin usar (ni generados ni servidos a ninguna sesión) durante este
+# tiempo se eliminan en cada nueva exportación
+MAX_ANTIGUEDAD_HORAS = 24
+
+FORMATOS = {
+    "CSV": {"extension": "csv", "mime": "text/csv"},
+    "CSV comprimido (gzip)": {"extension": "csv.gz", "mime": "application/gzip"},
+    "Parquet": {"extension": "parquet", "mime": "application/vnd.apache.parquet"},
+}
+
+
+def clave_exportacion(fecha, filtros, formato, version=None):
+    """Clave estable para (fecha, filtros, formato, versión del procesamiento)"""
+    payload = json.dumps(
+        {"fecha": str(fecha), "filtros": filtros, "formato": formato, "version": version},
+        sort_keys=True, default=str
+    )
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()[:16]
+
+
+def _es_lector(datos):
+    return hasattr(datos, "read_next_batch")
+
+
+def _escribir_csv(datos, path, comprimido=False):
+    abrir = gzip.open if comprimido else open
+    with abrir(path, "wt", encoding="utf-8", newline="") as f:
+        if not _es_lector(datos):
+            for inicio in range(0, max(len(datos), 1), FILAS_POR_BLOQUE):
+                datos.iloc[inicio:inicio + FILAS_POR_BLOQUE].to_csv(f, index=False, header=(inicio == 0))
+            return
+        encabezado = True
+        for lote in datos:
+            lote.to_pandas().to_csv(f, index=False, header=encabezado)
+            encabezado = False
+        if encabezado:
+            # Resultado vacío: solo el encabezado
+            datos.schema.empty_table().to_pandas().to_csv(f, index=False)
+
+
+def _escribir_parquet(datos, path):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    if _es_lector(datos):
+        # El esquema lo fija la consulta, no hay que inferirlo de los valores
+        with pq.ParquetWriter(path, datos.schema, compression="zstd") as writer:
+            for lote in datos:
+                writer.write_batch(lote)
+        return
+
+    df = datos
+    # El esquema sale del primer bloque con datos: inferido sobre una porción vacía,
+    # las columnas object (Decimal, textos que empiezan con None) quedan como `null`
+    primer_bloque = df.iloc[:FILAS_POR_BLOQUE]
+    schema = pa.Table.from_pandas(primer_bloque, preserve_index=False).schema
+    for i, campo in enumerate(schema):
+        if pa.types.is_null(campo.type):
+            # Columna vacía en el primer bloque: el tipo se toma del primer valor no nulo
+            no_nulos = df[campo.name].dropna()
+            if len(no_nulos):
+                schema = schema.set(i, campo.with_type(pa.array(no_nulos.iloc[:1].tolist()).type))
+    with pq.ParquetWriter(path, schema, compression="zstd") as writer:
+        for inicio in range(0, max(len(df), 1), FILAS_POR_BLOQUE):
+            bloque = df.iloc[inicio:inicio + FILAS_POR_BLOQUE]
+            writer.write_table(pa.Table.from_pandas(bloque, schema=schema, preserve_index=False))
+
+
+def limpiar_exportaciones(directorio=EXPORT_DIR, max_antiguedad_horas=MAX_ANTIGUEDAD_HORAS):
+    """Elimina artefactos sin uso reciente (la mtime se renueva en cada abrir_exportacion)"""
+    if not os.path.isdir(directorio):
+        return
+    limite = time.time() - max_antiguedad_horas * 3600
+    for nombre in os.listdir(directorio):
+        path = os.path.join(directorio, nombre)
+        try:
+            if os.path.getmtime(path) < limite:
+                os.remove(path)
+        except OSError:
+            pass
+
+
+def abrir_exportacion(path):
+    """
+    Abre el artefacto para servirlo y renueva su mtime, de modo que la limpieza
+    no lo borre mientras alguna sesión lo siga ofreciendo. None si no existe.
+    """
+    try:
+        os.utime(path)
+        return open(path, "rb")
+    except FileNotFoundError:
+        return None
+
+
+def ruta_exportacion(fecha, filtros, formato, version=None, directorio=EXPORT_DIR):
+    """Ruta del artefacto en caché para la combinación dada (exista o no)"""
+    clave = clave_exportacion(fecha, filtros, formato, version)
+    extension = FORMATOS[formato]["extension"]
+    return os.path.join(directorio, f"transbordos_{fecha}_{clave}.{extension}")
+
+
+def exportar(datos, fecha, filtros, formato, version=None, directorio=EXPORT_DIR):
+    """
+    Genera (o reutiliza) el archivo de exportación y devuelve su ruta.
+    `datos` es un DataFrame o un pa.RecordBatchReader.
+
+    La escritura se hace a un archivo temporal que luego se renombra, de modo
+    que un artefacto a medio escribir nunca queda visible en la caché.
+    """
+    if formato not in FORMATOS:
+        raise ValueError(f"Formato de exportación no soportado: {formato}")
+
+    path = ruta_exportacion(fecha, filtros, formato, version, directorio)
+    if os.path.exists(path):
+        return path
+
+    os.makedirs(directorio, exist_ok=True)
+    limpiar_exportaciones(directorio)
+
+    fd, tmp_path = tempfile.mkstemp(dir=directorio, suffix=".tmp")
+    os.close(fd)
+    try:
+        if formato == "Parquet":
+            _escribir_parquet(datos, tmp_path)
+        else:
+            _escribir_csv(datos, tmp_path, comprimido=(formato == "CSV comprimido (gzip)"))
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return path
@@ -0,0 +1,160 @@
+"""
+Extracción de transbordos desde la réplica en rebanadas horarias paralelas.
+
+El día [inicio, fin) se divide en N rebanadas de igual duración; cada una se
+consulta en su propia conexión del pool y los resultados se concatenan en
+orden. La réplica atiende varios scans concurrentes, así que el tiempo de
+pared pasa a ser el de la rebanada más lenta en lugar de la suma.
+
+Con `python extraccion.py YYYY-MM-DD [N ...]` se compara la consulta única
+contra el modo por rebanadas.
+"""
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import psycopg2.extensions
+
+from conexiones_db import conexion, leer_preparada, obtener_pool
+from copia_binaria import leer_copy_binario, sustituir_posicionales
+
+# ======================================================
+# CONFIGURACIÓN
+# ======================================================
+REBANADAS_POR_DEFECTO = int(os.getenv("TRANSBORDOS_REBANADAS", "1"))
+# "read_sql": sentencia preparada + pd.read_sql | "copy": COPY binario decodificado a NumPy
+MOTOR_POR_DEFECTO = os.getenv("TRANSBORDOS_MOTOR_EXTRACCION", "read_sql")
+MOTORES = ("read_sql", "copy")
+
+# Misma clave que el DISTINCT ON de la consulta de transbordos
+CLAVE_TRANSBORDO = ["idsam", "consecutivoevento", "serialmediopago"]
+
+# $1/$2: rango [desde, hasta) de fechahoraevento; {tipos_evento} se fija por script
+SQL_TRANSBORDOS = """
+SELECT DISTINCT ON (idsam, consecutivoevento, serialmediopago)
+    idsam,
+    serialmediopago,
+    fechahoraevento,
+    entidad,
+    latitude,
+    longitude,
+    idrutaestacion,
+    tipotransporte,
+    tipoevento,
+    consecutivoevento,
+    númerotransbordos as numerotransbordos,
+    montoevento
+FROM c_transacciones
+WHERE fechahoraevento >= $1
+  AND fechahoraevento < $2
+  AND idproducto IN ('4d4f')
+  AND tipoevento IN ({tipos_evento})
+  AND (
+      (entidad = '0002' AND númerotransbordos IN (1, 5, 6, 9, 10))
+      OR
+      (entidad = '0003' AND númerotransbordos IN (1, 2))
+  )
+"""
+
+
+def sql_transbordos(tipos_evento=(4, 8)):
+    return SQL_TRANSBORDOS.format(tipos_evento=", ".join(str(int(t)) for t in tipos_evento))
+
+
+def leer_consulta(nombre, sql, conn, params=(), motor=MOTOR_POR_DEFECTO):
+    """
+    Lee una consulta con marcadores $1, $2, ... con el motor elegido. Con "copy"
+    los textos llegan como categóricos y los enteros conservan su ancho (int32/int64).
+    """
+    if motor == "copy":
+        cur = psycopg2.extensions.cursor(conn)
+        try:
+            sql = sustituir_posicionales(cur, sql, params)
+        finally:
+            cur.close()
+        return leer_copy_binario(sql, conn)
+    return leer_preparada(nombre, sql, conn, params)
+
+
+def rebanadas_horarias(inicio, fin, n):
+    """Límites [desde, hasta) de n rebanadas de igual duración que cubren [inicio, fin)"""
+    limites = pd.date_range(pd.Timestamp(inicio), pd.Timestamp(fin), periods=n + 1)
+    return [(a.to_pydatetime(), b.to_pydatetime()) for a, b in zip(limites[:-1], limites[1:])]
+
+
+def _concatenar(partes):
+    # Las rebanadas vacías traen columnas object; se descartan para no perder los tipos
+    con_datos = [p for p in partes if not p.empty]
+    if not con_datos:
+        return partes[0]
+    if len(con_datos) == 1:
+        return con_datos[0]
+    df = pd.concat(con_datos, ignore_index=True)
+    # Con el motor "copy" cada rebanada trae sus propias categorías; concat las deja como object
+    for col in con_datos[0].columns:
+        if isinstance(con_datos[0][col].dtype, pd.CategoricalDtype) and not isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].astype("category")
+    return df
+
+
+def extraer_transbordos(inicio, fin, rebanadas=REBANADAS_POR_DEFECTO, tipos_evento=(4, 8), base="transacciones",
+                        motor=MOTOR_POR_DEFECTO):
+    """
+    Transbordos del rango [inicio, fin). Con rebanadas > 1 cada rebanada corre
+    en una conexión del pool de forma concurrente.
+    """
+    query = sql_transbordos(tipos_evento)
+    nombre = "trx_transbordos_" + "_".join(str(int(t)) for t in tipos_evento)
+
+    def leer(desde, hasta):
+        with conexion(base) as conn:
+            return leer_consulta(nombre, query, conn, (desde, hasta), motor)
+
+    if rebanadas <= 1:
+        return leer(inicio, fin)
+
+    limites = rebanadas_horarias(inicio, fin, rebanadas)
+    with ThreadPoolExecutor(max_workers=min(rebanadas, obtener_pool(base).maxconn)) as executor:
+        partes = list(executor.map(lambda r: leer(*r), limites))
+
+    df = _concatenar(partes)
+    # DISTINCT ON se aplica dentro de cada rebanada; un evento repetido con
+    # distinta hora puede caer en dos rebanadas, así que se deduplica de nuevo
+    return df.drop_duplicates(subset=CLAVE_TRANSBORDO, keep="first", ignore_index=True)
+
+
+# ======================================================
+# COMPARATIVA
+# ======================================================
+def comparar_extraccion(fecha, rebanadas=(1, 4, 8, 24), tipos_evento=(4, 8), repeticiones=1):
+    """Tiempo de pared por cantidad de rebanadas para un día; verifica que el resultado coincida"""
+    inicio = pd.Timestamp(fecha)
+    fin = inicio + pd.Timedelta(days=1)
+    filas, referencia = [], None
+    for n in rebanadas:
+        tiempos = []
+        for _ in range(repeticiones):
+            t0 = time.perf_counter()
+            df = extraer_transbordos(inicio, fin, rebanadas=n, tipos_evento=tipos_evento)
+            tiempos.append(time.perf_counter() - t0)
+        claves = df[CLAVE_TRANSBORDO].sort_values(CLAVE_TRANSBORDO, ignore_index=True)
+        if referencia is None:
+            referencia = claves
+        filas.append({
+            "rebanadas": n,
+            "segundos": round(min(tiempos), 3),
+            "filas": len(df),
+            "filas/s": int(len(df) / min(tiempos)) if min(tiempos) > 0 else None,
+            "coincide": claves.equals(referencia),
+        })
+    return pd.DataFrame(filas)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Uso: python extraccion.py YYYY-MM-DD [rebanadas ...]")
+        sys.exit(1)
+    niveles = tuple(int(n) for n in sys.argv[2:]) or (1, 4, 8, 24)
+    print(comparar_extraccion(sys.argv[1], niveles, repeticiones=2).to_string(index=False))
@@ -0,0 +1,146 @@
+"""
+Geocercas sobre validaciones: filtro de puntos dentro de un polígono dibujado.
+
+El filtro trabaja sobre los arreglos de coordenadas completos, sin crear un
+objeto Shapely por fila:
+    1) prefiltro por la caja envolvente del polígono (comparaciones NumPy)
+    2) prueba exacta con `shapely.contains_xy` solo sobre los candidatos
+
+`IndiceGrilla` se arma una vez al cargar los datos: ordena los puntos por celda
+de una grilla uniforme, así una consulta solo mira las celdas que tocan la
+caja del polígono. Las celdas enteramente dentro se toman completas y la
+prueba exacta se hace únicamente en las celdas del borde.
+"""
+import os
+
+import numpy as np
+
+# ======================================================
+# CONFIGURACIÓN
+# ======================================================
+TAMANO_CELDA_GRADOS = float(os.getenv("TRANSBORDOS_GEO_CELDA_GRADOS", "0.005"))  # ~500 m
+# Con coordenadas muy dispersas (GPS erróneos) la celda se agranda hasta entrar en este límite
+MAX_CELDAS = 1_000_000
+
+
+def caja_envolvente(poligono):
+    """(lon_min, lat_min, lon_max, lat_max) de una lista de vértices [lon, lat]"""
+    v = np.asarray(poligono, dtype=np.float64)
+    return v[:, 0].min(), v[:, 1].min(), v[:, 0].max(), v[:, 1].max()
+
+
+def en_caja(lon, lat, caja):
+    lon_min, lat_min, lon_max, lat_max = caja
+    return (lon >= lon_min) & (lon <= lon_max) & (lat >= lat_min) & (lat <= lat_max)
+
+
+def puntos_en_poligono(lon, lat, poligono):
+    """
+    Máscara booleana de los puntos estrictamente dentro del polígono (misma
+    semántica que `Polygon.contains`). `poligono` es una lista de vértices [lon, lat].
+    """
+    import shapely  # Shapely 2: contains_xy evalúa arreglos sin crear geometrías por punto
+
+    lon = np.asarray(lon, dtype=np.float64)
+    lat = np.asarray(lat, dtype=np.float64)
+    forma = shapely.Polygon(poligono)
+    shapely.prepare(forma)
+    mascara = np.zeros(len(lon), dtype=bool)
+    candidatos = np.flatnonzero(en_caja(lon, lat, caja_envolvente(poligono)))
+    mascara[candidatos] = shapely.contains_xy(forma, lon[candidatos], lat[candidatos])
+    return mascara
+
+
+def filtrar_por_poligono(df, poligono):
+    """Filas de `df` (columnas longitude/latitude) dentro del polígono"""
+    return df[puntos_en_poligono(df['longitude'].to_numpy(), df['latitude'].to_numpy(), poligono)]
+
+
+# ======================================================
+# ÍNDICE DE GRILLA
+# ======================================================
+class IndiceGrilla:
+    """Puntos ordenados por celda de una grilla uniforme lon/lat con offsets por celda"""
+
+    def __init__(self, lon, lat, tamano_celda=TAMANO_CELDA_GRADOS, max_celdas=MAX_CELDAS):
+        self.lon = np.asarray(lon, dtype=np.float64)
+        self.lat = np.asarray(lat, dtype=np.float64)
+        validos = np.isfinite(self.lon) & np.isfinite(self.lat)
+        if validos.any():
+            self.lon0, self.lat0 = self.lon[validos].min(), self.lat[validos].min()
+            extension_lon = self.lon[validos].max() - self.lon0
+            extension_lat = self.lat[validos].max() - self.lat0
+        else:
+            self.lon0 = self.lat0 = extension_lon = extension_lat = 0.0
+        while True:
+            self.nx = int(extension_lon // tamano_celda) + 1
+            self.ny = int(extension_lat // tamano_celda) + 1
+            if self.nx * self.ny <= max_celdas:
+                break
+            tamano_celda *= 2
+        self.tamano_celda = tamano_celda
+
+        # Los puntos sin coordenadas van a una celda extra que nunca se consulta
+        celda = np.full(len(self.lon), self.nx * self.ny, dtype=np.int32)
+        ix = np.clip(((self.lon[validos] - self.lon0) // tamano_celda).astype(np.int32), 0, self.nx - 1)
+        iy = np.clip(((self.lat[validos] - self.lat0) // tamano_celda).astype(np.int32), 0, self.ny - 1)
+        celda[validos] = iy * self.nx + ix
+        # Orden no estable: dentro de una celda da igual, las consultas devuelven posiciones ordenadas
+        self.orden = np.argsort(celda)
+        self.inicio = np.r_[0, np.cumsum(np.bincount(celda, minlength=self.nx * self.ny + 1))]
+
+    @classmethod
+    def desde_df(cls, df, **kwargs):
+        return cls(df['longitude'].to_numpy(), df['latitude'].to_numpy(), **kwargs)
+
+    def __len__(self):
+        return len(self.lon)
+
+    def _celdas(self, caja):
+        """Ids y cajas (x0, y0, x1, y1) de las celdas con puntos que tocan la caja"""
+        lon_min, lat_min, lon_max, lat_max = caja
+        t = self.tamano_celda
+        ix0, ix1 = max(int((lon_min - self.lon0) // t), 0), min(int((lon_max - self.lon0) // t), self.nx - 1)
+        iy0, iy1 = max(int((lat_min - self.lat0) // t), 0), min(int((lat_max - self.lat0) // t), self.ny - 1)
+        if ix0 > ix1 or iy0 > iy1:
+            vacio = np.array([], dtype=np.int64)
+            return vacio, (vacio, vacio, vacio, vacio)
+        ix, iy = (a.ravel() for a in np.meshgrid(np.arange(ix0, ix1 + 1), np.arange(iy0, iy1 + 1)))
+        ids = iy * self.nx + ix
+        con_puntos = self.inicio[ids + 1] > self.inicio[ids]
+        ids, ix, iy = ids[con_puntos], ix[con_puntos], iy[con_puntos]
+        x0, y0 = self.lon0 + ix * t, self.lat0 + iy * t
+        return ids, (x0, y0, x0 + t, y0 + t)
+
+    def _posiciones(self, ids):
+        """Posiciones (en el orden original) de todos los puntos de las celdas indicadas"""
+        desde = self.inicio[ids]
+        largo = self.inicio[ids + 1] - desde
+        total = int(largo.sum())
+        if total == 0:
+            return np.array([], dtype=np.int64)
+        # Rangos [desde, desde + largo) concatenados sin bucle
+        saltos = np.repeat(desde - np.r_[0, np.cumsum(largo)[:-1]], largo)
+        return self.orden[saltos + np.arange(total)]
+
+    def consulta_caja(self, caja):
+        """Posiciones de los puntos dentro de la caja (lon_min, lat_min, lon_max, lat_max), ascendentes"""
+        ids, (x0, y0, x1, y1) = self._celdas(caja)
+        lon_min, lat_min, lon_max, lat_max = caja
+        interior = (x0 >= lon_min) & (x1 <= lon_max) & (y0 >= lat_min) & (y1 <= lat_max)
+        borde = self._posiciones(ids[~interior])
+        borde = borde[en_caja(self.lon[borde], self.lat[borde], caja)]
+        return np.sort(np.concatenate([self._posiciones(ids[interior]), borde]))
+
+    def consulta_poligono(self, poligono):
+        """Posiciones de los puntos estrictamente dentro del polígono, ascendentes"""
+        import shapely
+
+        ids, cajas = self._celdas(caja_envolvente(poligono))
+        forma = shapely.Polygon(poligono)
+        shapely.prepare(forma)
+        celdas = shapely.box(*cajas)
+        interior = shapely.contains_properly(forma, celdas)
+        borde = self._posiciones(ids[~interior & shapely.intersects(forma, celdas)])
+        borde = borde[shapely.contains_xy(forma, self.lon[borde], self.lat[borde])]
+        return np.sort(np.concatenate([self._posiciones(ids[interior]), borde]))
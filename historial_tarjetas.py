@@ -0,0 +1,94 @@
+"""
+Índice por tarjeta sobre el historial de validaciones.
+
+El historial se guarda ordenado por (serialmediopago, fechahoraevento) junto
+con el arreglo de tarjetas únicas y sus desplazamientos, de modo que la línea
+de tiempo de una tarjeta es un `searchsorted` más un slice, sin recorrer el
+día completo. Las etiquetas de evento se calculan una sola vez, vectorizadas.
+"""
+import numpy as np
+import pandas as pd
+
+# ======================================================
+# ETIQUETAS DE EVENTO (entidad, numerotransbordos)
+# ======================================================
+ETIQUETAS_EVENTO = {
+    ('0002', 4): "🏠 Madre (Viaje 1)",
+    ('0002', 8): "🏠 Madre (Viaje 2)",
+    ('0002', 5): "🚌 1er Transbordo (V1)",
+    ('0002', 6): "🚌 2do Transbordo (V1)",
+    ('0002', 9): "🚌 1er Transbordo (V2)",
+    ('0002', 10): "🚌 2do Transbordo (V2)",
+    ('0003', 0): "🏠 Madre (Base)",
+    ('0003', 1): "🚌 1er Transbordo",
+    ('0003', 2): "🚌 2do Transbordo",
+}
+
+_ENTIDADES = {ent: i for i, ent in enumerate(sorted({ent for ent, _ in ETIQUETAS_EVENTO}))}
+_MAX_NT = max(nt for _, nt in ETIQUETAS_EVENTO)
+_CATEGORIAS = list(dict.fromkeys(ETIQUETAS_EVENTO.values()))
+
+# Tabla de búsqueda [entidad, numerotransbordos] -> código de categoría (-1 = sin etiqueta)
+_TABLA_CODIGOS = np.full((len(_ENTIDADES), _MAX_NT + 1), -1, dtype=np.int8)
+for (_ent, _nt), _etiqueta in ETIQUETAS_EVENTO.items():
+    _TABLA_CODIGOS[_ENTIDADES[_ent], _nt] = _CATEGORIAS.index(_etiqueta)
+
+
+def etiquetar_eventos(entidad, numerotransbordos):
+    """
+    Etiqueta vectorizada de eventos; devuelve un Categorical alineado a la entrada.
+    Los pares sin regla quedan como NaN para que cada vista aplique su texto por defecto.
+    """
+    ent = pd.Series(entidad, dtype=object).map(_ENTIDADES).fillna(-1).to_numpy(dtype=np.int64)
+    nt = pd.to_numeric(pd.Series(numerotransbordos), errors='coerce').fillna(-1).to_numpy(dtype=np.int64)
+    validos = (ent >= 0) & (nt >= 0) & (nt <= _MAX_NT)
+    codigos = np.full(len(ent), -1, dtype=np.int8)
+    codigos[validos] = _TABLA_CODIGOS[ent[validos], nt[validos]]
+    return pd.Categorical.from_codes(codigos, categories=_CATEGORIAS)
+
+
+class HistorialIndexado:
+    """Historial de validaciones ordenado por tarjeta con índice de desplazamientos"""
+
+    def __init__(self, df_history, ordenado=False):
+        if ordenado:
+            df = df_history
+        else:
+            df = df_history.sort_values(['serialmediopago', 'fechahoraevento'], kind='stable').reset_index(drop=True)
+            df['etiqueta_evento'] = etiquetar_eventos(df['entidad'], df['numerotransbordos'])
+        self.df = df
+        # Sobre datos ya ordenados los límites de cada tarjeta salen de un solo diff
+        tarjetas = df['serialmediopago'].to_numpy()
+        inicios = np.flatnonzero(np.r_[True, tarjetas[1:] != tarjetas[:-1]]) if len(tarjetas) else np.array([], dtype=np.int64)
+        self.tarjetas = tarjetas[inicios]
+        self.desplazamientos = np.append(inicios, len(df))
+
+    def a_dataframe(self):
+        return self.df
+
+    @classmethod
+    def desde_dataframe(cls, df):
+        """Reconstruye el índice desde un historial ya ordenado y etiquetado"""
+        return cls(df, ordenado=True)
+
+    def __len__(self):
+        return len(self.df)
+
+    def timeline(self, tarjeta, etiqueta_desconocida="💳 Validación Base"):
+        """
+        Validaciones de una tarjeta en orden cronológico, con columna 'Tipo Evento'.
+        `etiqueta_desconocida` admite el marcador {nt} con el código de transbordo.
+        """
+        i = np.searchsorted(self.tarjetas, tarjeta)
+        if i >= len(self.tarjetas) or self.tarjetas[i] != tarjeta:
+            return self.df.iloc[0:0].assign(**{'Tipo Evento': pd.Series(dtype=object)})
+
+        t_history = self.df.iloc[self.desplazamientos[i]:self.desplazamientos[i + 1]].copy()
+        etiquetas = t_history['etiqueta_evento'].astype(object)
+        sin_etiqueta = etiquetas.isna()
+        if sin_etiqueta.any():
+            etiquetas[sin_etiqueta] = [
+                etiqueta_desconocida.format(nt=nt) for nt in t_history.loc[sin_etiqueta, 'numerotransbordos']
+            ]
+        t_history['Tipo Evento'] = etiquetas
+        return t_history
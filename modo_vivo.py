@@ -0,0 +1,149 @@
+"""
+Modo en vivo para el día en curso: refresco incremental por marca de agua.
+
+El resultado de hoy queda en el almacén compartido junto con la marca de agua
+(la `fechahoraevento` más reciente ya procesada). Cada refresco:
+    1. extrae solo los transbordos desde la marca de agua (menos un solape
+       para validaciones que llegan con atraso) y descarta los ya vinculados
+    2. trae el historial del día solo de las tarjetas de esos transbordos
+    3. vincula y enriquece el delta con las mismas etapas que procesar_fecha
+    4. agrega el delta al DataFrame vinculado y reemplaza el historial de
+       esas tarjetas, y publica el resultado con la nueva marca de agua
+El costo de un refresco es proporcional a los minutos nuevos, no al día.
+"""
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+from almacen_resultados import almacen_global
+from extraccion import MOTOR_POR_DEFECTO, extraer_transbordos
+from procesamiento import (
+    enriquecer, extraer_historial, inicio_pool, leer_empresas, procesar_fecha,
+    publicar_resultado, resultado_en_almacen, vincular_y_calcular,
+)
+
+# ======================================================
+# CONFIGURACIÓN
+# ======================================================
+INTERVALO_VIVO_MIN = float(os.getenv("TRANSBORDOS_VIVO_INTERVALO_MIN", "5"))
+# Se vuelve a leer este margen antes de la marca de agua; los repetidos se descartan por clave
+SOLAPE_VIVO_MIN = float(os.getenv("TRANSBORDOS_VIVO_SOLAPE_MIN", "30"))
+# Clave de un transbordo en el DataFrame vinculado (columnas ya renombradas)
+CLAVE_VINCULADO = ['idsam_transbordo', 'consecutivoevento', 'serialmediopago']
+
+_locks = {}
+_locks_lock = threading.Lock()
+
+
+def _lock_fecha(fecha):
+    # Un solo refresco por día a la vez aunque haya varias sesiones en vivo
+    with _locks_lock:
+        return _locks.setdefault(fecha, threading.Lock())
+
+
+def marca_de_agua(resultado, df_linked):
+    """Marca de agua guardada en el almacén o, si el día vino de otro origen, el último transbordo"""
+    if resultado.get('marca_agua'):
+        return pd.Timestamp(resultado['marca_agua'])
+    return pd.Timestamp(df_linked['fecha_transbordo'].max())
+
+
+def _clave(idsam, consecutivoevento, serialmediopago):
+    """
+    MultiIndex de la clave con tipos normalizados. vincular_y_calcular deja los
+    enteros en int64, pero una extracción nueva puede traerlos como float,
+    Decimal o categóricos según el motor ("123" y "123.0" no coinciden como texto).
+    """
+    return pd.MultiIndex.from_arrays([
+        idsam.astype(str).to_numpy(),
+        consecutivoevento.to_numpy(dtype=np.int64),
+        serialmediopago.to_numpy(dtype=np.int64),
+    ])
+
+
+def _nuevos(df_transfers, df_linked, desde):
+    """Transbordos extraídos que todavía no están en el DataFrame vinculado"""
+    # Solo los ya vinculados dentro de la ventana releída pueden repetirse
+    recientes = df_linked[df_linked['fecha_transbordo'] >= pd.Timestamp(desde)]
+    claves = _clave(*(recientes[c] for c in CLAVE_VINCULADO))
+    candidatas = _clave(df_transfers['idsam'], df_transfers['consecutivoevento'], df_transfers['serialmediopago'])
+    return df_transfers[~candidatas.isin(claves)].reset_index(drop=True)
+
+
+def refrescar_delta(fecha_proceso, motor=MOTOR_POR_DEFECTO):
+    """
+    Refresca el día en el almacén con los eventos posteriores a la marca de agua.
+    Si el día no está en el almacén se procesa completo. Devuelve un resumen.
+    """
+    t0 = time.perf_counter()
+    fecha_inicio = fecha_proceso.strftime("%Y-%m-%d")
+    fecha_fin = (fecha_proceso + timedelta(days=1)).strftime("%Y-%m-%d")
+    almacen = almacen_global()
+    ahora = datetime.now().isoformat()
+
+    resultado = resultado_en_almacen(fecha_inicio)
+    df_linked = almacen.obtener(resultado['linked']) if resultado else None
+    historial = almacen.obtener(resultado['historial']) if resultado else None
+    if df_linked is None or historial is None:
+        procesado = procesar_fecha(fecha_proceso, motor=motor)
+        if procesado is None:
+            return {'modo': 'completo', 'nuevos': 0, 'segundos': time.perf_counter() - t0}
+        df_linked, df_history = procesado
+        publicar_resultado(fecha_inicio, df_linked, df_history, {
+            'procesado_en': ahora,
+            'origen': 'vivo',
+            'marca_agua': marca_de_agua({}, df_linked).isoformat(),
+        })
+        return {'modo': 'completo', 'nuevos': len(df_linked), 'segundos': time.perf_counter() - t0}
+
+    # 1) Transbordos desde la marca de agua (con solape) que aún no están vinculados
+    marca = marca_de_agua(resultado, df_linked)
+    desde = (marca - pd.Timedelta(minutes=SOLAPE_VIVO_MIN)).strftime("%Y-%m-%d %H:%M:%S")
+    df_delta = _nuevos(extraer_transbordos(desde, fecha_fin, rebanadas=1, motor=motor), df_linked, desde)
+    if df_delta.empty:
+        almacen.actualizar_meta(resultado['linked'], procesado_en=ahora)
+        return {'modo': 'delta', 'nuevos': 0, 'segundos': time.perf_counter() - t0}
+    nueva_marca = max(marca, pd.Timestamp(df_delta['fechahoraevento'].max()))
+
+    # 2) Historial del día solo de las tarjetas tocadas
+    tarjetas = df_delta['serialmediopago'].unique()
+    df_history_delta = extraer_historial(tarjetas.tolist(), inicio_pool(fecha_proceso), fecha_fin, motor)
+
+    # 3) Vinculación y enriquecimiento del delta
+    df_linked_delta = vincular_y_calcular(df_delta, df_history_delta)
+    df_linked_delta, df_history_delta = enriquecer(df_linked_delta, df_history_delta, leer_empresas())
+
+    # 4) Fusión: el vinculado crece con el delta; el historial de las tarjetas tocadas se reemplaza
+    df_history = historial.a_dataframe().drop(columns=['etiqueta_evento'])
+    df_history = pd.concat(
+        [df_history[~df_history['serialmediopago'].isin(tarjetas)], df_history_delta],
+        ignore_index=True
+    )
+    publicar_resultado(fecha_inicio, pd.concat([df_linked, df_linked_delta], ignore_index=True), df_history, {
+        'procesado_en': ahora,
+        'origen': 'vivo',
+        'marca_agua': nueva_marca.isoformat(),
+    })
+    return {
+        'modo': 'delta',
+        'nuevos': len(df_linked_delta),
+        'tarjetas': len(tarjetas),
+        'desde': desde,
+        'segundos': time.perf_counter() - t0,
+    }
+
+
+def refrescar_si_corresponde(fecha_proceso, intervalo_min=INTERVALO_VIVO_MIN, motor=MOTOR_POR_DEFECTO):
+    """Refresca solo si el último cálculo del día tiene más de `intervalo_min`; None si no hizo falta"""
+    fecha_inicio = fecha_proceso.strftime("%Y-%m-%d")
+    with _lock_fecha(fecha_inicio):
+        resultado = resultado_en_almacen(fecha_inicio)
+        if resultado is not None:
+            antiguedad = datetime.now() - datetime.fromisoformat(resultado['procesado_en'])
+            if antiguedad < timedelta(minutes=intervalo_min):
+                return None
+        return refrescar_delta(fecha_proceso, motor)
@@ -0,0 +1,205 @@
+"""
+Motor analítico DuckDB sobre resultados de transbordos guardados en Parquet.
+
+Cada día procesado se guarda particionado por fecha:
+    transbordos/fecha=YYYY-MM-DD/part.parquet   transbordos vinculados
+    transbordos/fecha=YYYY-MM-DD/meta.json      frescura (cuándo y quién lo calculó)
+    historial/fecha=YYYY-MM-DD/part.parquet     historial de tarjetas
+
+Sobre esos archivos se definen las vistas `transbordos`, `viajes` e
+`historial`; las consultas multi-día filtran por la columna de partición
+`fecha`, de modo que DuckDB solo lee los días del rango.
+"""
+import glob
+import json
+import os
+import threading
+
+from agregaciones import ANCHO_BIN_FINO_MIN, HistogramaIntervalos
+
+# ======================================================
+# CONFIGURACIÓN
+# ======================================================
+PARQUET_DIR = os.getenv("TRANSBORDOS_PARQUET_DIR", os.path.join("data", "parquet"))
+
+TABLAS = ("transbordos", "historial")
+
+
+def path_particion(tabla, fecha, directorio=PARQUET_DIR):
+    return os.path.join(directorio, tabla, f"fecha={fecha}", "part.parquet")
+
+
+def _path_meta(fecha, directorio=PARQUET_DIR):
+    return os.path.join(directorio, "transbordos", f"fecha={fecha}", "meta.json")
+
+
+def archivos_particion(fecha, directorio=PARQUET_DIR):
+    """Archivos que forman la partición del día: un Parquet por tabla y meta.json"""
+    return [path_particion(tabla, fecha, directorio) for tabla in TABLAS] + [_path_meta(fecha, directorio)]
+
+
+def guardar_particion(fecha, df_linked, df_history=None, directorio=PARQUET_DIR, meta=None):
+    """
+    Escribe (o reemplaza) la partición del día para transbordos e historial.
+    `meta` (procesado_en, duracion_s, origen, ...) se guarda como meta.json al final,
+    así que solo existe si los Parquet del día quedaron completos.
+    """
+    for tabla, df in (("transbordos", df_linked), ("historial", df_history)):
+        if df is None:
+            continue
+        path = path_particion(tabla, fecha, directorio)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = path + ".tmp"
+        df.to_parquet(tmp, index=False, compression="zstd")
+        os.replace(tmp, path)
+    if meta is not None:
+        path = _path_meta(fecha, directorio)
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(path + ".tmp", path)
+
+
+def meta_particion(fecha, directorio=PARQUET_DIR):
+    """meta.json del día, o None si la partición se guardó sin metadatos"""
+    path = _path_meta(fecha, directorio)
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def fechas_disponibles(tabla="transbordos", directorio=PARQUET_DIR):
+    """Fechas con partición guardada, en orden ascendente"""
+    paths = glob.glob(os.path.join(directorio, tabla, "fecha=*", "part.parquet"))
+    return sorted(os.path.basename(os.path.dirname(p)).split("=", 1)[1] for p in paths)
+
+
+class MotorAnalitico:
+    """Conexión DuckDB embebida con vistas sobre las particiones Parquet"""
+
+    def __init__(self, directorio=PARQUET_DIR, threads=None):
+        # DuckDB se importa recién aquí: guardar_particion/fechas_disponibles no lo necesitan
+        import duckdb
+
+        self.directorio = directorio
+        self.con = duckdb.connect()
+        if threads:
+            self.con.execute(f"SET threads = {int(threads)}")
+        self._lock = threading.Lock()
+        self._vistas = set()
+
+    def _asegurar_vistas(self):
+        # Las vistas se crean cuando aparece la primera partición; el glob se
+        # reevalúa en cada consulta, así que los días nuevos se ven sin recrearlas
+        for tabla in TABLAS:
+            if tabla in self._vistas or not fechas_disponibles(tabla, self.directorio):
+                continue
+            patron = os.path.join(self.directorio, tabla, "fecha=*", "*.parquet").replace("'", "''")
+            self.con.execute(f"""
+                CREATE OR REPLACE VIEW {tabla} AS
+                SELECT * FROM read_parquet('{patron}', hive_partitioning = true, union_by_name = true)
+            """)
+            self._vistas.add(tabla)
+            if tabla == "transbordos":
+                self.con.execute("""
+                    CREATE OR REPLACE VIEW viajes AS
+                    SELECT
+                        fecha,
+                        serialmediopago,
+                        consecutivoevento_madre,
+                        any_value(empresa_madre) AS empresa_madre,
+                        min(fecha_madre) AS fecha_madre,
+                        count(*) AS transbordos,
+                        sum(monto_ahorrado) AS monto_ahorrado
+                    FROM transbordos
+                    WHERE consecutivoevento_madre IS NOT NULL
+                    GROUP BY ALL
+                """)
+                self._vistas.add("viajes")
+
+    def consultar(self, sql, params=None):
+        """Ejecuta SQL arbitrario sobre las vistas y devuelve un DataFrame"""
+        with self._lock:
+            self._asegurar_vistas()
+            cur = self.con.cursor()
+        try:
+            return cur.execute(sql, params or []).df()
+        finally:
+            cur.close()
+
+    def disponible(self):
+        with self._lock:
+            self._asegurar_vistas()
+            return "transbordos" in self._vistas
+
+    # ======================================================
+    # CONSULTAS MULTI-DÍA
+    # ======================================================
+    def resumen_diario(self, desde, hasta):
+        return self.consultar("""
+            SELECT
+                fecha,
+                count(*) AS transbordos,
+                count(DISTINCT serialmediopago) AS tarjetas,
+                sum(monto_ahorrado) AS monto_ahorrado
+            FROM transbordos
+            WHERE fecha BETWEEN ? AND ?
+            GROUP BY fecha
+            ORDER BY fecha
+        """, [desde, hasta])
+
+    def matriz_empresas(self, desde, hasta):
+        return self.consultar("""
+            SELECT empresa_madre, empresa_transbordo, count(*) AS cantidad
+            FROM transbordos
+            WHERE fecha BETWEEN ? AND ?
+              AND empresa_madre IS NOT NULL
+            GROUP BY ALL
+        """, [desde, hasta])
+
+    def red_rutas(self, desde, hasta):
+        """Red ruta madre → ruta transbordo del rango; DuckDB agrega las aristas de todos los días"""
+        from red_rutas import RedRutas  # SciPy solo cuando se pide la red
+
+        aristas = self.consultar("""
+            SELECT idruta_madre AS origen, idruta_transbordo AS destino, count(*) AS cantidad
+            FROM transbordos
+            WHERE fecha BETWEEN ? AND ?
+              AND idruta_madre IS NOT NULL
+            GROUP BY ALL
+        """, [desde, hasta])
+        return RedRutas.desde_dataframe(aristas)
+
+    def distribucion_descuentos(self, desde, hasta):
+        return self.consultar("""
+            SELECT
+                tipo_descuento AS "Tipo de Descuento",
+                count(*) AS "Cantidad",
+                sum(monto_ahorrado) AS "Monto Total Ahorrado"
+            FROM transbordos
+            WHERE fecha BETWEEN ? AND ?
+            GROUP BY ALL
+            ORDER BY "Cantidad" DESC
+        """, [desde, hasta])
+
+    def histograma_intervalos(self, desde, hasta, ancho_minutos=ANCHO_BIN_FINO_MIN):
+        """Histograma combinable del rango: DuckDB suma los conteos por bin de todos los días"""
+        bins = self.consultar("""
+            SELECT
+                CAST(greatest(ceil(intervalo / ?) - 1, 0) AS BIGINT) AS bin,
+                count(*) AS cantidad,
+                count(*) FILTER (WHERE intervalo = 0) AS ceros,
+                sum(intervalo) AS suma,
+                min(intervalo) AS minimo,
+                max(intervalo) AS maximo
+            FROM transbordos
+            WHERE fecha BETWEEN ? AND ?
+              AND intervalo IS NOT NULL
+            GROUP BY ALL
+        """, [ancho_minutos, desde, hasta])
+        if bins.empty:
+            return HistogramaIntervalos.desde_valores([], ancho=ancho_minutos)
+        return HistogramaIntervalos.desde_conteos(
+            bins['bin'], bins['cantidad'], bins['suma'].sum(), bins['minimo'].min(), bins['maximo'].max(),
+            ancho=ancho_minutos, ceros=bins['ceros'].sum()
+        )
@@ -0,0 +1,219 @@
+"""
+Perfilador opcional para el dashboard de transbordos.
+
+Se activa desde el sidebar o con TRANSBORDOS_PROFILE=1. Mientras está activo:
+    - mide tiempo de pared, CPU y memoria de cada etapa del pipeline y de cada tab
+    - muestrea la pila del hilo del script (perfilador estadístico)
+    - registra asignaciones de memoria con tracemalloc
+Las muestras se exportan en formato speedscope (JSON) y en pilas colapsadas
+(texto compatible con flamegraph.pl).
+"""
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+import pandas as pd
+
+# ======================================================
+# CONFIGURACIÓN
+# ======================================================
+PERFILADO_POR_DEFECTO = os.getenv("TRANSBORDOS_PROFILE", "0") == "1"
+INTERVALO_MUESTREO = float(os.getenv("TRANSBORDOS_PROFILE_INTERVALO", "0.005"))
+TOP_ASIGNACIONES = 15
+# Corte de seguridad por si la ejecución termina sin llamar a detener() (ej. una excepción)
+MAX_DURACION_MUESTREO = 600
+
+
+# ======================================================
+# TRACEMALLOC COMPARTIDO ENTRE SESIONES
+# ======================================================
+# tracemalloc es global al proceso y cada sesión de Streamlit tiene su propio
+# perfilador: se cuenta cuántos están activos y solo el último lo detiene
+_lock_tracemalloc = threading.Lock()
+_perfiladores_activos = 0
+_tracemalloc_externo = False
+
+
+def _adquirir_tracemalloc():
+    global _perfiladores_activos, _tracemalloc_externo
+    with _lock_tracemalloc:
+        if _perfiladores_activos == 0:
+            # Si ya estaba activo (ej. python -X tracemalloc) no es nuestro para detenerlo
+            _tracemalloc_externo = tracemalloc.is_tracing()
+            if not _tracemalloc_externo:
+                tracemalloc.start()
+        _perfiladores_activos += 1
+
+
+def _liberar_tracemalloc():
+    global _perfiladores_activos
+    with _lock_tracemalloc:
+        _perfiladores_activos -= 1
+        if _perfiladores_activos == 0 and not _tracemalloc_externo:
+            tracemalloc.stop()
+
+
+def _reiniciar_pico():
+    """Reinicia el pico de memoria solo si no hay otro perfilador midiendo; True si se reinició"""
+    with _lock_tracemalloc:
+        if _perfiladores_activos != 1:
+            return False
+        tracemalloc.reset_peak()
+        return True
+
+
+class _Muestreador(threading.Thread):
+    """Hilo que toma la pila del hilo objetivo cada `intervalo` segundos"""
+
+    def __init__(self, hilo_objetivo, intervalo, al_abandonar=None):
+        super().__init__(daemon=True, name="perfilador-muestreo")
+        self.hilo_objetivo = hilo_objetivo
+        self.intervalo = intervalo
+        self.muestras = []
+        self._detener = threading.Event()
+        self._al_abandonar = al_abandonar
+
+    def run(self):
+        limite = time.monotonic() + MAX_DURACION_MUESTREO
+        while not self._detener.wait(self.intervalo):
+            frame = sys._current_frames().get(self.hilo_objetivo)
+            if frame is None or time.monotonic() >= limite:
+                # El hilo del script terminó (o se cortó) sin llamar a detener()
+                if self._al_abandonar:
+                    self._al_abandonar()
+                return
+            pila = []
+            while frame is not None:
+                codigo = frame.f_code
+                pila.append((codigo.co_name, codigo.co_filename, codigo.co_firstlineno))
+                frame = frame.f_back
+            if pila:
+                self.muestras.append(tuple(reversed(pila)))
+
+    def detener(self):
+        self._detener.set()
+        self.join()
+
+
+class Perfilador:
+    """Perfilador por etapas; con activo=False todas las llamadas son no-op"""
+
+    def __init__(self, activo=False, intervalo=INTERVALO_MUESTREO):
+        self.activo = activo
+        self.intervalo = intervalo
+        self.etapas = []
+        self.asignaciones = []
+        self._actual = None
+        self._muestreador = None
+        self._tracemalloc_adquirido = False
+        self._lock = threading.Lock()
+
+    def iniciar(self):
+        if not self.activo:
+            return self
+        _adquirir_tracemalloc()
+        self._tracemalloc_adquirido = True
+        self._muestreador = _Muestreador(threading.get_ident(), self.intervalo, al_abandonar=self._liberar)
+        self._muestreador.start()
+        return self
+
+    def _liberar(self):
+        """Devuelve tracemalloc una sola vez (desde detener() o desde el muestreador)"""
+        with self._lock:
+            if not self._tracemalloc_adquirido:
+                return False
+            self._tracemalloc_adquirido = False
+        _liberar_tracemalloc()
+        return True
+
+    def etapa(self, nombre):
+        """Cierra la etapa en curso (si hay) y abre una nueva"""
+        if not self.activo or not self._tracemalloc_adquirido:
+            return
+        self.cerrar_etapa()
+        # Con otras sesiones perfilando el pico es del proceso entero y no se reinicia
+        pico_propio = _reiniciar_pico()
+        self._actual = (nombre, time.perf_counter(), time.process_time(), tracemalloc.get_traced_memory()[0], pico_propio)
+
+    def cerrar_etapa(self):
+        if not self.activo or self._actual is None:
+            return
+        nombre, t0, cpu0, mem0, pico_propio = self._actual
+        mem_actual, mem_pico = tracemalloc.get_traced_memory()
+        self.etapas.append({
+            "Etapa": nombre,
+            "Tiempo (s)": round(time.perf_counter() - t0, 3),
+            "CPU (s)": round(time.process_time() - cpu0, 3),
+            "Δ Memoria (MB)": round((mem_actual - mem0) / 1024 / 1024, 2),
+            "Pico Memoria (MB)": round(mem_pico / 1024 / 1024, 2) if pico_propio else None,
+        })
+        self._actual = None
+
+    def detener(self):
+        """Cierra la etapa, detiene el muestreo y libera tracemalloc; se puede llamar más de una vez"""
+        if not self.activo or self._muestreador is None:
+            return
+        self.cerrar_etapa()
+        self._muestreador.detener()
+        if self._tracemalloc_adquirido:
+            snapshot = tracemalloc.take_snapshot()
+            self.asignaciones = [
+                {
+                    "Ubicación": f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}",
+                    "MB": round(stat.size / 1024 / 1024, 2),
+                    "Bloques": stat.count,
+                }
+                for stat in snapshot.statistics("lineno")[:TOP_ASIGNACIONES]
+            ]
+        self._liberar()
+
+    # ======================================================
+    # REPORTES
+    # ======================================================
+    def reporte_etapas(self):
+        return pd.DataFrame(self.etapas)
+
+    def reporte_asignaciones(self):
+        return pd.DataFrame(self.asignaciones)
+
+    @property
+    def muestras(self):
+        return self._muestreador.muestras if self._muestreador else []
+
+    def speedscope(self, nombre="transbordos"):
+        """Perfil muestreado en el formato de archivo de speedscope.app"""
+        indices, frames, muestras = {}, [], []
+        for pila in self.muestras:
+            ids = []
+            for funcion, archivo, linea in pila:
+                clave = (funcion, archivo, linea)
+                if clave not in indices:
+                    indices[clave] = len(frames)
+                    frames.append({"name": funcion, "file": archivo, "line": linea})
+                ids.append(indices[clave])
+            muestras.append(ids)
+        return json.dumps({
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "shared": {"frames": frames},
+            "profiles": [{
+                "type": "sampled",
+                "name": nombre,
+                "unit": "seconds",
+                "startValue": 0,
+                "endValue": round(len(muestras) * self.intervalo, 6),
+                "samples": muestras,
+                "weights": [self.intervalo] * len(muestras),
+            }],
+            "exporter": "perfilador.py",
+        })
+
+    def pilas_colapsadas(self):
+        """Pilas colapsadas 'a;b;c N' para flamegraph.pl / inferno"""
+        conteo = {}
+        for pila in self.muestras:
+            clave = ";".join(f"{funcion} ({os.path.basename(archivo)}:{linea})" for funcion, archivo, linea in pila)
+            conteo[clave] = conteo.get(clave, 0) + 1
+        return "\n".join(f"{pila} {n}" for pila, n in sorted(conteo.items()))
@@ -0,0 +1,58 @@
+"""
+Períodos de comparación del análisis geoespacial.
+
+Funciones puras sobre fechas: etiquetar validaciones por período, listar los
+días que cubren los períodos y agrupar días faltantes en tramos consultables.
+Cada período es [inicio, fin) por día.
+"""
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+
+def asignar_periodos(fechas, ranges):
+    """
+    Etiqueta de período de cada fecha como categórico en el orden de `ranges`
+    (NaN si no cae en ninguno). Cada período es [inicio, fin) por día; si dos se
+    solapan gana el primero. Los inicios y fines forman tramos elementales: se
+    etiqueta cada tramo una vez y las filas se ubican con searchsorted.
+    """
+    etiquetas = list(ranges.keys())
+    inicios = np.array([r[0] for r in ranges.values()], dtype='datetime64[D]')
+    fines = np.array([r[1] for r in ranges.values()], dtype='datetime64[D]')
+    limites = np.unique(np.concatenate([inicios, fines]))
+    # Código del primer período que cubre cada tramo [limites[i], limites[i+1]); -1 = ninguno
+    codigo_tramo = np.full(len(limites), -1, dtype=np.int64)
+    for i in range(len(limites) - 1):
+        cubre = np.flatnonzero((inicios <= limites[i]) & (limites[i] < fines))
+        if len(cubre):
+            codigo_tramo[i] = cubre[0]
+    dias = fechas.to_numpy().astype('datetime64[D]')
+    tramo = np.searchsorted(limites, dias, side='right') - 1
+    codigos = np.where(tramo >= 0, codigo_tramo[np.clip(tramo, 0, None)], -1)
+    return pd.Categorical.from_codes(codigos, categories=etiquetas)
+
+
+def dias_de_periodos(ranges):
+    """Días (YYYY-MM-DD) cubiertos por algún período [inicio, fin), ordenados"""
+    dias = set()
+    for inicio, fin in ranges.values():
+        dias.update(pd.date_range(inicio, fin, inclusive='left').strftime("%Y-%m-%d"))
+    return sorted(dias)
+
+
+def tramos_faltantes(faltantes):
+    """
+    Agrupa {día: rutas} en tramos (inicio, fin, rutas) de días consecutivos con
+    las mismas rutas faltantes; fin es exclusivo. Con el almacén vacío queda un
+    tramo por período.
+    """
+    tramos = []
+    for dia, rutas in sorted(faltantes.items()):
+        dia = datetime.strptime(dia, "%Y-%m-%d")
+        if tramos and tramos[-1][1] == dia and tramos[-1][2] == rutas:
+            tramos[-1][1] = dia + timedelta(days=1)
+        else:
+            tramos.append([dia, dia + timedelta(days=1), rutas])
+    return [tuple(t) for t in tramos]
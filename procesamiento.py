@@ -0,0 +1,297 @@
+"""
+Pipeline de procesamiento diario de transbordos, sin dependencias de interfaz.
+
+`procesar_fecha` ejecuta extracción, historial, vinculación, cálculos y
+enriquecimiento para un día; el dashboard lo llama desde "Procesar Datos" y
+arranque.py lo usa para precalentar días al iniciar el contenedor. El avance
+se informa con un callback `avisar(progreso, texto=None, exito=None)`.
+"""
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+from psycopg2.extras import execute_values
+
+from almacen_resultados import almacen_global
+from conexiones_db import conexion, leer_sql
+from extraccion import extraer_transbordos, leer_consulta, REBANADAS_POR_DEFECTO, MOTOR_POR_DEFECTO
+from historial_tarjetas import HistorialIndexado
+from perfilador import Perfilador
+from vinculacion import vincular_por_objetivo
+
+# ======================================================
+# CONSULTAS
+# ======================================================
+QUERY_HISTORIAL = """
+SELECT 
+    idsam,
+    serialmediopago,
+    fechahoraevento,
+    entidad,
+    idrutaestacion,
+    latitude,
+    longitude,
+    consecutivoevento,
+    montoevento,
+    númerotransbordos as numerotransbordos
+FROM c_transacciones c
+JOIN tmp_target_cards tc ON c.serialmediopago = tc.card_id
+WHERE c.fechahoraevento >= $1
+  AND c.fechahoraevento < $2
+  AND c.tipoevento IN (4, 8)
+  AND c.númerotransbordos IN (0, 1, 2, 4, 5, 6, 8, 9, 10)
+  AND c.montoevento >= 0
+"""
+
+QUERY_EMPRESAS = """
+SELECT 
+    r.ruta_hex,
+    e.eot_nombre AS empresa
+FROM catalogo_rutas r
+JOIN eots e 
+    ON r.id_eot_catalogo = e.cod_catalogo;
+"""
+
+# ======================================================
+# TARIFAS Y CLASIFICACIÓN
+# ======================================================
+# tipotransporte = 1 -> tarifa 2400 (Convencional)
+# tipotransporte = 3 -> tarifa 3400 (Diferencial)
+TARIFAS = {'1': 2400, '3': 3400}
+
+
+def calcular_monto_ahorrado(df_linked):
+    """Tarifa completa menos lo pagado en el transbordo; 0 si el tipotransporte no tiene tarifa"""
+    tipo = df_linked['tipotransporte'].astype(str)
+    ahorro = pd.Series(0, index=df_linked.index)
+    for codigo, tarifa in TARIFAS.items():
+        mask = tipo == codigo
+        ahorro[mask] = (tarifa - df_linked.loc[mask, 'montoevento_transbordo']).clip(lower=0)
+    return ahorro
+
+
+def vectorized_clasificar_descuento(df):
+    """Clasificación de descuentos optimizada vectorialmente"""
+    # Auxiliares
+    tarifa = np.where(df['tipotransporte_str'] == '3', TARIFAS['3'], TARIFAS['1'])
+    porcentaje = np.where(df['monto_ahorrado'] >= tarifa * 0.95, "100%", 
+                         np.where(df['monto_ahorrado'] >= tarifa * 0.45, "50%", "Otro"))
+    
+    conds = [
+        (df['entidad_transbordo'] == '0002') & (df['numerotransbordos'] == 5),
+        (df['entidad_transbordo'] == '0002') & (df['numerotransbordos'] == 6),
+        (df['entidad_transbordo'] == '0002') & (df['numerotransbordos'] == 9),
+        (df['entidad_transbordo'] == '0002') & (df['numerotransbordos'] == 10),
+        (df['entidad_transbordo'] == '0003') & (df['numerotransbordos'] == 1),
+        (df['entidad_transbordo'] == '0003') & (df['numerotransbordos'] == 2)
+    ]
+    
+    prefixes = ['TDP_V1_T1_', 'TDP_V1_T2_', 'TDP_V2_T1_', 'TDP_V2_T2_', 'EPAS_T1_', 'EPAS_T2_']
+    
+    results = np.full(len(df), "Otro", dtype=object)
+    for cond, prefix in zip(conds, prefixes):
+        results[cond] = prefix + porcentaje[cond]
+    
+    return results
+
+def _sin_aviso(progreso=None, texto=None, exito=None):
+    pass
+
+
+# ======================================================
+# ETAPAS
+# ======================================================
+def extraer_historial(tarjetas, desde, hasta, motor=MOTOR_POR_DEFECTO):
+    """Validaciones [desde, hasta) de las tarjetas indicadas (tabla temporal + consulta de historial)"""
+    # Al salir del bloque la conexión vuelve al pool y se descarta la tabla temporal
+    with conexion("transacciones") as conn_trx:
+        cur_trx = conn_trx.cursor()
+        cur_trx.execute("DROP TABLE IF EXISTS tmp_target_cards; CREATE TEMP TABLE tmp_target_cards (card_id BIGINT PRIMARY KEY);")
+        execute_values(cur_trx, "INSERT INTO tmp_target_cards (card_id) VALUES %s", [(c,) for c in tarjetas])
+        return leer_consulta("trx_historial", QUERY_HISTORIAL, conn_trx, (desde, hasta), motor)
+
+
+def vincular_y_calcular(df_transfers, df_history, avisar=None):
+    """Vincula cada transbordo con su madre y agrega intervalo, ahorro y tipo de descuento"""
+    avisar = avisar or _sin_aviso
+
+    # Preparar datos
+    df_transfers['consecutivoevento'] = df_transfers['consecutivoevento'].astype('int64')
+    df_history['consecutivoevento'] = df_history['consecutivoevento'].astype('int64')
+
+    avisar(None, "🔗 Vinculando transbordos con su validación madre...")
+    # merge_asof por tarjeta, con preferencia por el numerotransbordos objetivo (ver vinculacion.py)
+    df_linked = vincular_por_objetivo(df_transfers, df_history)
+    df_linked = df_linked.rename(columns={
+        # Columnas de transbordo (vienen de df_transfers)
+        'fechahoraevento': 'fecha_transbordo',
+        'idrutaestacion': 'idruta_transbordo',
+        'latitude': 'latitud_transbordo',
+        'longitude': 'longitud_transbordo',
+        'idsam': 'idsam_transbordo',
+        'montoevento': 'montoevento_transbordo',
+        'entidad': 'entidad_transbordo',
+        # Columnas de madre
+        'fechahoraevento_madre': 'fecha_madre',
+        'idrutaestacion_madre': 'idruta_madre',
+        'latitude_madre': 'latitud_madre',
+        'longitude_madre': 'longitud_madre',
+    })
+
+    avisar(80, "🧮 Calculando métricas...")
+
+    df_linked["fecha_transbordo"] = pd.to_datetime(df_linked["fecha_transbordo"])
+    df_linked["fecha_madre"] = pd.to_datetime(df_linked["fecha_madre"])
+
+    df_linked["intervalo"] = (
+        (df_linked["fecha_transbordo"] - df_linked["fecha_madre"])
+        .dt.total_seconds() / 60
+    )
+
+    df_linked.loc[(df_linked["intervalo"] < 0) | (df_linked["intervalo"] > 120), "intervalo"] = None
+
+    # ======================================================
+    # CÁLCULO DE MONTO AHORRADO
+    # ======================================================
+    df_linked['monto_ahorrado'] = calcular_monto_ahorrado(df_linked)
+    df_linked['tipotransporte_str'] = df_linked['tipotransporte'].astype(str)
+
+    # Clasificar tipo de transbordo (1 = primer beneficio, 2 = segundo beneficio)
+    df_linked["tipo_transbordo"] = 1
+    # Segundo transbordo: 6 o 10 para TDP, 2 para EPAS
+    df_linked.loc[df_linked["numerotransbordos"].isin([6, 10, 2]), "tipo_transbordo"] = 2
+
+    df_linked['tipo_descuento'] = vectorized_clasificar_descuento(df_linked)
+    return df_linked.drop(columns=['tipotransporte_str'])
+
+
+def leer_empresas():
+    """Catálogo ruta_hex -> empresa desde la base de monitoreo"""
+    with conexion("monitoreo") as conn_mon:
+        return leer_sql(QUERY_EMPRESAS, conn_mon).drop_duplicates("ruta_hex")
+
+
+def enriquecer(df_linked, df_history, df_empresas):
+    """Empresas de transbordo y madre, servicio, clasificación y empresa en el historial"""
+    df_linked = df_linked.merge(
+        df_empresas,
+        left_on="idruta_transbordo",
+        right_on="ruta_hex",
+        how="left"
+    ).rename(columns={"empresa": "empresa_transbordo"}).drop(columns=["ruta_hex"], errors='ignore')
+
+    df_linked = df_linked.merge(
+        df_empresas,
+        left_on="idruta_madre",
+        right_on="ruta_hex",
+        how="left"
+    ).rename(columns={"empresa": "empresa_madre"}).drop(columns=["ruta_hex"], errors='ignore')
+
+    df_linked["servicio_transbordo"] = (
+        df_linked["empresa_transbordo"].fillna("SIN_EMPRESA")
+        + " → " +
+        df_linked["empresa_madre"].fillna("SIN_EMPRESA")
+    )
+
+    # Clasificar tipo de transbordo
+    df_linked["clasificacion_transbordo"] = "Sin Madre"
+    df_linked.loc[df_linked["empresa_madre"].notna(), "clasificacion_transbordo"] = "Intra-Empresa"
+    df_linked.loc[
+        (df_linked["empresa_madre"].notna()) & 
+        (df_linked["empresa_transbordo"] != df_linked["empresa_madre"]), 
+        "clasificacion_transbordo"
+    ] = "Inter-Empresa"
+
+    # Enriquecer df_history con empresas antes de guardar
+    df_history = df_history.merge(
+        df_empresas,
+        left_on="idrutaestacion",
+        right_on="ruta_hex",
+        how="left"
+    ).drop(columns=["ruta_hex"], errors='ignore')
+    return df_linked, df_history
+
+
+def inicio_pool(fecha_proceso):
+    """Inicio del historial de un día: 2.5 h antes de medianoche para madres del día anterior"""
+    return (datetime.combine(fecha_proceso, datetime.min.time()) - timedelta(hours=2.5)).strftime("%Y-%m-%d %H:%M:%S")
+
+
+# ======================================================
+# PIPELINE DIARIO
+# ======================================================
+def procesar_fecha(fecha_proceso, rebanadas=REBANADAS_POR_DEFECTO, motor=MOTOR_POR_DEFECTO, avisar=None, perf=None):
+    """
+    Procesa un día completo. Devuelve (df_linked, df_history) con el historial
+    ya enriquecido con empresas, o None si no hay transbordos en la fecha.
+    """
+    avisar = avisar or _sin_aviso
+    perf = perf or Perfilador()
+
+    fecha_inicio = fecha_proceso.strftime("%Y-%m-%d")
+    fecha_fin = (fecha_proceso + timedelta(days=1)).strftime("%Y-%m-%d")
+
+    # 1) EXTRAER TRANSBORDOS
+    perf.etapa("1) Extraer transbordos")
+    avisar(10, "📥 Consultando transbordos desde Azure...")
+    df_transfers = extraer_transbordos(fecha_inicio, fecha_fin, rebanadas=rebanadas, motor=motor)
+    avisar(30)
+
+    if df_transfers.empty:
+        return None
+
+    avisar(None, exito=f"✅ Transbordos encontrados: **{len(df_transfers):,}**")
+
+    # 2) OBTENER HISTORIAL DE TARJETAS
+    perf.etapa("2) Historial de tarjetas")
+    avisar(40, "🎴 Obteniendo historial de tarjetas...")
+    unique_cards = df_transfers['serialmediopago'].unique().tolist()
+    df_history = extraer_historial(unique_cards, inicio_pool(fecha_proceso), fecha_fin, motor)
+    avisar(60, exito=f"✅ Historial cargado: **{len(df_history):,}** registros de **{len(unique_cards):,}** tarjetas únicas")
+
+    # 3) y 4) VINCULACIÓN DE MADRES Y CÁLCULOS ADICIONALES
+    perf.etapa("3) Vinculación y cálculos")
+    avisar(70, "🔗 Preparando vinculación de transbordos...")
+    df_linked = vincular_y_calcular(df_transfers, df_history, avisar)
+    avisar(85)
+
+    # 5) ENRIQUECIMIENTO CON EMPRESAS
+    perf.etapa("5) Enriquecimiento con empresas")
+    avisar(None, "🏷️ Enriqueciendo con nombres de empresas...")
+    df_linked, df_history = enriquecer(df_linked, df_history, leer_empresas())
+
+    avisar(100, "✅ Procesamiento completado!")
+    return df_linked, df_history
+
+
+# ======================================================
+# ALMACÉN COMPARTIDO
+# ======================================================
+def publicar_resultado(fecha_inicio, df_linked, df_history, meta=None):
+    """
+    Guarda el día en el almacén compartido y devuelve el dict de handles que la
+    sesión conserva en st.session_state['resultado'].
+    """
+    almacen = almacen_global()
+    meta_resultado = {
+        'fecha_proceso': fecha_inicio,
+        'tiempo_proceso': None,
+        'procesado_en': datetime.now().isoformat(),
+        'origen': 'procesado',
+        **(meta or {})
+    }
+    return {
+        'linked': almacen.guardar(('linked', fecha_inicio), df_linked, meta_resultado),
+        # Historial ordenado por tarjeta con índice de desplazamientos para las líneas de tiempo
+        'historial': almacen.guardar(('historial', fecha_inicio), HistorialIndexado(df_history), meta_resultado),
+        **meta_resultado
+    }
+
+
+def resultado_en_almacen(fecha_inicio):
+    """Handles del día si ya está en el almacén (procesado por otra sesión o precalentado)"""
+    almacen = almacen_global()
+    meta = almacen.meta(('linked', fecha_inicio))
+    if meta is None or not almacen.contiene(('historial', fecha_inicio)):
+        return None
+    return {'linked': ('linked', fecha_inicio), 'historial': ('historial', fecha_inicio), **meta}
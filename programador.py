@@ -0,0 +1,71 @@
+"""
+Precálculo programado de los últimos días para el dashboard.
+
+Proceso aparte del dashboard (servicio `precalculo-transbordos` en
+docker-compose) que cada TRANSBORDOS_PROGRAMADOR_INTERVALO_MIN minutos, solo
+dentro de la ventana de baja demanda, procesa los últimos N días más hoy y los
+guarda como particiones Parquet con su meta.json. El dashboard las publica en
+el almacén compartido cuando se selecciona el día (arranque.cargar_precalentados)
+y muestra cuándo se calcularon (arranque.frescura).
+
+Uso:
+    python programador.py            ciclo continuo
+    python programador.py --una-vez  una sola pasada (para cron), ignora la ventana
+"""
+import os
+import sys
+import time
+from datetime import datetime
+
+from arranque import dias_a_precalentar, precalentar
+
+# ======================================================
+# CONFIGURACIÓN
+# ======================================================
+# Días cerrados hacia atrás que se precalculan, además de hoy
+DIAS_PROGRAMADOR = int(os.getenv("TRANSBORDOS_PROGRAMADOR_DIAS", "3"))
+INTERVALO_MIN = float(os.getenv("TRANSBORDOS_PROGRAMADOR_INTERVALO_MIN", "60"))
+# Ventana de baja demanda "HH-HH" (hora local); puede cruzar medianoche, ej. "22-06"
+VENTANA = os.getenv("TRANSBORDOS_PROGRAMADOR_VENTANA", "22-06")
+
+
+def _leer_ventana(ventana=VENTANA):
+    desde, hasta = (int(h) for h in ventana.split("-"))
+    return desde, hasta
+
+
+def en_ventana(momento=None, ventana=VENTANA):
+    """True si la hora de `momento` cae dentro de la ventana [desde, hasta)"""
+    hora = (momento or datetime.now()).hour
+    desde, hasta = _leer_ventana(ventana)
+    if desde <= hasta:
+        return desde <= hora < hasta
+    return hora >= desde or hora < hasta
+
+
+def ejecutar_ciclo(dias=DIAS_PROGRAMADOR):
+    """Una pasada: los días ya cerrados y calculados se omiten, hoy se recalcula"""
+    t0 = time.perf_counter()
+    print(f"🗓️ {datetime.now():%Y-%m-%d %H:%M} precálculo de los últimos {dias} días + hoy")
+    precalentar(dias_a_precalentar(dias=dias + 1), origen="programador")
+    print(f"✅ Ciclo completado en {time.perf_counter() - t0:.1f}s")
+
+
+def programar(intervalo_min=INTERVALO_MIN, dias=DIAS_PROGRAMADOR, ventana=VENTANA):
+    """Ciclo continuo: una pasada por intervalo mientras se esté en la ventana"""
+    print(f"⏰ Programador activo: cada {intervalo_min:g} min en la ventana {ventana} h")
+    while True:
+        if en_ventana(ventana=ventana):
+            try:
+                ejecutar_ciclo(dias)
+            except Exception as e:
+                # Un ciclo fallido (ej. réplica caída) no detiene el programador
+                print(f"❌ Error en el ciclo de precálculo: {e}")
+        time.sleep(intervalo_min * 60)
+
+
+if __name__ == "__main__":
+    if "--una-vez" in sys.argv[1:]:
+        ejecutar_ciclo()
+    else:
+        programar()
@@ -0,0 +1,142 @@
+"""
+Red origen-destino de transbordos a nivel de ruta.
+
+Cada arista `idruta_madre → idruta_transbordo` pesa la cantidad de
+transbordos. La red se guarda como matriz dispersa CSR de SciPy indexada por
+el arreglo ordenado de rutas, así que escala a miles de rutas sin el pivot
+denso de la matriz por empresa. Dos redes (ej. de días distintos) se combinan
+alineando sus rutas y sumando matrices.
+"""
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+# ======================================================
+# CONFIGURACIÓN
+# ======================================================
+AMORTIGUACION_PAGERANK = 0.85
+MAX_ITER_PAGERANK = 100
+TOLERANCIA_PAGERANK = 1e-10
+
+
+class RedRutas:
+    """Matriz dispersa ruta madre × ruta transbordo con métricas de grafo"""
+
+    def __init__(self, rutas, matriz):
+        self.rutas = np.asarray(rutas, dtype=object)
+        self.matriz = sparse.csr_matrix(matriz, dtype=np.float64)
+        self.matriz.sum_duplicates()
+        self.matriz.eliminate_zeros()
+
+    @classmethod
+    def desde_aristas(cls, origen, destino, pesos=None):
+        """Arma la red desde arreglos alineados; aristas repetidas se suman"""
+        origen = pd.Series(origen, dtype=object).to_numpy()
+        destino = pd.Series(destino, dtype=object).to_numpy()
+        validas = pd.notna(origen) & pd.notna(destino)
+        w = np.ones(len(origen)) if pesos is None else np.asarray(pesos, dtype=np.float64)
+        origen, destino, w = origen[validas], destino[validas], w[validas]
+        # factorize con hash es bastante más rápido que np.unique sobre textos; sort=True
+        # deja las rutas ordenadas para alinear redes con searchsorted al combinar
+        codigos, rutas = pd.factorize(pd.Series(np.concatenate([origen, destino])).astype(str), sort=True)
+        n = len(rutas)
+        matriz = sparse.coo_matrix((w, (codigos[:len(origen)], codigos[len(origen):])), shape=(n, n))
+        return cls(rutas, matriz.tocsr())
+
+    @classmethod
+    def desde_transbordos(cls, df_linked):
+        """Red del DataFrame vinculado (solo transbordos con ruta madre identificada)"""
+        return cls.desde_aristas(df_linked['idruta_madre'], df_linked['idruta_transbordo'])
+
+    # ======================================================
+    # ALMACÉN (a_dataframe / desde_dataframe)
+    # ======================================================
+    def a_dataframe(self):
+        """Lista de aristas (origen, destino, cantidad)"""
+        coo = self.matriz.tocoo()
+        return pd.DataFrame({
+            'origen': self.rutas[coo.row],
+            'destino': self.rutas[coo.col],
+            'cantidad': coo.data,
+        })
+
+    @classmethod
+    def desde_dataframe(cls, df):
+        return cls.desde_aristas(df['origen'], df['destino'], df['cantidad'])
+
+    # ======================================================
+    # COMBINACIÓN
+    # ======================================================
+    def _reindexar(self, rutas):
+        """Matriz expresada sobre un arreglo de rutas que contiene a las propias"""
+        idx = np.searchsorted(rutas, self.rutas)
+        coo = self.matriz.tocoo()
+        return sparse.coo_matrix((coo.data, (idx[coo.row], idx[coo.col])), shape=(len(rutas), len(rutas))).tocsr()
+
+    def combinar(self, otra):
+        rutas = np.union1d(self.rutas.astype(str), otra.rutas.astype(str)).astype(object)
+        return RedRutas(rutas, self._reindexar(rutas) + otra._reindexar(rutas))
+
+    # ======================================================
+    # CONSULTAS
+    # ======================================================
+    @property
+    def n_rutas(self):
+        return len(self.rutas)
+
+    @property
+    def n_aristas(self):
+        return self.matriz.nnz
+
+    def densidad(self):
+        return self.n_aristas / (self.n_rutas ** 2) if self.n_rutas else 0.0
+
+    def top_aristas(self, k=20, incluir_misma_ruta=True):
+        """Las k aristas de mayor peso, sin ordenar la matriz completa (argpartition sobre los no nulos)"""
+        filas = np.repeat(np.arange(self.n_rutas), np.diff(self.matriz.indptr))
+        columnas = self.matriz.indices
+        datos = self.matriz.data
+        if not incluir_misma_ruta:
+            distintas = filas != columnas
+            filas, columnas, datos = filas[distintas], columnas[distintas], datos[distintas]
+        k = min(k, len(datos))
+        if k == 0:
+            return pd.DataFrame({'origen': [], 'destino': [], 'cantidad': []})
+        top = np.argpartition(-datos, k - 1)[:k]
+        top = top[np.argsort(-datos[top], kind='stable')]
+        return pd.DataFrame({
+            'origen': self.rutas[filas[top]],
+            'destino': self.rutas[columnas[top]],
+            'cantidad': datos[top].astype(np.int64),
+        })
+
+    def pagerank(self, amortiguacion=AMORTIGUACION_PAGERANK):
+        """PageRank ponderado por iteración de potencia sobre la matriz dispersa"""
+        n = self.n_rutas
+        if n == 0:
+            return np.array([])
+        salida = np.asarray(self.matriz.sum(axis=1)).ravel()
+        inv_salida = np.divide(1.0, salida, out=np.zeros(n), where=salida > 0)
+        transicion_t = (sparse.diags(inv_salida) @ self.matriz).T.tocsr()
+        sin_salida = salida == 0
+        rango = np.full(n, 1.0 / n)
+        for _ in range(MAX_ITER_PAGERANK):
+            # La masa de las rutas sin salida se reparte uniformemente
+            nuevo = amortiguacion * (transicion_t @ rango + rango[sin_salida].sum() / n) + (1 - amortiguacion) / n
+            if np.abs(nuevo - rango).sum() < TOLERANCIA_PAGERANK:
+                return nuevo
+            rango = nuevo
+        return rango
+
+    def metricas(self):
+        """Por ruta: grado y fuerza de entrada/salida, transbordos en la misma ruta y PageRank"""
+        m = self.matriz
+        return pd.DataFrame({
+            'ruta': self.rutas,
+            'grado_salida': np.diff(m.indptr),
+            'grado_entrada': np.bincount(m.indices, minlength=self.n_rutas),
+            'transbordos_salida': np.asarray(m.sum(axis=1)).ravel().astype(np.int64),
+            'transbordos_entrada': np.asarray(m.sum(axis=0)).ravel().astype(np.int64),
+            'misma_ruta': m.diagonal().astype(np.int64),
+            'pagerank': self.pagerank(),
+        })
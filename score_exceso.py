@@ -0,0 +1,188 @@
+"""
+Motor incremental de puntuación de uso excesivo del beneficio de transbordo.
+
+Por cada día procesado se guardan contadores compactos por tarjeta (viajes con
+transbordo, transbordos, monto ahorrado). Un estado acumulado con ventanas
+móviles de 7 y 30 días se actualiza cada noche sumando el día nuevo y restando
+los días que salen de cada ventana, sin volver a leer transbordos de días
+anteriores.
+
+Los contadores del ETL nocturno salen de su vinculación (vinculacion.vincular_merge_asof:
+la validación anterior más cercana, a lo sumo 10 eventos antes). El conteo
+"> 2 viajes/día" del dashboard usa vinculacion.vincular_por_objetivo, que
+prefiere la madre con el numerotransbordos del beneficio; cuando las dos eligen
+madres distintas, los viajes con transbordo de una tarjeta pueden diferir.
+
+Estructura del almacén (TRANSBORDOS_SCORE_DIR):
+    contadores/fecha=YYYY-MM-DD.parquet   contadores diarios por tarjeta
+    estado.parquet                        acumulados 7d / 30d por tarjeta
+    estado.json                           última fecha incorporada al estado
+"""
+import json
+import os
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+
+# ======================================================
+# CONFIGURACIÓN
+# ======================================================
+SCORE_DIR = os.getenv("TRANSBORDOS_SCORE_DIR", os.path.join("data", "score_exceso"))
+
+VENTANAS = (7, 30)
+# Un día es "con exceso" si la tarjeta hizo más de este número de viajes con transbordo
+UMBRAL_VIAJES_DIA = 2
+# Días con exceso dentro de la ventana a partir de los cuales se marca la tarjeta
+UMBRAL_DIAS_EXCESO = {7: 3, 30: 8}
+
+CONTADORES = ['viajes_con_transbordo', 'transbordos', 'monto_ahorrado', 'dias_exceso']
+
+
+def _path_contadores(fecha, directorio=SCORE_DIR):
+    return os.path.join(directorio, "contadores", f"fecha={fecha.isoformat()}.parquet")
+
+
+def contadores_diarios(df_linked):
+    """
+    Contadores por tarjeta para un día de transbordos vinculados.
+    Un viaje con transbordo se identifica por su validación madre única.
+    """
+    faltantes = {'serialmediopago', 'consecutivoevento_madre'} - set(df_linked.columns)
+    if faltantes:
+        raise ValueError(f"Faltan columnas de la vinculación para los contadores: {sorted(faltantes)}")
+    if 'monto_ahorrado' in df_linked.columns:
+        ahorro = df_linked['monto_ahorrado']
+    else:
+        # El ETL no calcula el ahorro; se deriva con la misma regla de tarifas del dashboard
+        from procesamiento import calcular_monto_ahorrado
+        ahorro = calcular_monto_ahorrado(df_linked).fillna(0)
+
+    base = pd.DataFrame({
+        'serialmediopago': df_linked['serialmediopago'].to_numpy(dtype=np.int64),
+        'consecutivoevento_madre': df_linked['consecutivoevento_madre'].to_numpy(),
+        'monto_ahorrado': ahorro.to_numpy(dtype=np.float64),
+    })
+    grupos = base.groupby('serialmediopago', sort=True)
+    contadores = pd.DataFrame({
+        'viajes_con_transbordo': grupos['consecutivoevento_madre'].nunique().astype(np.int32),
+        'transbordos': grupos.size().astype(np.int32),
+        'monto_ahorrado': grupos['monto_ahorrado'].sum().round().astype(np.int64),
+    })
+    contadores['dias_exceso'] = (contadores['viajes_con_transbordo'] > UMBRAL_VIAJES_DIA).astype(np.int32)
+    return contadores
+
+
+def _leer_contadores(fecha, directorio=SCORE_DIR):
+    path = _path_contadores(fecha, directorio)
+    if not os.path.exists(path):
+        return None
+    return pd.read_parquet(path).set_index('serialmediopago')
+
+
+def _leer_meta(directorio=SCORE_DIR):
+    path = os.path.join(directorio, "estado.json")
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _columnas_estado():
+    return [f"{c}_{v}d" for v in VENTANAS for c in CONTADORES]
+
+
+def _estado_vacio():
+    return pd.DataFrame(
+        {c: pd.Series(dtype=np.int64) for c in _columnas_estado()},
+        index=pd.Index([], dtype=np.int64, name='serialmediopago')
+    )
+
+
+def _como_ventana(contadores, ventana, signo=1):
+    return (contadores[CONTADORES] * signo).rename(columns={c: f"{c}_{ventana}d" for c in CONTADORES})
+
+
+def _reconstruir_estado(fecha, directorio=SCORE_DIR):
+    """Recalcula el estado a partir de los contadores guardados (nunca de transbordos)"""
+    estado = _estado_vacio()
+    for ventana in VENTANAS:
+        partes = []
+        for d in range(ventana):
+            contadores = _leer_contadores(fecha - timedelta(days=d), directorio)
+            if contadores is not None:
+                partes.append(_como_ventana(contadores, ventana))
+        if partes:
+            suma = pd.concat(partes).groupby(level=0).sum()
+            estado = estado.add(suma, fill_value=0)
+    return estado
+
+
+def _guardar_estado(estado, fecha, directorio=SCORE_DIR):
+    estado = estado.fillna(0).astype(np.int64)
+    estado = estado[(estado != 0).any(axis=1)]
+    tmp = os.path.join(directorio, "estado.parquet.tmp")
+    estado.reset_index().to_parquet(tmp, index=False)
+    os.replace(tmp, os.path.join(directorio, "estado.parquet"))
+    with open(os.path.join(directorio, "estado.json"), "w", encoding="utf-8") as f:
+        json.dump({"ultima_fecha": fecha.isoformat(), "tarjetas": int(len(estado))}, f)
+    return estado
+
+
+def registrar_dia(df_linked, fecha, directorio=SCORE_DIR):
+    """Contadores del día a partir de los transbordos vinculados e incorporación al estado"""
+    return registrar_contadores(contadores_diarios(df_linked), fecha, directorio)
+
+
+def registrar_contadores(nuevos, fecha, directorio=SCORE_DIR):
+    """
+    Guarda los contadores del día e incorpora el día al estado de ventanas móviles.
+
+    Si el día sigue inmediatamente a la última fecha del estado y todavía no
+    tenía contadores guardados, la actualización es incremental (se suma el día
+    nuevo y se restan los que salen de cada ventana). Ante reprocesos, huecos o
+    un registro repetido del mismo día se reconstruye desde los contadores, así
+    que registrar dos veces una fecha no la cuenta dos veces.
+    """
+    os.makedirs(os.path.join(directorio, "contadores"), exist_ok=True)
+    path = _path_contadores(fecha, directorio)
+    ya_registrado = os.path.exists(path)
+    nuevos.reset_index().to_parquet(path, index=False)
+
+    meta = _leer_meta(directorio)
+    estado_path = os.path.join(directorio, "estado.parquet")
+    incremental = (
+        not ya_registrado
+        and meta is not None
+        and date.fromisoformat(meta["ultima_fecha"]) == fecha - timedelta(days=1)
+        and os.path.exists(estado_path)
+    )
+    if incremental:
+        estado = pd.read_parquet(estado_path).set_index('serialmediopago')
+        for ventana in VENTANAS:
+            estado = estado.add(_como_ventana(nuevos, ventana), fill_value=0)
+            saliente = _leer_contadores(fecha - timedelta(days=ventana), directorio)
+            if saliente is not None:
+                estado = estado.add(_como_ventana(saliente, ventana, signo=-1), fill_value=0)
+    else:
+        # Un reproceso de un día pasado no debe retroceder el estado
+        if meta:
+            fecha = max(fecha, date.fromisoformat(meta["ultima_fecha"]))
+        estado = _reconstruir_estado(fecha, directorio)
+
+    return _guardar_estado(estado, fecha, directorio)
+
+
+def cargar_flags(directorio=SCORE_DIR):
+    """
+    Estado actual con las banderas de reincidencia por ventana.
+    Devuelve (DataFrame, ultima_fecha) o (None, None) si el almacén está vacío.
+    """
+    meta = _leer_meta(directorio)
+    estado_path = os.path.join(directorio, "estado.parquet")
+    if not meta or not os.path.exists(estado_path):
+        return None, None
+    estado = pd.read_parquet(estado_path)
+    for ventana in VENTANAS:
+        estado[f"flag_{ventana}d"] = estado[f"dias_exceso_{ventana}d"] >= UMBRAL_DIAS_EXCESO[ventana]
+    return estado, date.fromisoformat(meta["ultima_fecha"])
@@ -28,6 +28,7 @@ import psycopg2
 from datetime import datetime, timedelta, date
 from dateutil.rrule import rrule, DAILY
 from dotenv import load_dotenv
+from conexiones_db import registrar_base, obtener_pool, ejecutar_preparada, registro_consultas
 
 load_dotenv()
 
@@ -79,24 +80,21 @@ PG_CONFIG = {
     "password": os.getenv("DB_PASSWORD"),
 }
 
+# Las funciones de BD comparten un pool (con keepalives) en lugar de abrir una conexión cada una
+registrar_base("lluvia", {**PG_CONFIG, "connect_timeout": 10})
+
 # ====
 # FUNCIONES DE UTILIDAD
 # ====
 
 def get_db_connection(retries=3, delay=5):
     """
-    Intenta establecer una conexión con la base de datos con un sistema de reintentos.
+    Obtiene una conexión del pool con un sistema de reintentos.
+    Debe devolverse con liberar_conexion().
     """
     for i in range(retries):
         try:
-            return psycopg2.connect(
-                host=PG_CONFIG["host"],
-                port=PG_CONFIG["port"],
-                dbname=PG_CONFIG["dbname"],
-                user=PG_CONFIG["user"],
-                password=PG_CONFIG["password"],
-                connect_timeout=10
-            )
+            return obtener_pool("lluvia").obtener()
         except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
             if i < retries - 1:
                 print(f"Error de conexión: {e}. Reintentando en {delay} segundos... ({i+1}/{retries})")
@@ -105,6 +103,11 @@ def get_db_connection(retries=3, delay=5):
             else:
                 return None
 
+
+def liberar_conexion(conn):
+    """Devuelve la conexión al pool (descarta lo no confirmado)"""
+    obtener_pool("lluvia").devolver(conn)
+
 def registrar_alerta(descripcion: str, id_tipo_alerta: int = 1):
     """
     Registra una alerta en la tabla alertas.control_alertas cuando ocurre un error.
@@ -122,16 +125,18 @@ def registrar_alerta(descripcion: str, id_tipo_alerta: int = 1):
             print(f"  ⚠ No se pudo conectar a BD para registrar alerta: {descripcion[:50]}...")
             return False
         
-        cursor = conn.cursor()
-        cursor.execute("""
-            INSERT INTO alertas.control_alertas 
-            (fuente, fechahora_alerta, id_tipo_alerta, verificado, corregido, descripcion_incidente)
-            VALUES (%s, NOW(), %s, false, false, %s)
-        """, ('script_lluvia.py', id_tipo_alerta, descripcion))
-        
-        conn.commit()
-        cursor.close()
-        conn.close()
+        try:
+            cursor = conn.cursor()
+            ejecutar_preparada(cursor, "lluvia_alerta", """
+                INSERT INTO alertas.control_alertas 
+                (fuente, fechahora_alerta, id_tipo_alerta, verificado, corregido, descripcion_incidente)
+                VALUES ($1, NOW(), $2, false, false, $3)
+            """, ('script_lluvia.py', id_tipo_alerta, descripcion))
+            
+            conn.commit()
+            cursor.close()
+        finally:
+            liberar_conexion(conn)
         print(f"  ℹ Alerta registrada en control_alertas")
         return True
     except Exception as e:
@@ -149,16 +154,18 @@ def registrar_ejecucion_correcta(id_script: int = 1):
         if not conn:
             return
 
-        cursor = conn.cursor()
-        cursor.execute("""
-            INSERT INTO alertas.registro_ejecuciones 
-            (id_script, fecha_proceso, fecha_ejecucion, estado, detalles)
-            VALUES (%s, CURRENT_DATE, NOW(), %s, %s)
-        """, (id_script, 'OK', 'Ejecución completada correctamente'))
-        
-        conn.commit()
-        cursor.close()
-        conn.close()
+        try:
+            cursor = conn.cursor()
+            cursor.execute("""
+                INSERT INTO alertas.registro_ejecuciones 
+                (id_script, fecha_proceso, fecha_ejecucion, estado, detalles)
+                VALUES (%s, CURRENT_DATE, NOW(), %s, %s)
+            """, (id_script, 'OK', 'Ejecución completada correctamente'))
+            
+            conn.commit()
+            cursor.close()
+        finally:
+            liberar_conexion(conn)
         print("  ℹ Ejecución registrada en alertas.registro_ejecuciones")
 
     except Exception as e:
@@ -282,7 +289,7 @@ def insert_rain_records_into_db(records):
             mm_caidos,
             notas
         )
-        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+        VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9)
     """
 
     count_inserted = 0
@@ -305,7 +312,9 @@ def insert_rain_records_into_db(records):
         notas = f"Lluvia MAX Central: {rain_mm:.2f} mm"
 
         try:
-            cur.execute(
+            ejecutar_preparada(
+                cur,
+                "lluvia_casuistica",
                 insert_sql,
                 (
                     fecha_evento,
@@ -330,7 +339,7 @@ def insert_rain_records_into_db(records):
 
     conn.commit()
     cur.close()
-    conn.close()
+    liberar_conexion(conn)
 
     print(f"Insertadas {count_inserted} filas en T_CASUISTICAS_LLUVIA.")
 
@@ -359,7 +368,7 @@ def upsert_rainy_day(fecha_evento: date, mm_acumulados: float):
             fuente_dato,
             observacion
         )
-        VALUES (%s, %s, %s, %s, %s, %s)
+        VALUES ($1, $2, $3, $4, $5, $6)
         ON CONFLICT (fecha, tipo_atipico) DO UPDATE
         SET
             factor_exigencia = EXCLUDED.factor_exigencia,
@@ -369,7 +378,7 @@ def upsert_rainy_day(fecha_evento: date, mm_acumulados: float):
     """
 
     try:
-        cur.execute(insert_sql, (
+        ejecutar_preparada(cur, "lluvia_dia_atipico", insert_sql, (
             fecha_evento,
             'LLUVIA',         # tipo_atipico en mayúsculas
             0.50,             # factor_exigencia
@@ -384,7 +393,7 @@ def upsert_rainy_day(fecha_evento: date, mm_acumulados: float):
         print(f"Error al upsert día atípico {fecha_evento}: {e}")
     finally:
         cur.close()
-        conn.close()
+        liberar_conexion(conn)
 
 
 # ====
@@ -479,6 +488,8 @@ def main():
         print(error_detail)
         registrar_alerta(error_detail)
 
+    registro_consultas.imprimir_resumen()
+
 
 # ====
 # MAIN DE EJEMPLO
@@ -0,0 +1,60 @@
+"""
+Datos sintéticos compartidos por los tests. Los módulos del proyecto viven en
+la raíz del repositorio, así que se agrega al path.
+"""
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+RUTAS = ['0200', '0201', '0202']
+
+
+def generar_dia(n_tarjetas=300, eventos_por_tarjeta=8, semilla=0):
+    """
+    (df_transfers, df_history) de un día: cada tarjeta valida varias veces con
+    consecutivos crecientes; los eventos con códigos de transbordo son los transbordos.
+    """
+    rng = np.random.default_rng(semilla)
+    n = n_tarjetas * eventos_por_tarjeta
+    tarjeta = np.repeat(np.arange(1000, 1000 + n_tarjetas), eventos_por_tarjeta)
+    consecutivo = np.tile(np.arange(1, eventos_por_tarjeta + 1), n_tarjetas)
+    segundos = np.sort(rng.integers(0, 86_400, (n_tarjetas, eventos_por_tarjeta)), axis=1).ravel()
+    entidad = rng.choice(['0002', '0003'], n)
+    numerotransbordos = np.where(
+        entidad == '0002',
+        rng.choice([0, 4, 5, 6, 8, 9, 10], n),
+        rng.choice([0, 1, 2], n),
+    )
+    df_history = pd.DataFrame({
+        'idsam': rng.choice(['SAM1', 'SAM2'], n),
+        'serialmediopago': tarjeta.astype(np.int64),
+        'fechahoraevento': pd.Timestamp('2025-12-11') + pd.to_timedelta(segundos, unit='s'),
+        'entidad': entidad,
+        'idrutaestacion': rng.choice(RUTAS, n),
+        'latitude': -25.3 + rng.random(n) / 10,
+        'longitude': -57.6 + rng.random(n) / 10,
+        'consecutivoevento': consecutivo.astype(np.int64),
+        'montoevento': rng.choice([0, 1200, 2400], n).astype(np.int64),
+        'numerotransbordos': numerotransbordos.astype(np.int64),
+    })
+    es_transbordo = np.isin(numerotransbordos, [1, 2, 5, 6, 9, 10])
+    df_transfers = df_history[es_transbordo].drop(columns='montoevento').assign(
+        montoevento=df_history.loc[es_transbordo, 'montoevento'],
+        tipotransporte=rng.choice([1, 3], int(es_transbordo.sum())),
+    ).reset_index(drop=True)
+    return df_transfers, df_history
+
+
+@pytest.fixture
+def dia_sintetico():
+    return generar_dia()
+
+
+@pytest.fixture
+def empresas():
+    return pd.DataFrame({'ruta_hex': RUTAS, 'empresa': ['MAGNO', 'SAN ISIDRO', 'MAGNO']})
@@ -0,0 +1,62 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from agregaciones import RANGOS_INTERVALO, HistogramaIntervalos, binear_densidad
+
+
+def test_binear_densidad_conserva_el_peso_y_descarta_coordenadas_invalidas():
+    rng = np.random.default_rng(0)
+    lat = -25.3 + rng.random(5000) / 10
+    lon = -57.6 + rng.random(5000) / 10
+    pesos = rng.integers(1, 5, 5000)
+    lat[:10], lon[10:20], lat[20:30] = np.nan, 0, 0
+
+    bins = binear_densidad(lat, lon, pesos)
+
+    assert bins['peso'].sum() == pesos[30:].sum()
+    assert (bins['peso'] > 0).all()
+    assert bins['lat'].between(lat[30:].min(), lat[30:].max() + 0.002).all()
+
+
+def test_binear_densidad_engrosa_la_grilla_hasta_el_limite():
+    rng = np.random.default_rng(1)
+    lat, lon = -25.3 + rng.random(20000), -57.6 + rng.random(20000)
+
+    bins = binear_densidad(lat, lon, max_celdas=500)
+
+    assert len(bins) <= 500
+    assert bins['peso'].sum() == 20000
+
+
+def test_binear_densidad_sin_coordenadas_validas():
+    assert binear_densidad([np.nan, 0], [0, np.nan]).empty
+
+
+def test_rangos_igual_a_pd_cut():
+    rng = np.random.default_rng(2)
+    # Valores en los límites exactos y en 0 además de valores continuos
+    valores = np.r_[rng.random(5000) * 120, RANGOS_INTERVALO, RANGOS_INTERVALO, 0, 0, 0.25, 0.5]
+
+    hist = HistogramaIntervalos.desde_valores(valores)
+    esperado = pd.Series(pd.cut(valores, bins=RANGOS_INTERVALO)).value_counts(sort=False).to_numpy()
+
+    np.testing.assert_array_equal(hist.rangos()['Cantidad'].to_numpy(), esperado)
+
+
+def test_combinar_equivale_a_un_solo_histograma():
+    rng = np.random.default_rng(3)
+    a, b = rng.random(1000) * 120, np.r_[rng.random(500) * 60, 0, 0]
+
+    combinado = HistogramaIntervalos.desde_valores(a).combinar(HistogramaIntervalos.desde_valores(b))
+    completo = HistogramaIntervalos.desde_valores(np.r_[a, b])
+
+    np.testing.assert_array_equal(combinado.conteos, completo.conteos)
+    assert (combinado.n, combinado.ceros) == (completo.n, completo.ceros)
+    assert combinado.media() == pytest.approx(completo.media())
+    pd.testing.assert_frame_equal(combinado.rangos(), completo.rangos())
+
+
+def test_indice_bin_cerrado_a_derecha():
+    indices = HistogramaIntervalos.indice_bin([0, 0.1, 0.5, 0.51, 1.0, 1.01], ancho=0.5)
+    np.testing.assert_array_equal(indices, [0, 0, 0, 1, 1, 2])
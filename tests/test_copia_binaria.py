@@ -0,0 +1,105 @@
+import struct
+from datetime import date, datetime
+from decimal import Decimal
+
+import numpy as np
+import pandas as pd
+
+from copia_binaria import (
+    EPOCH_PG_DIAS, EPOCH_PG_US, FIRMA, OID_BOOL, OID_DATE, OID_FLOAT8, OID_INT2, OID_INT4, OID_INT8,
+    OID_NUMERIC, OID_TIMESTAMP, decodificar_copy_binario,
+)
+
+OID_VARCHAR = 1043
+
+
+def _numeric(valor):
+    """numeric binario de PostgreSQL: dígitos base 10000 alineados a la coma"""
+    signo, digitos, exponente = Decimal(valor).as_tuple()
+    escala = max(-exponente, 0)
+    entero = int("".join(map(str, digitos)) or "0") * 10 ** max(exponente, 0) * 10 ** (-escala % 4)
+    grupos = []
+    while entero:
+        entero, resto = divmod(entero, 10000)
+        grupos.insert(0, resto)
+    peso = len(grupos) - 1 - (escala + 3) // 4
+    while grupos and grupos[-1] == 0:
+        grupos.pop()
+    return struct.pack(f">hhHH{len(grupos)}h", len(grupos), peso, 0x4000 if signo else 0, escala, *grupos)
+
+
+CODIFICAR = {
+    OID_BOOL: lambda v: struct.pack(">?", v),
+    OID_INT2: lambda v: struct.pack(">h", v),
+    OID_INT4: lambda v: struct.pack(">i", v),
+    OID_INT8: lambda v: struct.pack(">q", v),
+    OID_FLOAT8: lambda v: struct.pack(">d", v),
+    OID_DATE: lambda v: struct.pack(">i", (v - date(1970, 1, 1)).days - EPOCH_PG_DIAS),
+    OID_TIMESTAMP: lambda v: struct.pack(">q", (v - datetime(1970, 1, 1)) // pd.Timedelta("1us") - EPOCH_PG_US),
+    OID_NUMERIC: _numeric,
+    OID_VARCHAR: lambda v: v.encode("utf-8"),
+}
+
+
+def _copy_binario(columnas, filas):
+    """Flujo COPY ... TO STDOUT WITH (FORMAT binary) de las filas dadas (None = NULL)"""
+    partes = [FIRMA, struct.pack(">ii", 0, 0)]
+    for fila in filas:
+        partes.append(struct.pack(">h", len(fila)))
+        for (_, oid), valor in zip(columnas, fila):
+            if valor is None:
+                partes.append(struct.pack(">i", -1))
+            else:
+                campo = CODIFICAR[oid](valor)
+                partes.append(struct.pack(">i", len(campo)) + campo)
+    partes.append(struct.pack(">h", -1))
+    return b"".join(partes)
+
+
+COLUMNAS = [
+    ("consecutivoevento", OID_INT8), ("entidad_num", OID_INT2), ("tipoevento", OID_INT4),
+    ("valido", OID_BOOL), ("latitude", OID_FLOAT8), ("fecha", OID_DATE),
+    ("fechahoraevento", OID_TIMESTAMP), ("montoevento", OID_NUMERIC), ("idsam", OID_VARCHAR),
+]
+FILAS = [
+    (1, 2, 4, True, -25.3, date(2025, 12, 11), datetime(2025, 12, 11, 5, 0, 0, 250000), Decimal("2400"), "SAM1"),
+    (2**40, -3, 8, False, 0.0, date(1999, 12, 31), datetime(1999, 12, 31, 23, 59, 59), Decimal("-0.05"), "ñandú"),
+    (3, 7, None, None, None, None, None, None, None),
+    (4, 0, 4, True, 1e-9, date(2000, 1, 1), datetime(2000, 1, 1), Decimal("123456789.1234"), ""),
+]
+
+
+def test_decodificar_tipos_y_nulos():
+    df = decodificar_copy_binario(_copy_binario(COLUMNAS, FILAS), COLUMNAS)
+
+    assert list(df.columns) == [nombre for nombre, _ in COLUMNAS]
+    np.testing.assert_array_equal(df['consecutivoevento'], [1, 2**40, 3, 4])
+    assert df['consecutivoevento'].dtype == np.int64
+    np.testing.assert_array_equal(df['entidad_num'], [2, -3, 7, 0])
+    # Enteros con NULL pasan a float con NaN, como pd.read_sql
+    np.testing.assert_array_equal(df['tipoevento'], [4, 8, np.nan, 4])
+    assert df['valido'].tolist()[:2] == [True, False] and pd.isna(df['valido'][2])
+    np.testing.assert_array_equal(df['latitude'], [-25.3, 0.0, np.nan, 1e-9])
+    assert df['fecha'].tolist()[:2] == [pd.Timestamp("2025-12-11"), pd.Timestamp("1999-12-31")]
+    assert df['fechahoraevento'].tolist() == [
+        pd.Timestamp("2025-12-11 05:00:00.25"), pd.Timestamp("1999-12-31 23:59:59"), pd.NaT, pd.Timestamp("2000-01-01"),
+    ]
+    np.testing.assert_array_equal(df['montoevento'], [2400.0, -0.05, np.nan, float(Decimal("123456789.1234"))])
+    assert df['idsam'].dtype == 'category'
+    assert df['idsam'].astype(object).tolist()[:2] == ["SAM1", "ñandú"]
+    assert pd.isna(df['idsam'][2]) and df['idsam'][3] == ""
+
+
+def test_decodificar_texto_sin_categorias():
+    columnas = [("consecutivoevento", OID_INT8), ("idsam", OID_VARCHAR)]
+
+    df = decodificar_copy_binario(_copy_binario(columnas, [(1, "a"), (2, None)]), columnas, categoricos=False)
+
+    assert df['idsam'].dtype != 'category'
+    assert df['idsam'][0] == "a" and pd.isna(df['idsam'][1])
+
+
+def test_decodificar_flujo_vacio():
+    df = decodificar_copy_binario(_copy_binario(COLUMNAS, []), COLUMNAS)
+
+    assert df.empty and list(df.columns) == [nombre for nombre, _ in COLUMNAS]
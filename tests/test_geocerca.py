@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+
+shapely = pytest.importorskip("shapely")
+
+from geocerca import IndiceGrilla, en_caja, puntos_en_poligono  # noqa: E402
+
+# Polígono cóncavo (forma de L) en [lon, lat], como lo entrega Leaflet.draw
+POLIGONO = [[-57.60, -25.30], [-57.52, -25.30], [-57.52, -25.27], [-57.56, -25.27],
+            [-57.56, -25.22], [-57.60, -25.22], [-57.60, -25.30]]
+
+
+@pytest.fixture
+def puntos():
+    rng = np.random.default_rng(0)
+    lon = -57.62 + rng.random(20000) * 0.12
+    lat = -25.32 + rng.random(20000) * 0.12
+    # Puntos sobre vértices y bordes, sin coordenadas y un GPS erróneo muy lejos
+    lon[:3], lat[:3] = [-57.60, -57.56, -57.58], [-25.30, -25.25, -25.30]
+    lon[3:6], lat[3:6] = np.nan, -25.25
+    lon[6], lat[6] = 10.0, 40.0
+    return lon, lat
+
+
+def _dentro(lon, lat, poligono):
+    forma = shapely.Polygon(poligono)
+    return np.array([forma.contains(shapely.Point(x, y)) for x, y in zip(lon, lat)])
+
+
+def test_puntos_en_poligono_igual_a_polygon_contains(puntos):
+    lon, lat = puntos
+
+    np.testing.assert_array_equal(puntos_en_poligono(lon, lat, POLIGONO), _dentro(lon, lat, POLIGONO))
+
+
+def test_indice_consulta_poligono_igual_a_fuerza_bruta(puntos):
+    lon, lat = puntos
+    indice = IndiceGrilla(lon, lat, tamano_celda=0.005)
+
+    np.testing.assert_array_equal(indice.consulta_poligono(POLIGONO), np.flatnonzero(_dentro(lon, lat, POLIGONO)))
+
+
+def test_indice_consulta_caja_igual_a_fuerza_bruta(puntos):
+    lon, lat = puntos
+    indice = IndiceGrilla(lon, lat, tamano_celda=0.005)
+    # Bordes de la caja alineados con celdas y sin alinear
+    for caja in [(-57.59, -25.29, -57.53, -25.23), (-57.595, -25.3, -57.5, -25.2), (0, 0, 1, 1)]:
+        esperado = np.flatnonzero(en_caja(lon, lat, caja))
+        np.testing.assert_array_equal(indice.consulta_caja(caja), esperado)
+
+
+def test_indice_agranda_la_celda_con_coordenadas_dispersas(puntos):
+    lon, lat = puntos
+
+    indice = IndiceGrilla(lon, lat, tamano_celda=0.005, max_celdas=10_000)
+
+    assert indice.nx * indice.ny <= 10_000
+    np.testing.assert_array_equal(indice.consulta_poligono(POLIGONO), np.flatnonzero(_dentro(lon, lat, POLIGONO)))
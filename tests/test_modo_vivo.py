@@ -0,0 +1,70 @@
+from datetime import date
+from decimal import Decimal
+
+import pandas as pd
+
+import modo_vivo
+from almacen_resultados import almacen_global
+from procesamiento import enriquecer, publicar_resultado, vincular_y_calcular
+
+CLAVE = ['idsam_transbordo', 'consecutivoevento', 'serialmediopago']
+
+
+def _procesar(df_transfers, df_history, empresas):
+    return enriquecer(vincular_y_calcular(df_transfers.copy(), df_history.copy()), df_history.copy(), empresas)
+
+
+def _como_extraccion_nueva(df):
+    """Mismos datos con los tipos que puede traer otro motor de extracción"""
+    return df.assign(
+        consecutivoevento=df['consecutivoevento'].astype('float64'),
+        serialmediopago=[Decimal(int(x)) for x in df['serialmediopago']],
+        idsam=df['idsam'].astype('category'),
+    ).reset_index(drop=True)
+
+
+def test_nuevos_descarta_ya_vinculados_con_tipos_distintos(dia_sintetico, empresas):
+    df_transfers, df_history = dia_sintetico
+    df_linked, _ = _procesar(df_transfers, df_history, empresas)
+
+    extraidos = _como_extraccion_nueva(df_transfers)
+    assert modo_vivo._nuevos(extraidos, df_linked, '2025-12-11 00:00:00').empty
+
+    # Solo quedan los que no estaban vinculados
+    parcial, _ = _procesar(df_transfers.iloc[:100], df_history, empresas)
+    nuevos = modo_vivo._nuevos(extraidos, parcial, '2025-12-11 00:00:00')
+    assert len(nuevos) == len(df_transfers) - 100
+
+
+def test_refresco_delta_equivale_a_procesar_el_dia_completo(monkeypatch, dia_sintetico, empresas):
+    df_transfers, df_history = dia_sintetico
+    fecha = date(2025, 12, 11)
+    completo, _ = _procesar(df_transfers, df_history, empresas)
+
+    # Estado inicial: el día procesado hasta el mediodía
+    corte = pd.Timestamp('2025-12-11 12:00')
+    previos = df_transfers[df_transfers['fechahoraevento'] < corte]
+    linked, history = _procesar(previos, df_history, empresas)
+    publicar_resultado(fecha.isoformat(), linked, history, {
+        'origen': 'vivo', 'marca_agua': previos['fechahoraevento'].max().isoformat(),
+    })
+
+    monkeypatch.setattr(modo_vivo, 'extraer_transbordos', lambda desde, fin, rebanadas, motor: _como_extraccion_nueva(
+        df_transfers[df_transfers['fechahoraevento'] >= pd.Timestamp(desde)]
+    ))
+    monkeypatch.setattr(modo_vivo, 'extraer_historial', lambda tarjetas, desde, hasta, motor: df_history[
+        df_history['serialmediopago'].isin([int(t) for t in tarjetas])
+    ].reset_index(drop=True))
+    monkeypatch.setattr(modo_vivo, 'leer_empresas', lambda: empresas)
+
+    resumen = modo_vivo.refrescar_delta(fecha)
+    assert resumen['modo'] == 'delta'
+    assert resumen['nuevos'] == len(completo) - len(linked)
+    # Un segundo refresco sobre el mismo solape no agrega nada
+    assert modo_vivo.refrescar_delta(fecha)['nuevos'] == 0
+
+    vivo = almacen_global().obtener(('linked', fecha.isoformat()))
+    columnas = CLAVE + ['consecutivoevento_madre', 'tipo_descuento', 'monto_ahorrado', 'clasificacion_transbordo']
+    esperado = completo[columnas].sort_values(CLAVE, ignore_index=True)
+    obtenido = vivo[columnas].sort_values(CLAVE, ignore_index=True)
+    pd.testing.assert_frame_equal(obtenido, esperado, check_dtype=False)
@@ -0,0 +1,57 @@
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from periodos import asignar_periodos, dias_de_periodos, tramos_faltantes
+
+PERIODOS = {
+    "1) Post": ("2025-12-24", "2025-12-31"),
+    "2) Pre": ("2025-12-17", "2025-12-24"),
+    # Se solapa con Post: esos días quedan en el primero
+    "3) Últimos": ("2025-12-28", "2026-01-04"),
+    "4) Año Ant.": ("2024-12-28", "2025-01-04"),
+}
+
+
+def _periodo_esperado(fecha):
+    dia = fecha.normalize()
+    for etiqueta, (inicio, fin) in PERIODOS.items():
+        if pd.Timestamp(inicio) <= dia < pd.Timestamp(fin):
+            return etiqueta
+    return np.nan
+
+
+def test_asignar_periodos_igual_a_recorrer_los_periodos_en_orden():
+    rng = np.random.default_rng(0)
+    fechas = pd.Series(pd.Timestamp("2024-12-20") + pd.to_timedelta(rng.integers(0, 400 * 86_400, 5000), unit="s"))
+    # Límites exactos de cada período, también al final del día anterior
+    bordes = [pd.Timestamp(d) for r in PERIODOS.values() for d in r]
+    fechas = pd.concat([fechas, pd.Series(bordes), pd.Series([b - pd.Timedelta("1s") for b in bordes])], ignore_index=True)
+
+    etiquetas = asignar_periodos(fechas, PERIODOS)
+
+    assert list(etiquetas.categories) == list(PERIODOS)
+    esperado = pd.Series([_periodo_esperado(f) for f in fechas], dtype=object)
+    pd.testing.assert_series_equal(pd.Series(etiquetas).astype(object), esperado)
+
+
+def test_dias_de_periodos_sin_repetidos():
+    dias = dias_de_periodos({"a": ("2025-12-30", "2026-01-02"), "b": ("2025-12-31", "2026-01-01")})
+
+    assert dias == ["2025-12-30", "2025-12-31", "2026-01-01"]
+
+
+def test_tramos_faltantes_agrupa_dias_consecutivos_con_las_mismas_rutas():
+    tramos = tramos_faltantes({
+        "2025-12-11": ["0200"],
+        "2025-12-10": ["0200"],
+        "2025-12-12": ["0200", "0201"],
+        "2025-12-14": ["0200"],
+    })
+
+    assert tramos == [
+        (datetime(2025, 12, 10), datetime(2025, 12, 12), ["0200"]),
+        (datetime(2025, 12, 12), datetime(2025, 12, 13), ["0200", "0201"]),
+        (datetime(2025, 12, 14), datetime(2025, 12, 15), ["0200"]),
+    ]
@@ -0,0 +1,65 @@
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import score_exceso
+
+INICIO = date(2025, 11, 1)
+
+
+def _dia(semilla, n_tarjetas=40):
+    """Transbordos vinculados de un día: varias madres por tarjeta, algunas con más de 2 viajes"""
+    rng = np.random.default_rng(semilla)
+    n = n_tarjetas * 4
+    return pd.DataFrame({
+        'serialmediopago': rng.integers(1000, 1000 + n_tarjetas, n),
+        'consecutivoevento_madre': rng.integers(1, 6, n).astype(float),
+        'monto_ahorrado': rng.choice([0, 2400, 3400], n),
+    })
+
+
+def _estado(directorio):
+    return pd.read_parquet(directorio / "estado.parquet").set_index('serialmediopago').sort_index()
+
+
+def test_registrar_dos_veces_el_mismo_dia_no_lo_cuenta_dos_veces(tmp_path):
+    score_exceso.registrar_dia(_dia(0), INICIO, tmp_path)
+    score_exceso.registrar_dia(_dia(1), INICIO + timedelta(days=1), tmp_path)
+    primero = _estado(tmp_path)
+
+    score_exceso.registrar_dia(_dia(1), INICIO + timedelta(days=1), tmp_path)
+
+    pd.testing.assert_frame_equal(_estado(tmp_path), primero)
+
+
+def test_incremental_igual_a_reconstruir(tmp_path):
+    incremental, reconstruido = tmp_path / "incremental", tmp_path / "reconstruido"
+    # 35 días: las ventanas de 7 y 30 días ya restan los días que salen
+    for d in range(35):
+        fecha = INICIO + timedelta(days=d)
+        score_exceso.registrar_dia(_dia(d), fecha, incremental)
+        score_exceso.registrar_contadores(score_exceso.contadores_diarios(_dia(d)), fecha, reconstruido)
+        # Sin estado.json cada registro reconstruye desde los contadores
+        (reconstruido / "estado.json").unlink()
+
+    pd.testing.assert_frame_equal(_estado(incremental), _estado(reconstruido), check_dtype=False)
+
+
+def test_contadores_diarios_cuenta_viajes_por_madre():
+    df = pd.DataFrame({
+        'serialmediopago': [1, 1, 1, 1, 2],
+        'consecutivoevento_madre': [10, 10, 20, 30, 5],
+        'monto_ahorrado': [2400, 2400, 3400, 0, 2400],
+    })
+
+    contadores = score_exceso.contadores_diarios(df)
+
+    assert contadores.loc[1, ['viajes_con_transbordo', 'transbordos', 'monto_ahorrado', 'dias_exceso']].tolist() == [3, 4, 8200, 1]
+    assert contadores.loc[2, 'dias_exceso'] == 0
+
+
+def test_contadores_diarios_exige_la_vinculacion():
+    with pytest.raises(ValueError):
+        score_exceso.contadores_diarios(pd.DataFrame({'serialmediopago': [1]}))
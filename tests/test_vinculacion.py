@@ -0,0 +1,75 @@
+import numpy as np
+import pandas as pd
+
+from conftest import generar_dia
+from vinculacion import numerotransbordos_objetivo, vincular_merge_asof, vincular_por_objetivo
+
+
+def _anteriores(df_history, tarjeta, consecutivo):
+    h = df_history
+    return h[(h['serialmediopago'] == tarjeta) & (h['consecutivoevento'] < consecutivo)]
+
+
+def _madre_esperada_etl(df_history, fila):
+    previas = _anteriores(df_history, fila.serialmediopago, fila.consecutivoevento)
+    if previas.empty:
+        return np.nan
+    madre = previas['consecutivoevento'].max()
+    return madre if fila.consecutivoevento - madre <= 10 else np.nan
+
+
+def _madre_esperada_dashboard(df_history, fila):
+    previas = _anteriores(df_history, fila.serialmediopago, fila.consecutivoevento)
+    objetivo = numerotransbordos_objetivo([fila.entidad], [fila.numerotransbordos])[0]
+    preferidas = previas[previas['numerotransbordos'] == objetivo]
+    candidatas = preferidas if not preferidas.empty else previas
+    return candidatas['consecutivoevento'].max() if not candidatas.empty else np.nan
+
+
+def _con_huecos(df_history):
+    """Historial con consecutivos salteados, para que algunas madres queden a más de 10 eventos"""
+    return df_history.assign(consecutivoevento=df_history['consecutivoevento'] ** 2)
+
+
+def test_vincular_merge_asof_toma_la_anterior_mas_cercana_a_lo_sumo_10_eventos_antes():
+    df_transfers, df_history = generar_dia(n_tarjetas=60, eventos_por_tarjeta=6)
+    df_history = _con_huecos(df_history)
+    df_transfers = df_transfers.assign(consecutivoevento=df_transfers['consecutivoevento'] ** 2)
+
+    df_linked = vincular_merge_asof(df_transfers, df_history)
+
+    df_linked = df_linked.sort_values(['serialmediopago', 'consecutivoevento'], ignore_index=True)
+    esperado = [_madre_esperada_etl(df_history, f) for f in df_linked.itertuples()]
+    np.testing.assert_array_equal(df_linked['consecutivoevento_madre'].to_numpy(dtype=float), esperado)
+    # Las columnas de una madre descartada quedan vacías
+    sin_madre = df_linked['consecutivoevento_madre'].isna()
+    assert sin_madre.any() and df_linked.loc[sin_madre, 'idsam_madre'].isna().all()
+
+
+def test_vincular_por_objetivo_prefiere_el_numerotransbordos_del_beneficio(dia_sintetico):
+    df_transfers, df_history = dia_sintetico
+    df_transfers = df_transfers.sample(frac=1, random_state=0)
+
+    df_linked = vincular_por_objetivo(df_transfers, df_history)
+
+    # Mismo orden de filas que la entrada
+    np.testing.assert_array_equal(df_linked['consecutivoevento'], df_transfers['consecutivoevento'])
+    esperado = [_madre_esperada_dashboard(df_history, f) for f in df_transfers.itertuples()]
+    np.testing.assert_array_equal(df_linked['consecutivoevento_madre'].to_numpy(dtype=float), esperado)
+
+
+def test_numerotransbordos_objetivo():
+    objetivo = numerotransbordos_objetivo(
+        ['0002', '0002', '0002', '0002', '0002', '0003', '0001'], [5, 6, 9, 10, 1, 2, 5]
+    )
+    np.testing.assert_array_equal(objetivo, [4, 4, 8, 8, np.nan, 0, np.nan])
+
+
+def test_vincular_merge_asof_con_historial_vacio():
+    df_transfers, df_history = generar_dia(n_tarjetas=5)
+
+    df_linked = vincular_merge_asof(df_transfers, df_history.iloc[0:0].astype(object))
+
+    assert len(df_linked) == len(df_transfers)
+    assert df_linked['consecutivoevento_madre'].isna().all()
+    assert pd.api.types.is_integer_dtype(df_linked['consecutivoevento'])
@@ -0,0 +1,187 @@
+"""
+Vinculación de transbordos con su validación madre y extracción particionada por tarjeta.
+
+Hay dos criterios, ambos con merge_asof por tarjeta:
+    vincular_merge_asof    ETL: la anterior más cercana, a lo sumo 10 eventos antes
+    vincular_por_objetivo  dashboard: la anterior más reciente, con preferencia por
+                           el numerotransbordos que corresponde al beneficio
+
+La vinculación solo mira dentro de una misma tarjeta, así que las tarjetas
+objetivo se reparten en N shards por `serialmediopago % N`. Cada shard corre
+en su propio proceso con su propia conexión: crea su tabla temporal de
+tarjetas, consulta su historial, vincula y devuelve su parte. El resultado es
+la concatenación de los shards.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from psycopg2.extras import execute_values
+
+from conexiones_db import BASES, conectar, registro_consultas
+from extraccion import MOTOR_POR_DEFECTO, leer_consulta
+
+# ======================================================
+# CONFIGURACIÓN
+# ======================================================
+SHARDS_POR_DEFECTO = int(os.getenv("TRANSBORDOS_SHARDS", "1"))
+
+
+def shard_de_tarjeta(tarjetas, n_shards):
+    """Shard de cada tarjeta (serialmediopago % N)"""
+    return np.asarray(tarjetas, dtype=np.int64) % n_shards
+
+
+# ======================================================
+# VINCULACIÓN (MERGE_ASOF)
+# ======================================================
+def vincular_merge_asof(df_transfers, df_history):
+    """
+    Vincula cada transbordo con la validación anterior más cercana de la misma
+    tarjeta (consecutivo estrictamente menor, a lo sumo 10 eventos antes).
+    """
+    # merge_asof exige claves del mismo tipo (un historial vacío llega como object)
+    # y la clave `on` ordenada; `by` agrupa por tarjeta
+    claves = {'serialmediopago': 'int64', 'consecutivoevento': 'int64'}
+    df_transfers = df_transfers.astype(claves).sort_values('consecutivoevento', kind='stable')
+    df_history = df_history.astype(claves).sort_values('consecutivoevento', kind='stable')
+    df_history = df_history.assign(consecutivoevento_madre=df_history['consecutivoevento'])
+
+    # allow_exact_matches=False asegura que no se vincule consigo mismo
+    df_linked = pd.merge_asof(
+        df_transfers,
+        df_history,
+        on='consecutivoevento',
+        by='serialmediopago',
+        direction='backward',
+        allow_exact_matches=False,
+        suffixes=('_transbordo', '_madre')
+    )
+
+    # Filtro de seguridad: consecutivoevento_madre debe estar entre [consecutivo - 10, consecutivo - 1]
+    mask_valid_madre = (df_linked['consecutivoevento'] - df_linked['consecutivoevento_madre'] <= 10)
+    df_linked.loc[~mask_valid_madre, [c for c in df_linked.columns if '_madre' in c]] = None
+    return df_linked
+
+
+# ======================================================
+# VINCULACIÓN POR NUMEROTRANSBORDOS OBJETIVO (DASHBOARD)
+# ======================================================
+COLUMNAS_MADRE = [
+    'idsam', 'fechahoraevento', 'entidad', 'idrutaestacion',
+    'latitude', 'longitude', 'consecutivoevento', 'montoevento',
+]
+
+
+def numerotransbordos_objetivo(entidad, numerotransbordos):
+    """
+    numerotransbordos que debe tener la madre preferida de cada transbordo
+    (TDP 5/6 → 4, TDP 9/10 → 8, EPAS → 0); NaN si no hay preferencia.
+    """
+    entidad = np.asarray(entidad)
+    numerotransbordos = np.asarray(numerotransbordos)
+    tdp = entidad == '0002'
+    objetivo = np.full(len(entidad), np.nan)
+    objetivo[tdp & np.isin(numerotransbordos, [5, 6])] = 4
+    objetivo[tdp & np.isin(numerotransbordos, [9, 10])] = 8
+    objetivo[entidad == '0003'] = 0
+    return objetivo
+
+
+def vincular_por_objetivo(df_transfers, df_history):
+    """
+    Vinculación del dashboard: la validación anterior más reciente de la misma
+    tarjeta (consecutivo estrictamente menor, sin límite de distancia), pero si
+    alguna anterior tiene el numerotransbordos objetivo se toma la más reciente
+    de esas. Devuelve df_transfers (sin sufijos, mismo orden de filas) con las
+    columnas `<col>_madre` de COLUMNAS_MADRE.
+    """
+    claves = {'serialmediopago': 'int64', 'consecutivoevento': 'int64'}
+    df_transfers = df_transfers.astype(claves).reset_index(drop=True)
+    transbordos = pd.DataFrame({
+        'serialmediopago': df_transfers['serialmediopago'],
+        'consecutivoevento': df_transfers['consecutivoevento'],
+        'fila': np.arange(len(df_transfers)),
+        'objetivo': numerotransbordos_objetivo(df_transfers['entidad'], df_transfers['numerotransbordos']),
+    }).sort_values('consecutivoevento', kind='stable', ignore_index=True)
+
+    df_history = df_history.astype(claves)
+    madres = df_history[COLUMNAS_MADRE + ['numerotransbordos']].add_suffix('_madre').assign(
+        serialmediopago=df_history['serialmediopago'],
+        consecutivoevento=df_history['consecutivoevento'],
+    ).sort_values('consecutivoevento', kind='stable')
+    columnas = [f"{c}_madre" for c in COLUMNAS_MADRE]
+
+    def anterior(izquierda, derecha):
+        # allow_exact_matches=False asegura que no se vincule consigo mismo
+        return pd.merge_asof(izquierda, derecha, on='consecutivoevento', by='serialmediopago',
+                             direction='backward', allow_exact_matches=False)
+
+    vinculado = anterior(transbordos, madres).set_index('fila')
+    for objetivo in (0, 4, 8):
+        con_objetivo = transbordos[transbordos['objetivo'] == objetivo]
+        candidatas = madres[madres['numerotransbordos_madre'] == objetivo]
+        if con_objetivo.empty or candidatas.empty:
+            continue
+        especificas = anterior(con_objetivo, candidatas).set_index('fila')
+        especificas = especificas[especificas['consecutivoevento_madre'].notna()]
+        vinculado.loc[especificas.index, columnas] = especificas[columnas]
+
+    return pd.concat([df_transfers, vinculado.sort_index()[columnas].reset_index(drop=True)], axis=1)
+
+
+# ======================================================
+# SHARDS
+# ======================================================
+def _procesar_shard(base, query_historial, inicio, fin, df_transfers, vincular, motor):
+    """Trabajo de un shard: conexión propia, tabla temporal, historial y vinculación"""
+    marca = registro_consultas.marca()
+    tarjetas = df_transfers['serialmediopago'].unique().tolist()
+    conn = conectar(BASES[base], base)
+    try:
+        cur = conn.cursor()
+        cur.execute("CREATE TEMP TABLE tmp_target_cards (card_id BIGINT PRIMARY KEY);")
+        execute_values(cur, "INSERT INTO tmp_target_cards (card_id) VALUES %s", [(c,) for c in tarjetas])
+        df_history = leer_consulta("trx_historial", query_historial, conn, (inicio, fin), motor)
+    finally:
+        conn.close()
+    df_linked = vincular(df_transfers, df_history)
+    # Las consultas del proceso hijo se devuelven para el registro del proceso principal
+    return df_linked, df_history, registro_consultas.registros(marca)
+
+
+def extraer_y_vincular_por_shards(df_transfers, query_historial, inicio, fin, vincular=vincular_merge_asof,
+                                  n_shards=SHARDS_POR_DEFECTO, base="transacciones", motor=MOTOR_POR_DEFECTO):
+    """
+    Historial y vinculación en N shards por tarjeta, un proceso y una conexión por shard.
+    `query_historial` filtra por la tabla temporal tmp_target_cards y recibe $1/$2 = [inicio, fin).
+    `vincular(df_transfers, df_history)` debe ser una función de nivel de módulo.
+    Devuelve (df_linked, df_history).
+    """
+    shard = shard_de_tarjeta(df_transfers['serialmediopago'], n_shards)
+    partes = [df_transfers[shard == i] for i in range(n_shards)]
+    partes = [p for p in partes if not p.empty]
+
+    with ProcessPoolExecutor(max_workers=len(partes) or 1) as executor:
+        futures = [
+            executor.submit(_procesar_shard, base, query_historial, inicio, fin, parte, vincular, motor)
+            for parte in partes
+        ]
+        resultados = [f.result() for f in futures]
+
+    linked, history = [], []
+    for df_linked, df_history, registros in resultados:
+        linked.append(df_linked)
+        history.append(df_history)
+        for registro in registros:
+            registro_consultas.agregar(registro)
+
+    if not resultados:
+        return df_transfers.iloc[0:0], pd.DataFrame()
+    # Los shards sin filas (o sin historial) traen columnas object; se descartan
+    # o se reinfieren para conservar los tipos de la extracción
+    return (
+        pd.concat([df for df in linked if not df.empty] or linked[:1], ignore_index=True).infer_objects(),
+        pd.concat([df for df in history if not df.empty] or history[:1], ignore_index=True),
+    )